@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from utils.pipeline import runPipeline
+from utils.llmScheduler import setRequester
+from utils.llm import promptUsage
+from utils.modelRouter import getModelRouter
+from utils.telemetry import configureTelemetry, stageStats
+
+load_dotenv()
+
+# USD per million tokens, used for the cost column of the report. Prompt-cache
+# reads and writes are billed as a multiple of the input price.
+PRICE_INPUT_PER_MTOK = float(os.getenv("PRICE_INPUT_PER_MTOK", "3"))
+PRICE_OUTPUT_PER_MTOK = float(os.getenv("PRICE_OUTPUT_PER_MTOK", "15"))
+CACHE_READ_PRICE_FACTOR = 0.1
+CACHE_WRITE_PRICE_FACTOR = 1.25
+
+# Execution output kept per record; the full output can be long
+BATCH_OUTPUT_MAX_CHARS = int(os.getenv("BATCH_OUTPUT_MAX_CHARS", "4000"))
+
+
+# Stream items from the input JSONL one line at a time. An item is either a
+# JSON object (command from "command", "body", "prompt" or "title"; id from
+# "id" or "request_id") or a bare JSON string; the line number is the
+# fallback id.
+def readItems(path):
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"command": item}
+            command = item.get("command") or item.get("body") or item.get("prompt") or item.get("title")
+            yield str(item.get("id") or item.get("request_id") or number), command, item.get("context")
+
+
+# Ids already written to the output, so a restarted run picks up where it stopped
+def finishedIds(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as file:
+        for line in file:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                # A line cut short by a crash is simply redone
+                continue
+    return done
+
+
+def cost(usage):
+    inputTokens = (usage["inputTokens"] + usage["cacheReadTokens"] * CACHE_READ_PRICE_FACTOR
+                   + usage["cacheWriteTokens"] * CACHE_WRITE_PRICE_FACTOR)
+    return (inputTokens * PRICE_INPUT_PER_MTOK + usage["outputTokens"] * PRICE_OUTPUT_PER_MTOK) / 1_000_000
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+async def runItem(itemId, command, context, args, llmSlots, execSlots):
+    started = time.monotonic()
+    record = {"id": itemId, "command": command}
+    # Batch items yield the LLM to interactive use of the same process
+    setRequester("batch", background=True)
+    try:
+        pipeline = await runPipeline(command, context if context is not None else args.context,
+                                     analyze=not args.no_analysis, llmSlots=llmSlots, execSlots=execSlots)
+        record.update(pipeline.toDict())
+        record.pop("response")
+        if record["output"] and len(record["output"]) > BATCH_OUTPUT_MAX_CHARS:
+            record["output"] = record["output"][:BATCH_OUTPUT_MAX_CHARS] + "\n... [truncated]"
+    except Exception as error:
+        record.update({"success": False, "error": f"{type(error).__name__}: {error}"})
+    record["latency"] = time.monotonic() - started
+    if record.get("usage"):
+        record["cost"] = cost(record["usage"])
+    return record
+
+
+async def runBatch(args):
+    done = finishedIds(args.output)
+    llmSlots = asyncio.Semaphore(args.llm_concurrency or args.concurrency)
+    execSlots = asyncio.Semaphore(args.exec_concurrency or args.concurrency)
+    # Bounded so the input file is read only as fast as the workers take items
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    records = []
+
+    with open(args.output, "a") as output:
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                record = await runItem(*item, args, llmSlots, execSlots)
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                records.append(record)
+                status = "ok" if record["success"] else "FAILED"
+                print(f"[{len(records)}] {record['id']} {status} in {record['latency']:.1f}s", file=sys.stderr)
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        skipped = 0
+        for itemId, command, context in readItems(args.input):
+            if itemId in done:
+                skipped += 1
+                continue
+            if not command:
+                print(f"Skipping {itemId}: no command", file=sys.stderr)
+                continue
+            await queue.put((itemId, command, context))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    return records, skipped
+
+
+def report(records, skipped):
+    latencies = [record["latency"] for record in records]
+    succeeded = sum(1 for record in records if record["success"])
+    usages = [record["usage"] for record in records if record.get("usage")]
+    inputTokens = sum(usage["inputTokens"] for usage in usages)
+    outputTokens = sum(usage["outputTokens"] for usage in usages)
+    cacheRead = sum(usage["cacheReadTokens"] for usage in usages)
+    cacheWrite = sum(usage["cacheWriteTokens"] for usage in usages)
+    promptTokens = inputTokens + cacheRead + cacheWrite
+    lines = [
+        f"Processed: {len(records)} (skipped {skipped} already done)",
+        f"Succeeded: {succeeded}, failed: {len(records) - succeeded}",
+        f"Latency: p50 {percentile(latencies, 0.5):.1f}s, p95 {percentile(latencies, 0.95):.1f}s, max {max(latencies, default=0):.1f}s",
+        f"Tokens: {inputTokens} in, {cacheRead} cache read, {cacheWrite} cache write, {outputTokens} out",
+        f"Prompt cache hit rate: {cacheRead / promptTokens if promptTokens else 0:.1%}",
+        f"Cost: ${sum(record.get('cost', 0) for record in records):.4f}",
+    ]
+    for name, quantiles in sorted(stageStats().items()):
+        lines.append(f"  {name}: " + ", ".join(f"{q} {value:.2f}s" for q, value in quantiles.items()))
+    for label, usage in promptUsage().items():
+        lines.append(f"  {label}: {usage['calls']} calls, cache hit rate {usage['cacheHitRate']:.1%}")
+    for name, route in getModelRouter().stats().items():
+        success = "" if route["successRate"] is None else f", code success {route['successRate']:.1%}"
+        lines.append(f"  {name} ({route['model']}): {route['calls']} calls, {route['errors']} errors{success}, "
+                     f"p50 {route.get('p50', 0):.2f}s, p90 {route.get('p90', 0):.2f}s")
+    print("\n".join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate, execute, correct and summarize every command of a JSONL file")
+    parser.add_argument("input", help="JSONL file with one command per line")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file results are appended to; finished ids are skipped on restart")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")), help="commands processed at once")
+    parser.add_argument("--llm-concurrency", type=int, default=None, help="LLM calls in flight at once (default: --concurrency)")
+    parser.add_argument("--exec-concurrency", type=int, default=None, help="code executions at once (default: --concurrency)")
+    parser.add_argument("--context", default=os.getenv("ADDITIONAL_CONTEXT"), help="Additional Context for items without their own")
+    parser.add_argument("--no-analysis", action="store_true", help="skip the LLM summary of each output")
+    args = parser.parse_args()
+    configureTelemetry()
+    records, skipped = asyncio.run(runBatch(args))
+    report(records, skipped)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tracemalloc
+
+# The pipeline reads its model settings at import time; the fake LLM ignores them
+os.environ.setdefault("ANTHROPIC_MODEL", "fake-model")
+os.environ.setdefault("MODEL_MAX_TOKENS", "4096")
+os.environ.setdefault("MODEL_TEMPERATURE", "0")
+# Cached responses and stored runs would turn every repeat into a cache hit
+os.environ["RESPONSE_CACHE_ENABLED"] = "False"
+
+from utils.clients import setAnthropicClient
+from utils.executor import setExecutor, AsyncExecutor
+from utils.fakes import FakeAnthropic, FakeExecutor
+from utils.pipeline import runPipeline
+from utils.modelRouter import getModelRouter
+from utils.llmScheduler import getLlmScheduler
+from utils.telemetry import stageStats
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Metrics compared against a baseline, and whether higher is better
+COMPARED = {
+    "throughput": True,
+    "latency.p50": False,
+    "latency.p95": False,
+    "latency.p99": False,
+    "peakMemoryMb": False,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Drive `requests` commands through the whole pipeline (generation, execution,
+# the correction loop and the analysis), `concurrency` at a time
+async def runBenchmark(args):
+    setAnthropicClient(FakeAnthropic(latency=args.llm_latency, failureRate=args.failure_rate,
+                                     outputSize=args.output_size, packages=args.packages, seed=args.seed))
+    if args.executor == "local":
+        setExecutor(AsyncExecutor(maxWorkers=args.concurrency * 2, local=True))
+    else:
+        setExecutor(FakeExecutor(latency=args.exec_latency, outputSize=args.output_size,
+                                 installLatency=args.install_latency, slots=args.sandboxes, seed=args.seed))
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, successes, attempts, tokens = [], 0, 0, 0
+
+    async def one(index):
+        nonlocal successes, attempts, tokens
+        async with slots:
+            started = time.monotonic()
+            pipeline = await runPipeline(f"Benchmark request {args.seed}-{index}", context="benchmark",
+                                         analyze=not args.no_analysis)
+            latencies.append(time.monotonic() - started)
+            successes += pipeline.success
+            attempts += pipeline.attempts
+            tokens += pipeline.usage.totalTokens
+
+    tracemalloc.start()
+    started = time.monotonic()
+    await asyncio.gather(*(one(index) for index in range(args.requests)))
+    elapsed = time.monotonic() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "config": {name: value for name, value in vars(args).items() if name not in ("save_baseline", "compare")},
+        "python": platform.python_version(),
+        "requests": args.requests,
+        "seconds": elapsed,
+        "throughput": args.requests / elapsed if elapsed else 0.0,
+        "latency": {f"p{int(q * 100)}": percentile(latencies, q) for q in (0.5, 0.95, 0.99)},
+        "successRate": successes / args.requests if args.requests else 0.0,
+        "repairAttempts": attempts,
+        "tokens": tokens,
+        "peakMemoryMb": peak / 1024 / 1024,
+        "maxRssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None,
+        "stages": stageStats(),
+        "routes": getModelRouter().stats(),
+        "llmScheduler": getLlmScheduler().stats(),
+    }
+
+
+def lookup(results, path):
+    for part in path.split("."):
+        results = results[part]
+    return results
+
+
+# Print metric deltas against a saved baseline; returns the regressions that
+# exceed `tolerance` (a fraction, 0.1 = 10%)
+def compare(results, baseline, tolerance):
+    regressions = []
+    for path, higherIsBetter in COMPARED.items():
+        current, previous = lookup(results, path), lookup(baseline, path)
+        if not previous:
+            continue
+        change = (current - previous) / previous
+        worse = -change if higherIsBetter else change
+        flag = "REGRESSION" if worse > tolerance else ""
+        print(f"  {path:14} {previous:10.3f} -> {current:10.3f} ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(path)
+    return regressions
+
+
+def report(results):
+    latency = results["latency"]
+    print(f"Requests: {results['requests']} in {results['seconds']:.2f}s ({results['throughput']:.2f}/s)")
+    print(f"Latency: p50 {latency['p50']:.3f}s, p95 {latency['p95']:.3f}s, p99 {latency['p99']:.3f}s")
+    print(f"Success rate: {results['successRate']:.1%}, repair attempts: {results['repairAttempts']}, tokens: {results['tokens']}")
+    memory = f"Peak traced memory: {results['peakMemoryMb']:.1f} MB"
+    if results["maxRssMb"] is not None:
+        memory += f", max RSS {results['maxRssMb']:.1f} MB"
+    print(memory)
+    for name, quantiles in sorted(results["stages"].items()):
+        print(f"  {name}: " + ", ".join(f"{q} {value:.3f}s" for q, value in quantiles.items()))
+    for name, route in results["routes"].items():
+        success = "" if route["successRate"] is None else f", code success {route['successRate']:.1%}"
+        print(f"  route {name} ({route['model']}): {route['calls']} calls{success}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against fake LLM and sandbox backends")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM response")
+    parser.add_argument("--exec-latency", type=float, default=0.3, help="seconds per fake sandbox run")
+    parser.add_argument("--failure-rate", type=float, default=0.3, help="share of generated code that fails")
+    parser.add_argument("--output-size", type=int, default=200, help="bytes of output per successful run")
+    parser.add_argument("--packages", default=None, help="pip packages the fake LLM asks for, e.g. requests")
+    parser.add_argument("--install-latency", type=float, default=0.0, help="seconds per fake package install")
+    parser.add_argument("--sandboxes", type=int, default=4, help="fake sandboxes that can run at once")
+    parser.add_argument("--executor", choices=("fake", "local"), default="fake",
+                        help="fake sandbox, or run the generated code with the local runner")
+    parser.add_argument("--no-analysis", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a baseline and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression before failing (fraction)")
+    args = parser.parse_args()
+
+    results = asyncio.run(runBenchmark(args))
+    report(results)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"Compared with {args.compare}:")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
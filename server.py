@@ -0,0 +1,198 @@
+import os
+import json
+import signal
+import asyncio
+import argparse
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from dotenv import load_dotenv
+from utils.jobQueue import JobQueue, QueueFull
+from utils.sessions import getSessionManager
+from utils.llmScheduler import getLlmScheduler
+from utils.telemetry import configureTelemetry, registry
+
+load_dotenv()
+
+SERVICE_MAX_BODY_BYTES = int(os.getenv("SERVICE_MAX_BODY_BYTES", str(1024 * 1024)))
+SERVICE_READ_TIMEOUT_SECONDS = float(os.getenv("SERVICE_READ_TIMEOUT_SECONDS", "30"))
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+async def readRequest(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= 100:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Too many headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > SERVICE_MAX_BODY_BYTES:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Body larger than {SERVICE_MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), body
+
+
+def head(writer, status, contentType, headers=None, length=None):
+    status = HTTPStatus(status)
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {contentType}", "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+
+def respond(writer, status, body, headers=None):
+    data = (json.dumps(body, default=str) + "\n").encode()
+    head(writer, status, "application/json", headers, len(data))
+    writer.write(data)
+
+
+# HTTP front end for the job queue; one request per connection.
+#
+#   POST   /jobs               {"command": ..., "context": ..., "analyze": true, "session": ..., "reuse": false}
+#                              -> 202 job, or 429 with Retry-After when the queue is full;
+#                              jobs with the same "session" share one Python session;
+#                              "reuse": true accepts a stored result of an identical earlier job
+#   GET    /jobs/<id>          job status, and the pipeline result once it is done
+#   GET    /jobs/<id>/events   newline-delimited JSON events (stages, streamed text,
+#                              execution output, "done") until the job finishes; ?after=<seq>
+#                              resumes after the last event a client saw
+#   DELETE /jobs/<id>          cancel a queued or running job
+#   GET    /health             queue and LLM scheduler statistics; 503 while shutting down
+#   GET    /metrics            Prometheus metrics
+class JobServer:
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(readRequest(reader), SERVICE_READ_TIMEOUT_SECONDS)
+            if request is not None:
+                await self.dispatch(writer, *request)
+        except HttpError as error:
+            respond(writer, error.status, {"error": str(error)}, error.headers)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as error:
+            respond(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(error).__name__}: {error}"})
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def dispatch(self, writer, method, path, query, body):
+        parts = path.strip("/").split("/")
+        if path == "/health" and method == "GET":
+            status = HTTPStatus.OK if self.queue.accepting else HTTPStatus.SERVICE_UNAVAILABLE
+            return respond(writer, status, {**self.queue.stats(), "llm": getLlmScheduler().stats()})
+        if path == "/metrics" and method == "GET":
+            data = registry.render().encode()
+            head(writer, HTTPStatus.OK, "text/plain; version=0.0.4", length=len(data))
+            return writer.write(data)
+        if path == "/jobs" and method == "POST":
+            return self.submit(writer, body)
+        if parts[0] == "jobs" and len(parts) in (2, 3):
+            job = self.queue.get(parts[1])
+            if job is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, "No such job")
+            if len(parts) == 3 and parts[2] == "events" and method == "GET":
+                after = query.get("after", ["0"])[0]
+                if not after.isdigit():
+                    raise HttpError(HTTPStatus.BAD_REQUEST, "\"after\" must be an event seq number")
+                return await self.stream(writer, job, int(after))
+            if len(parts) == 2 and method == "GET":
+                return respond(writer, HTTPStatus.OK, job.toDict())
+            if len(parts) == 2 and method == "DELETE":
+                cancelled = self.queue.cancel(job)
+                return respond(writer, HTTPStatus.ACCEPTED if cancelled else HTTPStatus.CONFLICT,
+                               {"id": job.id, "status": job.status, "cancelled": cancelled})
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No route for {method} {path}")
+
+    def submit(self, writer, body):
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Body is not JSON")
+        command = payload.get("command") if isinstance(payload, dict) else None
+        if not isinstance(command, str) or not command.strip():
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Missing \"command\"")
+        session = payload.get("session")
+        if session is not None and not isinstance(session, str):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "\"session\" must be a string")
+        reuse = payload.get("reuse", False)
+        if not isinstance(reuse, bool):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "\"reuse\" must be true or false")
+        try:
+            job = self.queue.submit(command, payload.get("context", os.getenv("ADDITIONAL_CONTEXT")),
+                                    analyze=payload.get("analyze", True) is not False, session=session,
+                                    reuse=reuse)
+        except QueueFull as error:
+            raise HttpError(HTTPStatus.TOO_MANY_REQUESTS, str(error), {"Retry-After": str(error.retryAfter)})
+        respond(writer, HTTPStatus.ACCEPTED, job.toDict(), {"Location": f"/jobs/{job.id}"})
+
+    # Close-delimited NDJSON: one event per line, flushed as it happens
+    async def stream(self, writer, job, after):
+        head(writer, HTTPStatus.OK, "application/x-ndjson", {"Cache-Control": "no-cache"})
+        async for event in job.follow(after):
+            writer.write((json.dumps(event, default=str) + "\n").encode())
+            await writer.drain()
+
+
+async def serve(args):
+    configureTelemetry()
+    llmSlots = asyncio.Semaphore(args.llm_concurrency) if args.llm_concurrency else None
+    execSlots = asyncio.Semaphore(args.exec_concurrency) if args.exec_concurrency else None
+    queue = JobQueue(workers=args.workers, maxQueued=args.queue_size, llmSlots=llmSlots, execSlots=execSlots,
+                     maxJobs=int(os.getenv("SERVICE_MAX_JOBS", "1000")),
+                     ttl=float(os.getenv("SERVICE_JOB_TTL_SECONDS", "3600"))).start()
+    server = await asyncio.start_server(JobServer(queue).handle, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers, queue of {args.queue_size}")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    async with server:
+        await stopping.wait()
+        # New jobs get 429 while the running ones finish
+        await queue.stop(grace=args.shutdown_grace)
+        getSessionManager().closeAll()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the generate/execute/correct/analyze pipeline as HTTP jobs")
+    parser.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVICE_WORKERS", "4")), help="jobs run at once on this node")
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv("SERVICE_QUEUE_SIZE", "16")), help="jobs waiting before 429")
+    parser.add_argument("--llm-concurrency", type=int, default=None, help="LLM calls in flight at once (default: unbounded)")
+    parser.add_argument("--exec-concurrency", type=int, default=None, help="code executions at once (default: unbounded)")
+    parser.add_argument("--shutdown-grace", type=float, default=30, help="seconds running jobs get to finish on shutdown")
+    args = parser.parse_args()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+# The modules read their settings from the environment on import; tests run
+# against the fake backends and keep nothing on disk between runs
+_scratch = tempfile.mkdtemp(prefix="genly-tests-")
+os.environ.update(
+    PACKAGE_CACHE_DIR=os.path.join(_scratch, "packages"),
+    ARTIFACT_STORE_DIR=os.path.join(_scratch, "artifacts"),
+    LLM_BACKEND="fake",
+    EXECUTOR_BACKEND="fake",
+    RESPONSE_CACHE_ENABLED="False",
+    ANTHROPIC_MODEL="test-model",
+    MODEL_MAX_TOKENS="1000",
+    MODEL_TEMPERATURE="0",
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from utils.clients import setAnthropicClient  # noqa: E402
+from utils.executor import setExecutor  # noqa: E402
+from utils.fakes import FakeAnthropic, FakeExecutor  # noqa: E402
+
+
+# Fast fake LLM and sandbox for the whole process; tests adjust them as needed
+@pytest.fixture
+def fakeBackends():
+    client = FakeAnthropic(latency=0.01, jitter=0, failureRate=0)
+    executor = FakeExecutor(latency=0.01, jitter=0)
+    setAnthropicClient(client)
+    setExecutor(executor)
+    yield client, executor
+    setAnthropicClient(None)
+    setExecutor(None)
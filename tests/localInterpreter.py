@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+from types import SimpleNamespace
+
+
+# Stand-in for e2b.CodeInterpreter that runs code with this interpreter in a
+# subprocess. Each instance gets its own home directory, and its own /tmp so
+# the pool's baseline and reset scripts run for real without touching the
+# machine's. Packages are only recorded.
+class LocalInterpreter:
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix="genly-interpreter-")
+        self.home = os.path.join(self.root, "home")
+        self.tmp = os.path.join(self.root, "tmp")
+        os.makedirs(self.home)
+        os.makedirs(self.tmp)
+        self.is_open = True
+        self.runs = []
+        self.installs = []
+
+    def run_python(self, code, timeout=None, env_vars=None, on_stdout=None, on_stderr=None, on_exit=None):
+        if not self.is_open:
+            raise RuntimeError("Sandbox is closed")
+        self.runs.append(code)
+        process = subprocess.Popen([sys.executable, "-u", "-c", code.replace("/tmp/", self.tmp + "/")],
+                                   cwd=self.home, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   env=dict(os.environ, HOME=self.home, **(env_vars or {})))
+        output = {"stdout": [], "stderr": []}
+
+        def read(stream, pipe, callback):
+            for line in pipe:
+                output[stream].append(line)
+                if callback is not None:
+                    callback(SimpleNamespace(line=line.rstrip("\n")))
+
+        readers = [threading.Thread(target=read, args=("stdout", process.stdout, on_stdout)),
+                   threading.Thread(target=read, args=("stderr", process.stderr, on_stderr))]
+        for reader in readers:
+            reader.start()
+        process.wait(timeout)
+        for reader in readers:
+            reader.join()
+        if on_exit is not None:
+            on_exit(process.returncode)
+        return "".join(output["stdout"]), "".join(output["stderr"]), []
+
+    def install_python_packages(self, packages):
+        self.installs.append(packages)
+
+    def close(self):
+        self.is_open = False
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,63 @@
+import io
+import os
+import pytest
+from PIL import Image
+from utils.artifactStore import ArtifactStore, ArtifactTooLarge
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_identical_files_are_stored_once(tmp_path):
+    store = ArtifactStore(str(tmp_path), chunkSize=4)
+    first = store.ingestBytes(b"a,b\n1,2\n", "artifacts/table.csv")
+    second = store.ingestBytes(b"a,b\n1,2\n", "copy.csv")
+    assert first.digest == second.digest and first.name == "table.csv"
+    assert first.read() == b"a,b\n1,2\n" and first.size == 8
+    assert first.mimeType == "text/csv"
+    assert store.stats() == {"stored": 1, "deduplicated": 1, "rejected": 0}
+
+
+def test_files_over_the_limit_are_rejected_while_streaming(tmp_path):
+    store = ArtifactStore(str(tmp_path), maxBytes=10)
+    chunks = []
+
+    def source():
+        for chunk in (b"x" * 6, b"x" * 6, b"x" * 6):
+            chunks.append(chunk)
+            yield chunk
+
+    with pytest.raises(ArtifactTooLarge):
+        store.ingest(source(), "big.bin")
+    # It stops reading at the chunk that crossed the limit and keeps nothing
+    assert len(chunks) == 2
+    assert os.listdir(os.path.join(str(tmp_path), "tmp")) == []
+    assert store.stats()["rejected"] == 1
+
+
+def test_least_recently_used_objects_are_evicted(tmp_path):
+    store = ArtifactStore(str(tmp_path), maxTotalBytes=25)
+    old = store.ingestBytes(b"1" * 10, "old.txt")
+    used = store.ingestBytes(b"2" * 10, "used.txt")
+    os.utime(old.path, (1, 1))
+    os.utime(used.path, (2, 2))
+    # Ingesting the same content again counts as a use
+    store.ingestBytes(b"1" * 10, "old-again.txt")
+    store.ingestBytes(b"3" * 10, "new.txt")
+    assert os.path.exists(old.path) and not os.path.exists(used.path)
+
+
+def test_thumbnails_are_small_pngs_and_evicted_with_their_image(tmp_path):
+    store = ArtifactStore(str(tmp_path), thumbnailSize=32, maxTotalBytes=len(png(600, 300)) + 10)
+    chart = store.ingestBytes(png(600, 300), "chart.png")
+    assert chart.isImage and chart.mimeType == "image/png"
+    with Image.open(io.BytesIO(chart.thumbnail())) as thumbnail:
+        assert thumbnail.size == (32, 16)
+    assert os.path.exists(store.thumbnailPath(chart.digest))
+    assert store.ingestBytes(b"plain text", "notes.txt").thumbnail() is None
+    os.utime(chart.path, (1, 1))
+    store.ingestBytes(png(601, 300), "other.png")
+    assert not os.path.exists(chart.path) and not os.path.exists(store.thumbnailPath(chart.digest))
@@ -0,0 +1,41 @@
+import asyncio
+from utils import clients
+from utils.clients import getAsyncHttpClient
+from utils.fakes import FakeAnthropic
+from utils.genlyStub import GenlyStubServer
+
+
+def test_async_http_client_outlives_each_event_loop():
+    async def post(url):
+        client = getAsyncHttpClient()
+        response = await client.post(url + "/generate-provider-recommendations", content='{"commands": ["a"]}')
+        return client, response.json()
+
+    with GenlyStubServer() as stub:
+        # Streamlit runs every rerun under a new asyncio.run
+        first, body = asyncio.run(post(stub.url))
+        second, _ = asyncio.run(post(stub.url))
+    assert first is second
+    assert body["recommendations"][0]["command"] == "a"
+    assert not first.loop.is_closed()
+
+
+def test_streams_run_on_the_client_loop():
+    loops = []
+
+    class Recording(FakeAnthropic):
+        def stream(self, **kwargs):
+            loops.append(asyncio.get_running_loop())
+            return super().stream(**kwargs)
+
+    client = clients._LoopClient(Recording(latency=0.01, jitter=0), clients._clientLoop())
+
+    async def ask():
+        async with client.messages.stream(messages=[{"role": "user", "content": "Summary: hi"}]) as stream:
+            text = "".join([chunk async for chunk in stream.text_stream])
+            return text, await stream.get_final_message()
+
+    for _ in range(2):
+        text, message = asyncio.run(ask())
+        assert message.content[0].text == text
+    assert loops == [client.loop, client.loop]
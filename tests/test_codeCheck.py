@@ -0,0 +1,47 @@
+import ast
+import pytest
+from utils import codeCheck
+from utils.codeCheck import checkCode, requiredDistributions
+
+
+# Whatever this interpreter has installed, treat every import as missing
+@pytest.fixture(autouse=True)
+def nothingInstalled(monkeypatch):
+    monkeypatch.setattr(codeCheck, "_installed", lambda module: False)
+
+
+def test_unknown_imports_are_their_own_distribution():
+    tree = ast.parse("import os\nimport cv2\nimport surely_not_a_module\nimport google.cloud.storage\n"
+                     "import google.surely_not_a_module\nfrom sklearn import svm\n")
+    assert requiredDistributions(tree) == ["opencv-python", "surely-not-a-module", "google-cloud-storage",
+                                           "scikit-learn"]
+
+
+def test_installed_modules_come_from_the_caller():
+    tree = ast.parse("import cv2\nimport requests\n")
+    assert requiredDistributions(tree, lambda module: module == "requests") == ["opencv-python"]
+
+
+def test_distributions_from_the_environment(monkeypatch):
+    monkeypatch.setenv("IMPORT_DISTRIBUTIONS", "surely_not_a_module=internal-sdk")
+    assert requiredDistributions(ast.parse("import surely_not_a_module.client\n")) == ["internal-sdk"]
+
+
+def test_pip_block_keeps_its_own_specs():
+    packages, failure = checkCode("import requests\nimport cv2\n", "requests==2.31")
+    assert failure is None
+    assert packages == "pip install requests==2.31 opencv-python"
+
+
+def test_the_same_code_is_checked_once():
+    def checks():
+        return codeCheck.checkCount._values.get((("outcome", "ok"),), 0)
+    before = checks()
+    first = checkCode("import cv2\nprint('checked once')\n", None)
+    assert checkCode("import cv2\nprint('checked once')\n", None) is first
+    assert checks() == before + 1
+
+
+def test_syntax_errors_fail_before_running():
+    _, failure = checkCode("print(\n", None)
+    assert failure.failed and failure.exceptionType == "SyntaxError"
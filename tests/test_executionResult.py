@@ -0,0 +1,68 @@
+from utils.executionResult import ExecutionResult
+
+TRACEBACK = '''Traceback (most recent call last):
+  File "/tmp/main.py", line 12, in <module>
+    main()
+  File "/tmp/main.py", line 8, in main
+    response = fetch(url)
+KeyError: 'items'
+'''
+
+
+def test_clean_run_is_not_a_failure():
+    result = ExecutionResult("done\n", "", exitCode=0)
+    assert not result.failed
+    assert result.exceptionType is None
+
+
+def test_traceback_is_parsed_once():
+    result = ExecutionResult("partial output\n", TRACEBACK, exitCode=1)
+    assert result.failed
+    assert result.exceptionType == "KeyError"
+    assert result.exceptionMessage == "'items'"
+    assert [(frame.line, frame.function) for frame in result.frames] == [(12, "<module>"), (8, "main")]
+    assert result.frames[-1].source == "response = fetch(url)"
+
+
+def test_failure_markers_in_stdout():
+    result = ExecutionResult("Failed to retrieve playlists. Status code: 401\n", "", exitCode=0)
+    assert result.failed
+    assert result.markers == ["Failed to retrieve", "Status code:"]
+
+
+def test_nonzero_exit_and_timeout_fail_without_output():
+    assert ExecutionResult(exitCode=2).failed
+    assert ExecutionResult(timedOut=True).failed
+
+
+def test_benign_stderr_progress_is_not_a_failure():
+    assert not ExecutionResult("ok\n", "Installation completed\n", exitCode=0).failed
+    assert ExecutionResult("ok\n", "warning: something broke\n", exitCode=0).failed
+
+
+def test_syntax_error_without_traceback_header():
+    stderr = '  File "main.py", line 3\n    print("x"\n         ^\nSyntaxError: \'(\' was never closed\n'
+    result = ExecutionResult("", stderr, exitCode=1)
+    assert result.exceptionType == "SyntaxError"
+    assert result.frames[0].line == 3
+
+
+def test_fingerprint_ignores_line_numbers_but_not_the_exception():
+    moved = ExecutionResult("", TRACEBACK.replace("line 8", "line 9"), exitCode=1)
+    other = ExecutionResult("", TRACEBACK.replace("KeyError", "ValueError"), exitCode=1)
+    result = ExecutionResult("", TRACEBACK, exitCode=1)
+    assert result.fingerprint() == moved.fingerprint()
+    assert result.fingerprint() != other.fingerprint()
+
+
+def test_digest_keeps_the_exception_within_budget():
+    result = ExecutionResult("x" * 50000 + "\n", TRACEBACK, exitCode=1)
+    digest = result.digest(maxTokens=200)
+    assert "Exception: KeyError: 'items'" in digest
+    assert "characters omitted" in digest
+    assert len(digest) <= 200 * 4 + 100
+
+
+def test_unpacks_like_the_old_tuple():
+    stdout, stderr, artifacts = ExecutionResult("out", "err")
+    assert (stdout, stderr, artifacts) == ("out", "err", [])
@@ -0,0 +1,117 @@
+import time
+import asyncio
+from types import SimpleNamespace
+import pytest
+from localInterpreter import LocalInterpreter
+from utils import executor as executorModule
+from utils.executor import AsyncExecutor
+from utils.outputStream import OutputStream
+from utils.sandboxPool import SandboxPool
+
+
+@pytest.fixture
+def sandboxes(monkeypatch):
+    def use(factory=LocalInterpreter, **kwargs):
+        pool = SandboxPool(factory, **dict(dict(minSize=0, maxSize=1, maintenanceInterval=60), **kwargs))
+        monkeypatch.setattr(executorModule, "getSandboxPool", lambda: pool)
+        created.append(pool)
+        return pool
+
+    created = []
+    yield use
+    for pool in created:
+        pool.close()
+
+
+def run(code, packages=None, timeout=10, **kwargs):
+    return asyncio.run(AsyncExecutor(**kwargs).run(code, packages, timeout, output=OutputStream()))
+
+
+def test_runs_code_in_a_pooled_sandbox(sandboxes):
+    pool = sandboxes()
+    result = run("print('hello')")
+    assert not result.failed and result.exitCode == 0
+    assert result.stdout == "hello\n"
+    assert pool.stats()["size"] == 1
+
+
+def test_sdk_timeout_is_a_timed_out_result(sandboxes):
+    class TimeoutException(Exception):
+        pass
+
+    class Slow(LocalInterpreter):
+        def run_python(self, code, **kwargs):
+            if code.startswith("\nimport os, json"):
+                return super().run_python(code, **kwargs)
+            raise TimeoutException("Request timed out")
+
+    pool = sandboxes(Slow)
+    result = run("print('x')")
+    assert result.timedOut and result.failed
+    assert "timed out" in result.stderr
+    # The sandbox is not trusted again
+    assert pool.stats()["size"] == 0
+
+
+def test_sdk_errors_are_failed_results(sandboxes):
+    class Lost(LocalInterpreter):
+        def run_python(self, code, **kwargs):
+            if code.startswith("\nimport os, json"):
+                return super().run_python(code, **kwargs)
+            raise ConnectionError("sandbox went away")
+
+    sandboxes(Lost)
+    result = run("print('x')")
+    assert result.exitCode == 1
+    assert "ConnectionError: sandbox went away" in result.stderr
+
+
+def test_artifact_download_errors_are_failed_results(sandboxes):
+    class Unreachable:
+        name = "/home/user/artifacts/chart.png"
+
+        def download(self):
+            raise OSError("connection reset")
+
+    class WithArtifact(LocalInterpreter):
+        def run_python(self, code, **kwargs):
+            stdout, stderr, _ = super().run_python(code, **kwargs)
+            return stdout, stderr, [Unreachable()]
+
+    sandboxes(WithArtifact)
+    result = run("print('drawn')")
+    assert result.failed and result.exitCode == 1
+    assert result.stdout == "drawn\n"
+    assert "Downloading the artifacts failed: connection reset" in result.stderr
+
+
+def test_run_stopped_after_a_traceback_has_an_exit_code(sandboxes):
+    sandboxes()
+    started = time.monotonic()
+    result = run("import time\nimport sys\ntry:\n    1 / 0\nexcept Exception:\n    import traceback; traceback.print_exc()\n"
+                 "sys.stderr.flush()\ntime.sleep(5)", tracebackGrace=0.2)
+    assert time.monotonic() - started < 4
+    assert result.exceptionType == "ZeroDivisionError"
+    assert result.exitCode
+
+
+def test_unknown_packages_are_left_out_and_a_full_pool_is_a_failed_result(sandboxes):
+    class NoPackage(LocalInterpreter):
+        def install_python_packages(self, packages):
+            super().install_python_packages(packages)
+            if "nothing-at-all" in packages:
+                raise Exception(f"Failed to install package {packages}: not found")
+
+    pool = sandboxes(NoPackage)
+    result = run("import nothing_at_all", "pip install nothing-at-all six")
+    # The code ran anyway and its ImportError is for the correction
+    assert result.exceptionType == "ModuleNotFoundError"
+    # The sandbox is fine and goes back to the pool
+    assert pool.stats()["size"] == 1
+
+    entry = pool.acquire()
+    assert entry.sandbox.installs[-2:] == ["nothing-at-all", "six"]
+    pool.acquireTimeout = 0.1
+    result = run("print('x')")
+    assert result.exitCode == 1 and "No sandbox available" in result.stderr
+    pool.release(entry, reset=False)
@@ -0,0 +1,40 @@
+import asyncio
+from utils.fenceParser import FenceParser
+from utils.fakes import FakeAnthropic
+from utils.llm import streamMessage, replayText
+from utils.pipeline import parse_response
+
+RESPONSE = "Install first:\n```pip\npip install requests\n```\nThen run:\n```python\nimport requests\nprint(1)\n```\nDone."
+
+
+def test_blocks_close_as_soon_as_their_fence_arrives():
+    parser = FenceParser()
+    closed = [parser.feed(RESPONSE[start:start + 3]) for start in range(0, len(RESPONSE), 3)]
+    blocks = [block for chunk in closed for block in chunk]
+    assert blocks == [("pip", "pip install requests"), ("python", "import requests\nprint(1)")]
+    # The pip block is out long before the response is complete
+    pipAt = next(index for index, chunk in enumerate(closed) if chunk)
+    assert pipAt * 3 < RESPONSE.index("```python")
+    assert parser.first("python") == "import requests\nprint(1)"
+    assert parser.unclosed() is None
+
+
+def test_a_cut_off_block_is_reported_as_unclosed():
+    parser = FenceParser()
+    parser.feed("```python\nprint(1)\npri")
+    assert parser.blocks == []
+    assert parser.unclosed() == ("python", "print(1)\npri")
+
+
+def test_streamed_and_replayed_text_give_the_same_callbacks():
+    client = FakeAnthropic(latency=0.01, jitter=0, failureRate=0, packages="pandas", chunks=20)
+    streamed, fences = [], []
+    message = asyncio.run(streamMessage(client, onText=streamed.append, onFence=lambda *block: fences.append(block),
+                                        model="test-model", max_tokens=100,
+                                        messages=[{"role": "user", "content": "print something"}]))
+    text = message.content[0].text
+    assert "".join(streamed) == text and len(streamed) > 1
+    replayed = []
+    replayText(text, onFence=lambda *block: replayed.append(block))
+    assert fences == replayed == [("pip", "pip install pandas"), ("python", "print('x' * 200)")]
+    assert parse_response(text) == ("print('x' * 200)", "pip install pandas")
@@ -0,0 +1,111 @@
+import time
+import asyncio
+import pytest
+from utils.genlyApi import AsyncGenlyApi, GenlyApiError, PreferenceCommand
+from utils.genlyStub import GenlyStubServer
+
+
+def preferences(command="Add new songs to my playlist", category="Entertainment", providers=("Spotify", "Youtube")):
+    return [PreferenceCommand(command, category, list(providers))]
+
+
+def test_summary_is_built_from_all_preferences_in_one_call():
+    with GenlyStubServer() as stub:
+        api = AsyncGenlyApi(stub.url, channelId="channel")
+        commands = preferences() + preferences("Add new contacts to my CRM system", "CRM", ["HubSpot"])
+        summary = asyncio.run(api.generatePreferredTaskSummary(commands))
+    assert len(stub.requests) == 1
+    assert "1. Add new songs to my playlist" in summary
+    assert "2. Add new contacts to my CRM system" in summary
+    assert stub.requests[0][1]["channelID"] == "channel"
+
+
+def test_retries_failed_requests():
+    with GenlyStubServer(failures=2) as stub:
+        api = AsyncGenlyApi(stub.url, retries=3, backoff=0.01)
+        summary = asyncio.run(api.generatePreferredTaskSummary(preferences()))
+    assert len(stub.requests) == 3
+    assert "Add new songs" in summary
+
+
+def test_honours_retry_after():
+    with GenlyStubServer(failures=1, retryAfter=0.3) as stub:
+        api = AsyncGenlyApi(stub.url, retries=1, backoff=0.01)
+        started = time.monotonic()
+        asyncio.run(api.generatePreferredTaskSummary(preferences()))
+    assert time.monotonic() - started >= 0.3
+    assert len(stub.requests) == 2
+
+
+def test_gives_up_after_the_last_retry():
+    with GenlyStubServer(failures=5) as stub:
+        api = AsyncGenlyApi(stub.url, retries=2, backoff=0.01)
+        with pytest.raises(GenlyApiError):
+            asyncio.run(api.generatePreferredTaskSummary(preferences()))
+    assert len(stub.requests) == 3
+
+
+def test_coalesces_concurrent_identical_requests():
+    async def main(api):
+        # Spacing, letter case and provider order do not make a request different
+        return await asyncio.gather(
+            api.generatePreferredTaskSummary(preferences()),
+            api.generatePreferredTaskSummary(preferences("Add new  songs to my playlist", "entertainment",
+                                                         ("youtube", "Spotify"))),
+            api.generatePreferredTaskSummary(preferences()),
+        )
+
+    with GenlyStubServer(delay=0.2) as stub:
+        api = AsyncGenlyApi(stub.url)
+        summaries = asyncio.run(main(api))
+    assert len(stub.requests) == 1
+    assert len(set(summaries)) == 1
+
+
+def test_caches_summaries_until_the_ttl_expires():
+    with GenlyStubServer() as stub:
+        api = AsyncGenlyApi(stub.url, cacheTtl=0.2)
+        asyncio.run(api.generatePreferredTaskSummary(preferences()))
+        asyncio.run(api.generatePreferredTaskSummary(preferences()))
+        assert len(stub.requests) == 1
+        time.sleep(0.3)
+        asyncio.run(api.generatePreferredTaskSummary(preferences()))
+    assert len(stub.requests) == 2
+
+
+def test_summaries_of_many_lists_come_in_one_call():
+    lists = [preferences(), preferences("Add new contacts", "CRM", ["HubSpot"]), preferences()]
+    with GenlyStubServer() as stub:
+        api = AsyncGenlyApi(stub.url)
+        summaries = asyncio.run(api.generatePreferredTaskSummaries(lists))
+        # Both are cached now
+        asyncio.run(api.generatePreferredTaskSummary(lists[1]))
+    assert [path for path, _ in stub.requests] == ["/process-preferred-task-summaries"]
+    assert len(stub.requests[0][1]["batches"]) == 2
+    assert summaries[0] == summaries[2]
+    assert "Add new contacts" in summaries[1]
+
+
+def test_summaries_without_a_batch_endpoint_fetch_each_distinct_list_once():
+    lists = [preferences(), preferences("Add new contacts", "CRM", ["HubSpot"]), preferences()]
+    with GenlyStubServer(batching=False) as stub:
+        api = AsyncGenlyApi(stub.url)
+        summaries = asyncio.run(api.generatePreferredTaskSummaries(lists))
+        asyncio.run(api.generatePreferredTaskSummaries([preferences("A"), preferences("B")]))
+    paths = [path for path, _ in stub.requests]
+    # The missing endpoint is only tried once
+    assert paths.count("/process-preferred-task-summaries") == 1
+    assert paths.count("/process-preferred-task-summary") == 4
+    assert summaries[0] == summaries[2]
+    assert "Add new contacts" in summaries[1]
+
+
+def test_the_cached_summary_is_for_exactly_what_was_sent():
+    with GenlyStubServer() as stub:
+        api = AsyncGenlyApi(stub.url)
+        first = asyncio.run(api.generatePreferredTaskSummary(preferences(category="Entertainment",
+                                                                         providers=("Youtube", "Spotify"))))
+        second = asyncio.run(api.generatePreferredTaskSummary(preferences(category="entertainment",
+                                                                          providers=("spotify", "youtube"))))
+    assert first == second
+    assert stub.requests[0][1]["preferences"][0]["providersToUse"] == ["spotify", "youtube"]
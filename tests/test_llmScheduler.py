@@ -0,0 +1,106 @@
+import time
+import asyncio
+from utils.llmScheduler import LlmScheduler, setRequester
+
+
+# Queue every call before any can go out, then let the bucket refill and
+# record the order in which they are admitted
+def admissionOrder(scheduler, calls):
+    order = []
+
+    async def call(requester, label, background, tag):
+        setRequester(requester, background)
+        await scheduler.acquire(10, label)
+        order.append(tag)
+
+    async def main():
+        scheduler.requests.level = 0
+        await asyncio.gather(*(call(*arguments) for arguments in calls))
+
+    asyncio.run(main())
+    return order
+
+
+def test_priority_classes_go_in_order():
+    order = admissionOrder(LlmScheduler(requestsPerMinute=1200), [
+        ("job", "generation", True, "batch generation"),
+        ("user", "analysis", False, "analysis"),
+        ("user", "correction", False, "correction"),
+        ("user", "generation", False, "generation"),
+    ])
+    assert order == ["generation", "correction", "analysis", "batch generation"]
+
+
+def test_requesters_take_turns_within_a_class():
+    calls = [("a", "generation", False, f"a{index}") for index in range(3)]
+    calls += [("b", "generation", False, f"b{index}") for index in range(2)]
+    order = admissionOrder(LlmScheduler(requestsPerMinute=1200), calls)
+    assert order == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_token_bucket_limits_the_rate():
+    scheduler = LlmScheduler(tokensPerMinute=1200)
+
+    async def main():
+        scheduler.tokens.level = 0
+        started = time.monotonic()
+        await scheduler.acquire(5)
+        return time.monotonic() - started
+
+    # 20 tokens a second, so 5 tokens take a quarter of a second
+    assert 0.2 <= asyncio.run(main()) < 1.0
+
+
+def test_settle_charges_the_real_usage():
+    scheduler = LlmScheduler(tokensPerMinute=1000)
+
+    async def main():
+        grant = await scheduler.acquire(100)
+        scheduler.settle(grant, 400)
+
+    asyncio.run(main())
+    assert 590 <= scheduler.tokens.level <= 610
+
+
+def test_rate_limited_responses_pause_admissions():
+    scheduler = LlmScheduler(backoff=0.1)
+
+    async def waited():
+        started = time.monotonic()
+        await scheduler.acquire(1)
+        return time.monotonic() - started
+
+    scheduler.observe(429, {"retry-after": "0.3"})
+    assert asyncio.run(waited()) >= 0.25
+    # Without retry-after the backoff doubles per 429 in a row
+    scheduler.observe(429, {})
+    scheduler.observe(429, {})
+    assert asyncio.run(waited()) >= 0.35
+    assert scheduler.rateLimited == 3
+
+
+def test_limits_are_learned_from_headers():
+    scheduler = LlmScheduler()
+    scheduler.observe(200, {"anthropic-ratelimit-requests-limit": "50",
+                            "anthropic-ratelimit-requests-remaining": "10",
+                            "anthropic-ratelimit-tokens-limit": "40000",
+                            "anthropic-ratelimit-tokens-remaining": "39000"})
+    assert scheduler.requests.capacity == 50 and scheduler.requests.level <= 10
+    assert scheduler.tokens.capacity == 40000 and scheduler.tokens.level <= 39000
+
+
+def test_cancelled_waiters_leave_the_queue():
+    scheduler = LlmScheduler(requestsPerMinute=60)
+
+    async def main():
+        scheduler.requests.level = -100
+        waiting = asyncio.create_task(scheduler.acquire(1))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    assert sum(scheduler.stats()["waiting"].values()) == 0
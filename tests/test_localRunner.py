@@ -0,0 +1,62 @@
+import os
+import time
+import asyncio
+import threading
+import pytest
+from utils import executor as executorModule
+from utils.executor import AsyncExecutor
+from utils.localRunner import LocalRunner
+from utils.outputStream import OutputStream
+
+posix = pytest.mark.skipif(os.name != "posix", reason="limits and process groups are POSIX only")
+
+
+def test_runs_code_and_collects_artifacts():
+    result = LocalRunner().run("import os\nprint('hi')\nopen(os.path.join('artifacts', 'a.txt'), 'w').write('x')\n")
+    assert result.stdout == "hi\n" and result.exitCode == 0
+    assert [artifact.name for artifact in result.artifacts] == ["a.txt"]
+
+
+def test_timeout_kills_the_process_group():
+    started = time.monotonic()
+    result = LocalRunner(timeout=0.5).run("import subprocess, time\nsubprocess.Popen(['sleep', '30'])\ntime.sleep(30)")
+    assert time.monotonic() - started < 5
+    assert result.timedOut and "timed out after 0.5s" in result.stderr
+
+
+@posix
+def test_memory_limit_applies_only_when_set():
+    assert LocalRunner().preexec() is None
+    runner = LocalRunner(memoryBytes=256 * 1024 * 1024)
+    assert runner.preexec() is not None
+    result = runner.run("data = bytearray(1024 * 1024 * 1024)")
+    assert result.exceptionType == "MemoryError"
+
+
+def test_runs_wait_for_a_free_slot():
+    runner = LocalRunner(maxParallel=1)
+    first = runner.start("import time; time.sleep(0.3)")
+    started = time.monotonic()
+    second = threading.Thread(target=runner.run, args=("pass",))
+    second.start()
+    time.sleep(0.1)
+    assert second.is_alive()
+    first.wait()
+    second.join(5)
+    assert not second.is_alive() and time.monotonic() - started >= 0.2
+
+
+# More runs than threads and slots: every pool thread may be waiting in
+# start() for a slot, and the runs holding slots must still finish
+def test_local_runs_do_not_deadlock_the_thread_pool(monkeypatch):
+    runner = LocalRunner(maxParallel=1)
+    monkeypatch.setattr(executorModule, "getLocalRunner", lambda: runner)
+    executor = AsyncExecutor(maxWorkers=1, local=True)
+
+    async def main():
+        runs = [executor.run(f"import time; time.sleep(0.1); print({index})", output=OutputStream())
+                for index in range(4)]
+        return await asyncio.wait_for(asyncio.gather(*runs), 20)
+
+    results = asyncio.run(main())
+    assert sorted(result.stdout for result in results) == ["0\n", "1\n", "2\n", "3\n"]
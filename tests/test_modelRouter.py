@@ -0,0 +1,57 @@
+import pytest
+from utils import modelRouter
+from utils.modelRouter import ModelRouter, Route
+
+
+def router(**stages):
+    routes = {"default": Route("default", "big-model", 4000, 0.0), "fast": Route("fast", "small-model", 2000, 0.0)}
+    return ModelRouter(routes, stages or {"correction": ["fast", "default"]},
+                       {"analysis": {"temperature": 0.8}})
+
+
+def test_repairs_escalate_once_the_fast_route_failed():
+    routes = router()
+    assert [routes.route("correction", attempt).name for attempt in range(4)] == ["fast", "default", "default",
+                                                                                 "default"]
+    # Stages without routes use the default one
+    assert routes.route("generation").model == "big-model"
+
+
+def test_stage_overrides_replace_the_route_settings():
+    route = router(analysis=["fast"]).route("analysis")
+    assert route.params() == {"model": "small-model", "max_tokens": 2000, "temperature": 0.8}
+
+
+def test_unknown_routes_are_rejected():
+    with pytest.raises(ValueError, match="Unknown route 'huge'"):
+        router(generation=["huge"])
+
+
+def test_stats_count_calls_errors_and_outcomes():
+    routes = router()
+    fast = routes.route("correction")
+    with routes.timed("correction", fast):
+        pass
+    with pytest.raises(RuntimeError):
+        with routes.timed("correction", fast):
+            raise RuntimeError("overloaded")
+    routes.recordOutcome("correction", fast, True)
+    routes.recordOutcome("correction", fast, False)
+    routes.recordOutcome("correction", fast, False)
+    stats = routes.stats()["correction/fast"]
+    assert stats["model"] == "small-model"
+    assert stats["calls"] == 2 and stats["errors"] == 1
+    assert stats["successRate"] == pytest.approx(1 / 3)
+
+
+def test_routes_come_from_the_environment(monkeypatch):
+    monkeypatch.setattr(modelRouter, "_router", None)
+    monkeypatch.setenv("FAST_MODEL", "small-model")
+    monkeypatch.setenv("GENERATION_ROUTES", "fast, default")
+    monkeypatch.setenv("CORRECTION_MAX_TOKENS", "500")
+    routes = modelRouter.getModelRouter()
+    assert [routes.route("generation", attempt).model for attempt in range(2)] == ["small-model", "test-model"]
+    # The fast route falls back to the default settings
+    assert routes.route("generation").maxTokens == 1000
+    assert routes.route("correction", 1).maxTokens == 500
+    assert routes.route("analysis").temperature == 0.8
@@ -0,0 +1,44 @@
+from utils.outputStream import OutputStream, TracebackDetector
+
+TRACEBACK = 'Traceback (most recent call last):\n  File "main.py", line 1, in <module>\n    main()\nValueError: bad\n'
+
+
+def test_traceback_split_across_chunks():
+    detector = TracebackDetector()
+    found = [detector.feed(TRACEBACK[start:start + 7]) for start in range(0, len(TRACEBACK), 7)]
+    assert [line for line in found if line] == ["ValueError: bad"]
+    assert detector.feed("KeyError: not in a traceback\n") is None
+
+
+def test_traceback_listeners_are_called_once():
+    output = OutputStream()
+    early, late = [], []
+    output.onTraceback(early.append)
+    output.write("working\n" + TRACEBACK, "stderr")
+    output.write(TRACEBACK, "stderr")
+    # Registered after the traceback came in, e.g. while the run was starting
+    output.onTraceback(late.append)
+    assert early == late == ["ValueError: bad"]
+
+
+def test_subscribers_get_every_chunk_and_broken_ones_are_dropped():
+    seen = []
+    output = OutputStream(lambda stream, text: seen.append((stream, text)))
+    output.subscribe(lambda stream, text: 1 / 0)
+    output.write("a")
+    output.write("b", "stderr")
+    assert seen == [("stdout", "a"), ("stderr", "b")]
+    assert output.text() == "a" and output.text("stderr") == "b"
+
+
+def test_long_output_keeps_head_and_tail(tmp_path):
+    output = OutputStream(maxChars=100, spillDir=str(tmp_path))
+    for index in range(100):
+        output.write(f"line {index:03}\n")
+    text = output.text()
+    assert text.startswith("line 000\n")
+    assert text.endswith("line 099\n")
+    assert "characters omitted" in text
+    assert output.total == 900
+    output.close()
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+from utils.packageCache import PackageCache, parsePackages, packageKey
+
+
+def test_pip_blocks_become_sorted_canonical_specs():
+    block = "!pip install Requests  python_dotenv -q --index-url https://example.org\npip3 install numpy==1.26 # pinned"
+    assert parsePackages(block) == ["numpy==1.26", "python-dotenv", "requests"]
+    assert parsePackages("") == []
+
+
+# Builds that only write the marker file, counting how often they ran
+class QuickCache(PackageCache):
+    def __init__(self, root, **kwargs):
+        super().__init__(root, **kwargs)
+        self.builds = []
+
+    def _build(self, key, specs):
+        self.builds.append(key)
+        os.makedirs(self.entryDir(key), exist_ok=True)
+        with open(os.path.join(self.entryDir(key), "ready"), "w") as file:
+            json.dump(specs, file)
+        return True
+
+
+def age(cache, pipBlock, seconds):
+    ready = os.path.join(cache.entryDir(packageKey(parsePackages(pipBlock))), "ready")
+    os.utime(ready, (os.path.getmtime(ready) - seconds,) * 2)
+
+
+def test_hits_reuse_the_environment(tmp_path):
+    cache = QuickCache(str(tmp_path))
+    first = cache.prepare("pip install b a")
+    assert cache.prepare("pip install a b") == first
+    assert (cache.hits, cache.misses, len(cache.builds)) == (1, 1, 1)
+
+
+def test_least_recently_used_environments_are_evicted(tmp_path):
+    cache = QuickCache(str(tmp_path), maxEntries=2)
+    cache.prepare("pip install a")
+    age(cache, "pip install a", 20)
+    cache.prepare("pip install b")
+    age(cache, "pip install b", 10)
+    # Using a again makes b the oldest
+    cache.prepare("pip install a")
+    cache.prepare("pip install c")
+    assert sorted(json.load(open(os.path.join(tmp_path, name, "ready")))[0] for name in os.listdir(tmp_path)
+                  if not name.startswith(".")) == ["a", "c"]
+    assert cache.evictions == 1
+
+
+def test_held_environments_are_not_evicted(tmp_path):
+    cache = QuickCache(str(tmp_path), maxEntries=1)
+    entry = cache.entryDir(packageKey(["a"]))
+    cache.prepare("pip install a", hold=True)
+    cache.prepare("pip install b")
+    assert os.path.exists(entry)
+    cache.release("pip install a")
+    cache.prepare("pip install c")
+    assert not os.path.exists(entry)
+
+
+def test_concurrent_prepares_build_once_and_leave_no_locks(tmp_path):
+    cache = QuickCache(str(tmp_path))
+    threads = [threading.Thread(target=cache.prepare, args=("pip install a",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache.builds) == 1
+    assert cache._keyLocks == {}
+
+
+class FakeSandbox:
+    def __init__(self, unknown=()):
+        self.installs = []
+        self.unknown = unknown
+
+    def install_python_packages(self, packages):
+        self.installs.append(packages)
+        if set(packages.split()) & set(self.unknown):
+            raise Exception(f"Failed to install package {packages}")
+
+
+def test_sandbox_installs_are_remembered(tmp_path):
+    cache = PackageCache(str(tmp_path))
+    sandbox, other = FakeSandbox(), FakeSandbox()
+    cache.installInto(sandbox, "pip install b a")
+    cache.installInto(sandbox, "pip install a b")
+    assert sandbox.installs == ["a b"]
+    prefer = cache.hasInstalled("pip install a b")
+    assert prefer(sandbox) and not prefer(other)
+
+
+def test_a_package_pip_does_not_know_is_left_out(tmp_path):
+    cache = PackageCache(str(tmp_path))
+    sandbox = FakeSandbox(unknown=["helpers"])
+    assert cache.installInto(sandbox, "pip install requests helpers") == ["helpers"]
+    assert sandbox.installs == ["helpers requests", "helpers", "requests"]
+    # Remembered with what was left out
+    assert cache.installInto(sandbox, "pip install requests helpers") == ["helpers"]
+    assert len(sandbox.installs) == 3
+    # Nothing installed at all is tried again
+    assert cache.installInto(sandbox, "pip install helpers") == ["helpers"]
+    assert cache.installInto(sandbox, "pip install helpers") == ["helpers"]
+    assert sandbox.installs[3:] == ["helpers", "helpers"]
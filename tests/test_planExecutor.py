@@ -0,0 +1,97 @@
+import json
+import asyncio
+import pytest
+from utils.clients import setAnthropicClient
+from utils.fakes import FakeAnthropic
+from utils.planExecutor import PlanExecutor, PlanError, parsePlan
+
+
+def summary(*tasks):
+    return json.dumps({"planSummary": "Test plan", "tasks": list(tasks)})
+
+
+def test_single_task_or_plain_text_is_not_a_plan():
+    assert parsePlan("Just add the songs to my playlist") is None
+    assert parsePlan(summary({"id": "a", "command": "Add the songs"})) is None
+
+
+def test_order_puts_dependencies_first_and_keeps_plan_order_otherwise():
+    plan = parsePlan(summary(
+        {"id": "report", "command": "Write the report", "dependsOn": ["songs", "contacts"]},
+        {"id": "songs", "command": "List the songs"},
+        {"id": "contacts", "command": "List the contacts"},
+    ))
+    assert [task.id for task in plan.order()] == ["songs", "contacts", "report"]
+
+
+def test_dependencies_by_name_and_position():
+    plan = parsePlan(summary(
+        {"name": "Fetch", "command": "Fetch the data"},
+        {"name": "Clean", "command": "Clean the data", "dependencies": "fetch"},
+        {"command": "Chart the data", "after": [2]},
+    ))
+    assert [task.dependsOn for task in plan.order()] == [[], ["1"], ["2"]]
+
+
+def test_critical_path_follows_the_slowest_chain():
+    plan = parsePlan(summary(
+        {"id": "a", "command": "A"},
+        {"id": "b", "command": "B"},
+        {"id": "c", "command": "C", "dependsOn": ["a", "b"]},
+    ))
+    assert plan.criticalPath({"a": 1.0, "b": 3.0, "c": 2.0}) == 5.0
+
+
+def test_cycles_and_unknown_dependencies_are_errors():
+    with pytest.raises(PlanError, match="cycle"):
+        parsePlan(summary({"id": "a", "command": "A", "dependsOn": ["b"]},
+                          {"id": "b", "command": "B", "dependsOn": ["a"]}))
+    with pytest.raises(PlanError, match="Unknown task"):
+        parsePlan(summary({"id": "a", "command": "A"}, {"id": "b", "command": "B", "dependsOn": ["z"]}))
+
+
+# Code for a task mentioning "BROKEN" always fails; every prompt is kept
+class ScriptedAnthropic(FakeAnthropic):
+    def __init__(self):
+        super().__init__(latency=0.01, jitter=0, failureRate=0)
+        self.prompts = []
+
+    def _respond(self, text, rng):
+        self.prompts.append(text)
+        if "Summary:" not in text and "BROKEN" in text:
+            return "```python\n# fake: fail\nraise RuntimeError('broken')\n```"
+        return super()._respond(text, rng)
+
+
+def test_dependents_of_a_failed_task_are_skipped(fakeBackends):
+    client = ScriptedAnthropic()
+    setAnthropicClient(client)
+    plan = parsePlan(summary(
+        {"id": "a", "command": "Load the songs"},
+        {"id": "b", "command": "BROKEN step"},
+        {"id": "c", "command": "Chart the songs", "dependsOn": ["a"]},
+        {"id": "d", "command": "Mail the chart", "dependsOn": ["b", "c"]},
+    ))
+    result = asyncio.run(PlanExecutor(retries=1).run("Make a chart", plan, analyze=False))
+    statuses = {node.task.id: node.status for node in result.nodes}
+    assert statuses == {"a": "succeeded", "b": "failed", "c": "succeeded", "d": "skipped"}
+    assert not result.success
+    # The failed task got its fresh retry, the skipped one never ran
+    attempts = {node.task.id: len(node.pipelines) for node in result.nodes}
+    assert attempts["b"] == 2 and attempts["d"] == 0
+    assert "Task d (skipped)" in result.result.output
+
+
+def test_dependent_tasks_get_their_inputs(fakeBackends):
+    client = ScriptedAnthropic()
+    setAnthropicClient(client)
+    plan = parsePlan(summary(
+        {"id": "a", "command": "Load the songs"},
+        {"id": "b", "command": "Chart the songs", "dependsOn": ["a"]},
+    ))
+    result = asyncio.run(PlanExecutor().run("Make a chart", plan, analyze=False))
+    assert result.success
+    output = result.nodes[0].resultText()
+    prompt = next(text for text in client.prompts if "Task: Chart the songs" in text)
+    assert f"a (Load the songs): {output}" in prompt
+    assert result.timings["criticalPath"] <= result.timings["serial"]
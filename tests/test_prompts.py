@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+from utils.llm import Usage
+from utils.prompts import PromptTemplate, CORRECTION, TASK_GENERATION, CACHE_CONTROL
+
+
+def test_the_prefix_only_holds_the_stable_fields():
+    template = PromptTemplate("test", "Rules\nContext: {context}\n", "Code: {code}\n")
+    prompt = template.render(context="jazz", code="print(1)")
+    assert prompt.prefix == "Rules\nContext: jazz\n" and prompt.suffix == "Code: print(1)\n"
+    assert prompt.text == "Rules\nContext: jazz\nCode: print(1)\n"
+
+
+def test_attempts_of_a_repair_share_one_prefix():
+    first = CORRECTION.render(message="Chart my songs", context="", code="a", errors="NameError")
+    second = CORRECTION.render(message="Chart my songs", context="", code="b", errors="KeyError")
+    assert first.prefix is second.prefix
+    assert first.suffix != second.suffix
+    other = CORRECTION.render(message="Mail the chart", context="", code="a", errors="NameError")
+    assert other.prefix != first.prefix
+
+
+def test_rendered_prefixes_are_bounded():
+    template = PromptTemplate("test", "Request: {message}", "", maxPrefixes=2)
+    for message in ("one", "two", "one", "three"):
+        template.render(message=message)
+    # "one" was used again after "two", so "two" went first
+    assert list(template._prefixes) == [("one",), ("three",)]
+
+
+def test_requests_mark_the_prefix_for_caching():
+    prompt = CORRECTION.render(message="Chart my songs", context="", code="a", errors="NameError")
+    content = prompt.request()["messages"][0]["content"]
+    assert content[0] == {"type": "text", "text": prompt.prefix, "cache_control": CACHE_CONTROL}
+    assert content[1] == {"type": "text", "text": prompt.suffix}
+
+    prompt = TASK_GENERATION.render(knowledge="", message="Chart my songs", context="{}")
+    request = prompt.request()
+    assert request["system"] == [{"type": "text", "text": prompt.prefix, "cache_control": CACHE_CONTROL}]
+    assert request["messages"] == [{"role": "user", "content": [{"type": "text", "text": prompt.suffix}]}]
+
+
+def test_the_version_follows_the_template_text():
+    assert PromptTemplate("a", "x {y}", "z").version == PromptTemplate("b", "x {y}", "z").version
+    assert PromptTemplate("a", "x {y}", "z").version != PromptTemplate("a", "x {y}!", "z").version
+    assert PromptTemplate("a", "x", "z").version != PromptTemplate("a", "x", "z", placement="system").version
+
+
+def test_cache_reads_count_towards_the_hit_rate():
+    usage = Usage()
+    usage.add(SimpleNamespace(input_tokens=100, output_tokens=50, cache_creation_input_tokens=900,
+                              cache_read_input_tokens=None))
+    usage.add(SimpleNamespace(input_tokens=100, output_tokens=50, cache_creation_input_tokens=0,
+                              cache_read_input_tokens=900))
+    assert usage.cacheHitRate == 900 / 2000
+    assert usage.totalTokens == 2100
@@ -0,0 +1,101 @@
+import asyncio
+from utils.clients import setAnthropicClient
+from utils.executionResult import ExecutionResult
+from utils.fakes import FakeAnthropic
+from utils.pipeline import runPipeline, parse_response
+from utils.repairEngine import RepairEngine
+
+
+def failure(kind="ValueError"):
+    return ExecutionResult("", f"Traceback (most recent call last):\n  File \"main.py\", line 1, in <module>\n"
+                               f"{kind}: boom\n", exitCode=1)
+
+
+# Scripted corrections: response N is the code "attempt N"; `failing` maps the
+# attempts that fail to the exception they raise
+def engine(failing, **kwargs):
+    calls = []
+
+    async def correct(prompt, index):
+        calls.append(prompt)
+        return f"```python\nattempt {index}\n```", 100
+
+    async def execute(code, packages):
+        index = int(code.split()[-1])
+        return failure(failing[index]) if index in failing else ExecutionResult("fixed\n", exitCode=0)
+
+    return RepairEngine(correct, parse_response, execute, lambda code, result: f"fix {code}", **kwargs), calls
+
+
+def test_stops_at_the_first_working_correction():
+    repair, calls = engine({0: "KeyError", 1: "TypeError"})
+    result = asyncio.run(repair.repair("original", failure()))
+    assert result.success
+    assert result.reason == "fixed"
+    assert result.attempts == 3
+    assert result.candidate.code == "attempt 2"
+    # Each correction starts from the latest failing code
+    assert calls == ["fix original", "fix attempt 0", "fix attempt 1"]
+
+
+def test_gives_up_after_the_attempt_budget():
+    repair, _ = engine({index: f"Error{index}" for index in range(10)}, maxAttempts=3, maxRepeats=10)
+    result = asyncio.run(repair.repair("original", failure()))
+    assert not result.success
+    assert result.attempts == 3
+    assert result.reason == "gave up after 3 attempts"
+
+
+def test_stops_when_the_same_failure_repeats():
+    repair, _ = engine({index: "ValueError" for index in range(10)}, maxAttempts=10, maxRepeats=2)
+    result = asyncio.run(repair.repair("original", failure()))
+    assert not result.success
+    assert result.reason == "the same failure keeps repeating"
+    assert result.attempts == 2
+
+
+def test_stops_when_the_token_budget_is_used_up():
+    repair, _ = engine({index: f"Error{index}" for index in range(10)}, maxAttempts=10, maxTokens=250,
+                       maxRepeats=10)
+    result = asyncio.run(repair.repair("original", failure()))
+    assert not result.success
+    assert result.attempts == 3
+    assert result.reason == "token budget of 250 used up"
+
+
+def test_parallel_candidates_take_the_first_success():
+    repair, _ = engine({0: "KeyError"}, candidates=2)
+    result = asyncio.run(repair.repair("original", failure()))
+    assert result.success
+    assert result.attempts == 2
+    assert result.candidate.code == "attempt 1"
+
+
+# Fails the first answer it gives, then writes working code
+class FailsOnce(FakeAnthropic):
+    def _respond(self, text, rng):
+        if "Summary:" in text:
+            return super()._respond(text, rng)
+        failed = getattr(self, "failed", False)
+        self.failed = True
+        return "```python\nprint('ok')\n```" if failed else "```python\n# fake: fail\nraise RuntimeError('x')\n```"
+
+
+def test_pipeline_repairs_failing_code(fakeBackends):
+    setAnthropicClient(FailsOnce(latency=0.01, jitter=0))
+    pipeline = asyncio.run(runPipeline("print something"))
+    assert pipeline.success
+    assert pipeline.attempts == 1
+    assert pipeline.repairReason == "fixed"
+    assert pipeline.code == "print('ok')"
+    assert pipeline.analysis
+
+
+def test_pipeline_reports_a_repair_that_gives_up(fakeBackends):
+    client, _ = fakeBackends
+    client.failureRate = 1.0
+    pipeline = asyncio.run(runPipeline("print something", analyze=False))
+    assert not pipeline.success
+    assert pipeline.attempts >= 1
+    assert pipeline.repairReason == "the same failure keeps repeating"
+    assert pipeline.result.exceptionType == "RuntimeError"
@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from utils.pipeline import runPipeline, PipelineHooks
+from utils.resultStore import CoalescingStore, PipelineResultStore
+
+
+def runs(store, keep, count=2):
+    calls = []
+
+    async def work():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return f"run {len(calls)}"
+
+    async def main():
+        return await asyncio.gather(*(store.run("key", work, keep=keep) for _ in range(count)))
+
+    return asyncio.run(main()), calls
+
+
+def test_concurrent_runs_are_shared():
+    results, calls = runs(CoalescingStore(), keep=False)
+    assert len(calls) == 1
+    assert [value for value, _ in results] == ["run 1", "run 1"]
+    assert sorted(ran for _, ran in results) == [False, True]
+
+
+def test_finished_runs_are_only_reused_when_kept():
+    store = CoalescingStore()
+    runs(store, keep=False)
+    _, calls = runs(store, keep=False, count=1)
+    assert calls == [0]
+    runs(store, keep=True, count=1)
+    (result,), calls = runs(store, keep=True, count=1)
+    assert calls == [] and result == ("run 1", False)
+
+
+def test_failures_reach_every_waiter_and_are_not_stored():
+    store = CoalescingStore()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("sandbox went away")
+        return "ok"
+
+    async def main():
+        return await asyncio.gather(*(store.run("key", work) for _ in range(2)), return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(main())] == [RuntimeError, RuntimeError]
+    assert asyncio.run(store.run("key", work)) == ("ok", True)
+    assert len(calls) == 2
+
+
+def test_a_cancelled_waiter_leaves_the_run_alone():
+    store = CoalescingStore()
+
+    async def work():
+        await asyncio.sleep(0.1)
+        return "done"
+
+    async def main():
+        owner = asyncio.create_task(store.run("key", work))
+        waiter = asyncio.create_task(store.run("key", work))
+        await asyncio.sleep(0.02)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(main()) == ("done", True)
+    assert store.get("key") == "done"
+
+
+def test_keys_depend_on_command_category_and_context():
+    keys = {PipelineResultStore.key("Chart my songs"), PipelineResultStore.key("Chart my songs", "music"),
+            PipelineResultStore.key("Chart my songs", None, "I like jazz")}
+    assert len(keys) == 3
+    assert PipelineResultStore.key("Chart my songs", "music") == PipelineResultStore.key("Chart my songs", "music")
+
+
+# Every hook call but onStage, in order
+class ListHooks(PipelineHooks):
+    def __init__(self):
+        self.calls = []
+
+    def onGenerated(self, response):
+        self.calls.append(("onGenerated", response))
+
+    def onExecuted(self, result):
+        self.calls.append(("onExecuted", result.output))
+
+    def onFinalResult(self, result):
+        self.calls.append(("onFinalResult", result.output))
+
+    def onAnalysis(self, analysis):
+        self.calls.append(("onAnalysis", analysis))
+
+
+def test_a_stored_run_replays_what_was_rendered_live(fakeBackends):
+    live = ListHooks()
+    pipeline = asyncio.run(runPipeline("List my songs", hooks=live))
+    assert [name for name, _ in live.calls][:2] == ["onGenerated", "onExecuted"]
+    replayed = ListHooks()
+    pipeline.replay(replayed)
+    assert replayed.calls == live.calls
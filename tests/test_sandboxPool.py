@@ -0,0 +1,114 @@
+import os
+import time
+import pytest
+from localInterpreter import LocalInterpreter
+from utils.sandboxPool import SandboxPool
+
+
+def pool(factory=LocalInterpreter, **kwargs):
+    kwargs = dict(dict(minSize=0, maxSize=2, maintenanceInterval=0.05), **kwargs)
+    return SandboxPool(factory, **kwargs)
+
+
+def waitFor(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_released_sandboxes_are_reset_and_reused():
+    sandboxes = pool()
+    entry = sandboxes.acquire()
+    entry.sandbox.run_python("open('leftover.txt', 'w').write('x'); import os; os.makedirs('artifacts/plots')")
+    sandboxes.release(entry)
+    waitFor(lambda: sandboxes.stats()["idle"] == 1)
+    again = sandboxes.acquire()
+    assert again is entry and again.uses == 2
+    assert os.listdir(entry.sandbox.home) == ["artifacts"]
+    assert os.listdir(os.path.join(entry.sandbox.home, "artifacts")) == []
+    # A sandbox still in use when the pool closes is closed on release
+    sandboxes.close()
+    assert entry.sandbox.is_open
+    sandboxes.release(entry)
+    assert not entry.sandbox.is_open
+
+
+def test_the_first_sandbox_tells_what_the_image_has_installed():
+    sandboxes = pool()
+    assert sandboxes.modules is None
+    entry = sandboxes.acquire()
+    assert {"json", "pytest"} <= sandboxes.modules
+    sandboxes.release(entry)
+    sandboxes.close()
+
+
+def test_acquire_waits_for_a_free_sandbox_and_times_out():
+    sandboxes = pool(maxSize=1)
+    entry = sandboxes.acquire()
+    with pytest.raises(TimeoutError):
+        sandboxes.acquire(timeout=0.1)
+    sandboxes.release(entry, reset=False)
+    assert sandboxes.acquire(timeout=1) is entry
+    sandboxes.close()
+
+
+def test_prefer_picks_a_matching_idle_sandbox():
+    sandboxes = pool()
+    first, second = sandboxes.acquire(), sandboxes.acquire()
+    sandboxes.release(first, reset=False)
+    sandboxes.release(second, reset=False)
+    assert sandboxes.acquire(prefer=lambda sandbox: sandbox is first.sandbox) is first
+    sandboxes.close()
+
+
+def test_worn_and_failed_sandboxes_are_closed():
+    sandboxes = pool(maxUses=1)
+    entry = sandboxes.acquire()
+    sandboxes.release(entry)
+    assert not entry.sandbox.is_open
+    entry = sandboxes.acquire()
+    with pytest.raises(ValueError):
+        with sandboxes.sandbox():
+            raise ValueError()
+    sandboxes.release(entry)
+    assert sandboxes.stats()["size"] == 0
+    sandboxes.close()
+
+
+def test_idle_sandboxes_are_closed_down_to_min_size():
+    sandboxes = pool(minSize=1, idleTimeout=0.1)
+    first, second = sandboxes.acquire(), sandboxes.acquire()
+    sandboxes.release(first, reset=False)
+    sandboxes.release(second, reset=False)
+    waitFor(lambda: sandboxes.stats()["size"] == 1)
+    assert sandboxes.stats()["idle"] == 1
+    sandboxes.close()
+
+
+def test_unhealthy_idle_sandboxes_are_replaced():
+    sandboxes = pool(minSize=1, healthCheckInterval=0.1)
+    waitFor(lambda: sandboxes.stats()["idle"] == 1)
+    sick = sandboxes._idle[0]
+    sick.sandbox.is_open = False
+    waitFor(lambda: sandboxes.stats()["idle"] == 1 and sandboxes._idle[0] is not sick)
+    sandboxes.close()
+
+
+def test_a_sandbox_whose_baseline_fails_is_closed():
+    created = []
+
+    class Broken(LocalInterpreter):
+        def __init__(self):
+            super().__init__()
+            created.append(self)
+
+        def run_python(self, code, **kwargs):
+            raise RuntimeError("no kernel")
+
+    sandboxes = pool(factory=Broken, maxSize=1)
+    with pytest.raises(RuntimeError):
+        sandboxes.acquire()
+    assert not created[0].is_open
+    assert sandboxes.stats()["size"] == 0
+    sandboxes.close()
@@ -0,0 +1,112 @@
+import json
+import asyncio
+from types import SimpleNamespace
+from localInterpreter import LocalInterpreter
+from utils import kernel
+from utils import sessions as sessionsModule
+from utils import executor as executorModule
+from utils.executor import AsyncExecutor
+from utils.outputStream import OutputStream
+from utils.sandboxPool import SandboxPool
+from utils.sessions import KernelSession, LocalKernelSession, SandboxKernelSession, SessionManager
+
+
+# Kernel that answers each cell from a script: "ok" finishes the cell, "hang"
+# never answers and "exit" ends the process
+class ScriptedSession(KernelSession):
+    def __init__(self):
+        super().__init__("test")
+        self.watching = False
+        self.watchers = 0
+        self.installs = []
+
+    def _start(self):
+        pass
+
+    def _send(self, line):
+        cell = json.loads(line)
+        if cell["code"] == "ok":
+            for stream in ("stdout", "stderr"):
+                self._receive(stream, kernel.SENTINEL + json.dumps({"id": cell["id"], "ok": True}) + "\n")
+        elif cell["code"] == "exit":
+            self._exited(1)
+
+    def _install(self, specs, output):
+        self.installs.append(specs)
+        return specs
+
+    def _artifactMarker(self):
+        self.watching = True
+        self.watchers += 1
+        return {}
+
+    def _artifacts(self, marker):
+        return []
+
+    def _stopArtifacts(self):
+        self.watching = False
+
+    def _stop(self):
+        pass
+
+
+def test_artifact_watch_stops_however_the_cell_ends():
+    session = ScriptedSession()
+    assert not session.execute("ok", output=OutputStream(), cellId="1").failed
+    assert not session.watching
+    assert session.execute("hang", output=OutputStream(), timeout=0.05, cellId="2").timedOut
+    assert not session.watching
+    assert "The Python session ended" in session.execute("exit", output=OutputStream(), cellId="3").stderr
+    assert not session.watching
+    assert session.watchers == 3
+
+
+def test_prefetch_installs_into_the_session(monkeypatch):
+    manager = SessionManager(lambda key: ScriptedSession(), maintenanceInterval=60)
+    monkeypatch.setattr(executorModule, "getSessionManager", lambda: manager)
+    asyncio.run(AsyncExecutor().prefetch("pip install pandas", session="conversation"))
+    session = manager.peek("conversation")
+    assert session.installs == [["pandas"]] and session.alive
+    # The cell that needs them installs nothing more
+    assert not session.execute("ok", "pip install pandas", output=OutputStream(), cellId="1").failed
+    assert session.installs == [["pandas"]]
+    manager.closeAll()
+
+
+def test_a_failed_cell_leaves_the_namespace_as_it_was():
+    session = LocalKernelSession("test")
+    try:
+        assert not session.execute("x = 1", output=OutputStream(), timeout=30, cellId="1").failed
+        failed = session.execute("x = 2\ny = 3\nraise ValueError('candidate')", output=OutputStream(),
+                                 timeout=30, cellId="2")
+        assert failed.exceptionType == "ValueError"
+        result = session.execute("print(x, 'y' in globals())", output=OutputStream(), timeout=30, cellId="3")
+        assert result.stdout.strip() == "1 False"
+    finally:
+        session.close()
+
+
+# Enough of a sandbox for SandboxKernelSession to start a kernel in
+class KernelSandbox(LocalInterpreter):
+    def __init__(self):
+        super().__init__()
+        self.filesystem = SimpleNamespace(write=lambda path, content: None)
+        finished = SimpleNamespace(done=lambda: True)
+        self.process = SimpleNamespace(start=lambda *args, **kwargs: SimpleNamespace(finished=finished))
+
+
+def test_sessions_do_not_use_the_shared_pool(monkeypatch):
+    shared = SandboxPool(KernelSandbox, minSize=0, maxSize=1)
+    own = SandboxPool(KernelSandbox, minSize=0, maxSize=1)
+    monkeypatch.setattr(sessionsModule, "getSessionSandboxPool", lambda: own)
+    monkeypatch.setattr(executorModule, "getSandboxPool", lambda: shared)
+    session = SandboxKernelSession("conversation")
+    session._start()
+    assert own.stats()["inUse"] == 1 and shared.stats()["size"] == 0
+    # A stateless run still gets a sandbox
+    entry = shared.acquire(timeout=1)
+    shared.release(entry, reset=False)
+    session.close()
+    assert own.stats()["size"] == 0
+    shared.close()
+    own.close()
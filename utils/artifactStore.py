@@ -0,0 +1,231 @@
+import os
+import io
+import hashlib
+import mimetypes
+import tempfile
+import threading
+import urllib.parse
+from PIL import Image
+from dotenv import load_dotenv
+from utils.clients import getHttpSession, HTTP_TIMEOUT_SECONDS
+
+load_dotenv()
+
+# Leading bytes of the file types the UI knows how to preview
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+)
+
+# Image types Pillow can decode into a thumbnail
+THUMBNAIL_TYPES = {"image/png", "image/jpeg", "image/gif", "image/bmp", "image/webp"}
+
+
+def detectType(head, name=None):
+    for signature, mimeType in SIGNATURES:
+        if head.startswith(signature):
+            return mimeType
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if b"<svg" in head[:512]:
+        return "image/svg+xml"
+    guessed = mimetypes.guess_type(name or "")[0]
+    if guessed:
+        return guessed
+    try:
+        head.decode("utf-8")
+        return "text/plain"
+    except UnicodeDecodeError:
+        return "application/octet-stream"
+
+
+class ArtifactTooLarge(Exception):
+    pass
+
+
+# A file produced by a run. Holds only metadata; the content stays in the
+# store and is read, or turned into a thumbnail, when somebody asks for it.
+class Artifact:
+    def __init__(self, store, digest, name, size, mimeType):
+        self.store = store
+        self.digest = digest
+        self.name = name
+        self.size = size
+        self.mimeType = mimeType
+
+    @property
+    def path(self):
+        return self.store.objectPath(self.digest)
+
+    @property
+    def isImage(self):
+        return self.mimeType in THUMBNAIL_TYPES
+
+    def read(self):
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def open(self):
+        return open(self.path, "rb")
+
+    # PNG bytes of a preview no larger than the store's thumbnail size, or None
+    # for files that are not images
+    def thumbnail(self):
+        return self.store.thumbnail(self) if self.isImage else None
+
+    def toDict(self):
+        return {"name": self.name, "digest": self.digest, "size": self.size, "mimeType": self.mimeType}
+
+
+# Content-addressed, size-bounded store for run artifacts. Files are streamed
+# to disk in chunks while they are hashed, so a large chart never sits in
+# memory whole; identical files are stored once. Files over maxBytes are
+# rejected and the least recently used objects are removed once the store
+# grows past maxTotalBytes.
+class ArtifactStore:
+    def __init__(self, root, maxBytes=50 * 1024 * 1024, maxTotalBytes=1024 * 1024 * 1024,
+                 chunkSize=64 * 1024, thumbnailSize=480):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.maxTotalBytes = maxTotalBytes
+        self.chunkSize = chunkSize
+        self.thumbnailSize = thumbnailSize
+        self.stored = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "thumbnails"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def stats(self):
+        return {"stored": self.stored, "deduplicated": self.deduplicated, "rejected": self.rejected}
+
+    def objectPath(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def thumbnailPath(self, digest):
+        return os.path.join(self.root, "thumbnails", digest[:2], f"{digest}-{self.thumbnailSize}.png")
+
+    # Store an iterable of byte chunks under `name`. Raises ArtifactTooLarge as
+    # soon as more than maxBytes have arrived.
+    def ingest(self, chunks, name):
+        hasher = hashlib.sha256()
+        size = 0
+        head = b""
+        fd, temp = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > self.maxBytes:
+                        with self._lock:
+                            self.rejected += 1
+                        raise ArtifactTooLarge(f"{name} is larger than {self.maxBytes} bytes")
+                    if len(head) < 512:
+                        head += chunk[:512 - len(head)]
+                    hasher.update(chunk)
+                    file.write(chunk)
+            digest = hasher.hexdigest()
+            path = self.objectPath(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._lock:
+                if os.path.exists(path):
+                    self.deduplicated += 1
+                    os.utime(path)
+                else:
+                    os.replace(temp, path)
+                    self.stored += 1
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        self._evict(keep=digest)
+        return Artifact(self, digest, os.path.basename(name), size, detectType(head, name))
+
+    def ingestBytes(self, data, name):
+        return self.ingest((data[i:i + self.chunkSize] for i in range(0, len(data), self.chunkSize)), name)
+
+    def ingestFile(self, path, name=None):
+        with open(path, "rb") as file:
+            return self.ingest(iter(lambda: file.read(self.chunkSize), b""), name or path)
+
+    # Stream an E2B artifact straight from the sandbox's file endpoint into the
+    # store. Artifacts without that endpoint fall back to download().
+    def ingestSandboxArtifact(self, artifact):
+        sandbox = getattr(artifact, "_sandbox", None)
+        if sandbox is None or not hasattr(sandbox, "file_url"):
+            return self.ingestBytes(artifact.download(), artifact.name)
+        url = f"{sandbox.file_url()}?path={urllib.parse.quote(artifact.name)}"
+        with getHttpSession().get(url, stream=True, timeout=HTTP_TIMEOUT_SECONDS) as response:
+            response.raise_for_status()
+            length = int(response.headers.get("Content-Length") or 0)
+            if length > self.maxBytes:
+                with self._lock:
+                    self.rejected += 1
+                raise ArtifactTooLarge(f"{artifact.name} is larger than {self.maxBytes} bytes")
+            return self.ingest(response.iter_content(self.chunkSize), artifact.name)
+
+    def thumbnail(self, artifact):
+        path = self.thumbnailPath(artifact.digest)
+        if not os.path.exists(path):
+            with Image.open(artifact.path) as image:
+                # Let JPEG decode at a reduced scale instead of full resolution
+                image.draft("RGB", (self.thumbnailSize, self.thumbnailSize))
+                image.thumbnail((self.thumbnailSize, self.thumbnailSize))
+                buffer = io.BytesIO()
+                image.save(buffer, "PNG")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+            with os.fdopen(fd, "wb") as file:
+                file.write(buffer.getvalue())
+            os.replace(temp, path)
+        with open(path, "rb") as file:
+            return file.read()
+
+    def _objects(self):
+        objects = []
+        base = os.path.join(self.root, "objects")
+        for prefix in os.listdir(base):
+            for digest in os.listdir(os.path.join(base, prefix)):
+                stat = os.stat(os.path.join(base, prefix, digest))
+                objects.append((stat.st_mtime, stat.st_size, digest))
+        return sorted(objects)
+
+    def _evict(self, keep):
+        with self._lock:
+            objects = self._objects()
+            total = sum(size for _, size, _ in objects)
+            for _, size, digest in objects:
+                if total <= self.maxTotalBytes:
+                    break
+                if digest == keep:
+                    continue
+                os.remove(self.objectPath(digest))
+                thumbnails = os.path.dirname(self.thumbnailPath(digest))
+                for name in os.listdir(thumbnails) if os.path.isdir(thumbnails) else ():
+                    if name.startswith(digest):
+                        os.remove(os.path.join(thumbnails, name))
+                total -= size
+
+
+_store = None
+_storeLock = threading.Lock()
+
+def getArtifactStore():
+    global _store
+    with _storeLock:
+        if _store is None:
+            _store = ArtifactStore(
+                os.path.expanduser(os.getenv("ARTIFACT_STORE_DIR", "~/.cache/genly_execute/artifacts")),
+                maxBytes=int(os.getenv("ARTIFACT_MAX_MB", "50")) * 1024 * 1024,
+                maxTotalBytes=int(os.getenv("ARTIFACT_STORE_MAX_MB", "1024")) * 1024 * 1024,
+                thumbnailSize=int(os.getenv("ARTIFACT_THUMBNAIL_PX", "480")),
+            )
+        return _store
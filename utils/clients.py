@@ -0,0 +1,285 @@
+import os
+import asyncio
+import threading
+import types
+import httpx
+import anthropic
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from utils.llmScheduler import getLlmScheduler
+
+load_dotenv()
+
+try:
+    import h2  # noqa: F401 - httpx only negotiates HTTP/2 when h2 is installed
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# Request counters for one connection pool. Every change is forwarded to the
+# hook registered with setMetricsHook(hook), called as hook(poolName, stats).
+class PoolMetrics:
+    def __init__(self, name, maxConnections):
+        self.name = name
+        self.maxConnections = maxConnections
+        self.inFlight = 0
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {
+            "inFlight": self.inFlight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "maxConnections": self.maxConnections,
+            "utilization": self.inFlight / self.maxConnections if self.maxConnections else 0.0,
+        }
+
+    def started(self):
+        with self._lock:
+            self.inFlight += 1
+            self.requests += 1
+        self._report()
+
+    def finished(self, failed=False):
+        with self._lock:
+            self.inFlight -= 1
+            self.errors += 1 if failed else 0
+        self._report()
+
+    def _report(self):
+        if _metricsHook is not None:
+            try:
+                _metricsHook(self.name, self.stats())
+            except Exception:
+                pass
+
+
+_metricsHook = None
+
+def setMetricsHook(hook):
+    global _metricsHook
+    _metricsHook = hook
+
+
+# `onResponse(status, headers)`, when given, sees every response, e.g. so the
+# LLM scheduler can follow the API's rate-limit headers
+class _CountingAsyncTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, metrics, onResponse=None, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.onResponse = onResponse
+
+    async def handle_async_request(self, request):
+        self.metrics.started()
+        failed = True
+        try:
+            response = await super().handle_async_request(request)
+            failed = response.status_code >= 500 or response.status_code == 429
+            if self.onResponse is not None:
+                self.onResponse(response.status_code, response.headers)
+            return response
+        finally:
+            self.metrics.finished(failed)
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, metrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    def send(self, request, **kwargs):
+        self.metrics.started()
+        failed = True
+        try:
+            response = super().send(request, **kwargs)
+            failed = response.status_code >= 500 or response.status_code == 429
+            return response
+        finally:
+            self.metrics.finished(failed)
+
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+anthropicMetrics = PoolMetrics("anthropic", LLM_MAX_CONNECTIONS)
+
+_lock = threading.Lock()
+_anthropicClient = None
+_clientsLoop = None
+_anthropicOverride = None
+
+# Replace the Anthropic client for the whole process, e.g. with a
+# utils.fakes.FakeAnthropic for benchmarks. Anything with an async
+# messages.stream(**kwargs) like the SDK's works; None restores the real one.
+def setAnthropicClient(client):
+    global _anthropicOverride
+    _anthropicOverride = client
+
+
+# Event loop on a daemon thread that owns the shared async clients and their
+# connections for the life of the process; called with _lock held
+def _clientLoop():
+    global _clientsLoop
+    if _clientsLoop is None:
+        _clientsLoop = asyncio.new_event_loop()
+        threading.Thread(target=_clientsLoop.run_forever, name="async-clients", daemon=True).start()
+    return _clientsLoop
+
+
+# Await `coroutine` on `loop` from any other loop; cancelling the caller
+# cancels it there too
+async def _onLoop(loop, coroutine):
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+
+# messages.stream() of the shared client, driven from the caller's loop: the
+# request, every text chunk and the final message are awaited on the client's
+# own loop and handed over
+class _LoopStream:
+    def __init__(self, client, loop, kwargs):
+        self.client = client
+        self.loop = loop
+        self.kwargs = kwargs
+        self._manager = None
+        self._stream = None
+
+    async def __aenter__(self):
+        async def enter():
+            self._manager = self.client.messages.stream(**self.kwargs)
+            self._stream = await self._manager.__aenter__()
+        await _onLoop(self.loop, enter())
+        return self
+
+    async def __aexit__(self, *exc):
+        return await _onLoop(self.loop, self._manager.__aexit__(*exc))
+
+    @property
+    def text_stream(self):
+        return self._text()
+
+    async def _text(self):
+        chunks = self._stream.text_stream
+        while True:
+            try:
+                yield await _onLoop(self.loop, chunks.__anext__())
+            except StopAsyncIteration:
+                return
+
+    async def get_final_message(self):
+        return await _onLoop(self.loop, self._stream.get_final_message())
+
+
+class _LoopClient:
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+        self.messages = types.SimpleNamespace(stream=lambda **kwargs: _LoopStream(client, loop, kwargs))
+
+
+# Shared AsyncAnthropic client with keep-alive pooling, HTTP/2 when h2 is
+# installed, and the SDK's retry/backoff. httpx connections belong to the event
+# loop that opened them and Streamlit runs every rerun under a new asyncio.run,
+# so the one client of the process lives on its own background loop and callers
+# on any loop stream through it: every run, rerun and job reuses the same warm
+# connections. The rate limits are enforced by the LLM scheduler
+# (utils/llmScheduler.py).
+def getAnthropicClient():
+    global _anthropicOverride, _anthropicClient
+    if _anthropicOverride is None and os.getenv("LLM_BACKEND", "anthropic") == "fake":
+        from utils.fakes import fakeAnthropicFromEnv
+        with _lock:
+            _anthropicOverride = _anthropicOverride or fakeAnthropicFromEnv()
+    if _anthropicOverride is not None:
+        return _anthropicOverride
+    with _lock:
+        if _anthropicClient is None:
+            transport = _CountingAsyncTransport(
+                anthropicMetrics,
+                onResponse=getLlmScheduler().observe,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "10")),
+                    keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_SECONDS", "30")),
+                ),
+            )
+            httpClient = getattr(anthropic, "DefaultAsyncHttpxClient", httpx.AsyncClient)
+            client = anthropic.AsyncAnthropic(
+                api_key=os.environ["ANTHROPIC_API_KEY"],
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+                timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "600")),
+                http_client=httpClient(transport=transport),
+            )
+            _anthropicClient = _LoopClient(client, _clientLoop())
+        return _anthropicClient
+
+
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "60"))
+httpMetrics = PoolMetrics("http", HTTP_POOL_MAXSIZE)
+
+_session = None
+
+# Process-wide requests.Session (thread safe for plain requests) with a sized
+# keep-alive pool and retries with exponential backoff on 429/5xx. requests has
+# no HTTP/2 support, so this stays on HTTP/1.1.
+def getHttpSession():
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=int(os.getenv("HTTP_MAX_RETRIES", "3")),
+                backoff_factor=float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5")),
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,
+                respect_retry_after_header=True,
+            )
+            adapter = _CountingAdapter(httpMetrics, pool_connections=HTTP_POOL_MAXSIZE,
+                                       pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+asyncHttpMetrics = PoolMetrics("http-async", HTTP_POOL_MAXSIZE)
+_asyncHttpClient = None
+
+
+# httpx.AsyncClient requests from the caller's loop, sent on the client's own
+# loop; responses are read in full there before they are handed over
+class _LoopHttpClient:
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+
+    async def request(self, method, url, **kwargs):
+        return await _onLoop(self.loop, self.client.request(method, url, **kwargs))
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+# Shared httpx.AsyncClient for plain HTTP APIs. Like the Anthropic client it
+# lives on the background loop, so callers on any loop (every Streamlit rerun
+# has its own) share one pool of keep-alive connections. Retries are left to
+# the caller; httpx only retries failed connection attempts.
+def getAsyncHttpClient():
+    global _asyncHttpClient
+    with _lock:
+        if _asyncHttpClient is None:
+            transport = _CountingAsyncTransport(
+                asyncHttpMetrics,
+                http2=HTTP2_AVAILABLE,
+                retries=1,
+                limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+            )
+            client = httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT_SECONDS)
+            _asyncHttpClient = _LoopHttpClient(client, _clientLoop())
+        return _asyncHttpClient
@@ -0,0 +1,205 @@
+import os
+import re
+import ast
+import sys
+import threading
+import importlib.util
+from collections import OrderedDict
+from dotenv import load_dotenv
+from utils.executionResult import ExecutionResult
+from utils.packageCache import parsePackages, canonicalName
+from utils.telemetry import registry
+
+load_dotenv()
+
+checkCount = registry.counter("genly_static_checks_total", "Pre-execution checks by outcome (ok, syntax, no_code)")
+inferredPackages = registry.counter("genly_inferred_packages_total",
+                                    "Distributions added to a pip block because the code imports them")
+
+# Import names whose distribution has a different name. Dotted names cover
+# namespace packages, where the top-level name says nothing.
+IMPORT_DISTRIBUTIONS = {
+    "attr": "attrs",
+    "bs4": "beautifulsoup4",
+    "Crypto": "pycryptodome",
+    "cv2": "opencv-python",
+    "dateutil": "python-dateutil",
+    "docx": "python-docx",
+    "dotenv": "python-dotenv",
+    "fitz": "pymupdf",
+    "google.auth": "google-auth",
+    "google.oauth2": "google-auth",
+    "google.cloud.bigquery": "google-cloud-bigquery",
+    "google.cloud.storage": "google-cloud-storage",
+    "google.generativeai": "google-generativeai",
+    "google_auth_oauthlib": "google-auth-oauthlib",
+    "googleapiclient": "google-api-python-client",
+    "jose": "python-jose",
+    "jwt": "pyjwt",
+    "magic": "python-magic",
+    "MySQLdb": "mysqlclient",
+    "OpenSSL": "pyopenssl",
+    "PIL": "pillow",
+    "pptx": "python-pptx",
+    "psycopg2": "psycopg2-binary",
+    "serial": "pyserial",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "slugify": "python-slugify",
+    "telegram": "python-telegram-bot",
+    "yaml": "pyyaml",
+    "zmq": "pyzmq",
+}
+
+# Top-level names shared by many distributions; only the dotted entries above resolve them
+NAMESPACE_PACKAGES = {"google", "azure"}
+
+STDLIB_MODULES = set(getattr(sys, "stdlib_module_names", ())) | set(sys.builtin_module_names) | {"__future__"}
+
+
+# IMPORT_DISTRIBUTIONS plus "module=distribution,..." pairs from the
+# environment, e.g. for internal SDKs
+def _distributions():
+    mapping = dict(IMPORT_DISTRIBUTIONS)
+    for pair in os.getenv("IMPORT_DISTRIBUTIONS", "").split(","):
+        module, _, distribution = pair.partition("=")
+        if module.strip() and distribution.strip():
+            mapping[module.strip()] = distribution.strip()
+    return mapping
+
+
+# Imports inside `try:` blocks that handle ImportError are optional
+def _optionalImports(tree):
+    optional = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Try):
+            continue
+        handled = set()
+        for handler in node.handlers:
+            types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+            handled.update(getattr(kind, "id", None) for kind in types)
+        if handled & {None, "ImportError", "ModuleNotFoundError", "Exception"}:
+            for statement in node.body:
+                optional.update(id(child) for child in ast.walk(statement))
+    return optional
+
+
+# Absolute module names the code imports unconditionally, e.g. ["cv2", "google.oauth2.credentials"]
+def importedModules(tree):
+    optional = _optionalImports(tree)
+    modules = []
+    for node in ast.walk(tree):
+        if id(node) in optional:
+            continue
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.append(node.module)
+    return modules
+
+
+def _installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# Distributions the imports of `tree` need that are not in the standard
+# library and that `installed(module)` says the interpreter the code runs in
+# does not have (by default: this interpreter). Import names without a known
+# distribution are taken as the distribution name, which is right for most
+# of PyPI; the installers put a name pip does not know aside on its own, so a
+# wrong guess costs the run nothing but the ImportError it would have had
+# anyway. Namespace packages are only resolved through a mapping.
+def requiredDistributions(tree, installed=None):
+    installed = installed or _installed
+    mapping = _distributions()
+    distributions = []
+    for module in importedModules(tree):
+        top = module.split(".")[0]
+        if top in STDLIB_MODULES or top.startswith("_"):
+            continue
+        parts = module.split(".")
+        prefixes = [".".join(parts[:end]) for end in range(len(parts), 0, -1)]
+        distribution = next((mapping[prefix] for prefix in prefixes if prefix in mapping), None)
+        if distribution is None:
+            if top in NAMESPACE_PACKAGES:
+                continue
+            distribution = canonicalName(top)
+        if installed(module if top in NAMESPACE_PACKAGES else top):
+            continue
+        if distribution not in distributions:
+            distributions.append(distribution)
+    return distributions
+
+
+# `pipBlock` with `distributions` it does not name yet added, as one
+# "pip install ..." line; the block's own specs (and pins) win
+def mergePackages(pipBlock, distributions):
+    specs = parsePackages(pipBlock)
+    names = {canonicalName(re.match(r"[A-Za-z0-9._-]*", spec).group()) for spec in specs}
+    added = [name for name in distributions if canonicalName(name) not in names]
+    if not added:
+        return pipBlock
+    inferredPackages.inc(len(added))
+    return "pip install " + " ".join(specs + added)
+
+
+# The message Python prints for a SyntaxError in main.py, taken from the
+# error itself rather than from whatever main.py is on disk
+def formatSyntaxError(error):
+    lines = [f'  File "main.py", line {error.lineno}']
+    if error.text:
+        text = error.text.rstrip("\n")
+        stripped = text.lstrip()
+        lines.append(f"    {stripped}")
+        if error.offset:
+            start = max(error.offset - 1 - (len(text) - len(stripped)), 0)
+            end = error.end_offset if error.end_offset and error.end_lineno == error.lineno else error.offset + 1
+            lines.append("    " + " " * start + "^" * max(end - error.offset, 1))
+    lines.append(f"{type(error).__name__}: {error.msg}")
+    return "\n".join(lines) + "\n"
+
+
+# Check generated code before anything runs it. Returns (packages, failure):
+# the pip block with the distributions its imports need added, and, when the
+# code cannot run at all (no code block, or a SyntaxError), an ExecutionResult
+# that describes it the way a run would, so the correction starts without a
+# sandbox round trip. `installed` is passed on to requiredDistributions. The
+# same code is usually checked twice, once while it streams in (to prefetch
+# its packages) and once before it runs, so recent results are kept.
+def checkCode(code, packages=None, installed=None):
+    key = (code, packages)
+    with _checkedLock:
+        if key in _checked:
+            _checked.move_to_end(key)
+            return _checked[key]
+    checked = _check(code, packages, installed)
+    with _checkedLock:
+        _checked[key] = checked
+        while len(_checked) > CHECKED_MAX_ENTRIES:
+            _checked.popitem(last=False)
+    return checked
+
+
+CHECKED_MAX_ENTRIES = 64
+_checked = OrderedDict()
+_checkedLock = threading.Lock()
+
+
+def _check(code, packages, installed):
+    if not code or not code.strip():
+        checkCount.inc(outcome="no_code")
+        return packages, ExecutionResult(stderr="The response did not contain a ```python code block", exitCode=1)
+    try:
+        tree = ast.parse(code, "<main.py>")
+    except SyntaxError as error:
+        checkCount.inc(outcome="syntax")
+        return packages, ExecutionResult(stderr=formatSyntaxError(error), exitCode=1)
+    except ValueError as error:
+        # e.g. null bytes in the source
+        checkCount.inc(outcome="syntax")
+        return packages, ExecutionResult(stderr=f"SyntaxError: {error}", exitCode=1)
+    checkCount.inc(outcome="ok")
+    return mergePackages(packages, requiredDistributions(tree, installed)), None
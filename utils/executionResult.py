@@ -0,0 +1,131 @@
+import os
+import re
+import hashlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ERROR_DIGEST_MAX_TOKENS = int(os.getenv("ERROR_DIGEST_MAX_TOKENS", "1000"))
+
+# Rough size of a token, used to turn the digest token budget into characters
+CHARS_PER_TOKEN = 4
+
+FRAME_PATTERN = re.compile(r'^\s*File "(?P<file>[^"]+)", line (?P<line>\d+)(?:, in (?P<function>.+))?$')
+EXCEPTION_PATTERN = re.compile(r"^(?P<type>[A-Za-z_][\w.]*(?:Error|Exception|Exit|Interrupt|Warning|Iteration)?)(?::\s?(?P<message>.*))?$")
+
+# Output markers the generated scripts print when an API call went wrong
+FAILURE_MARKERS = ("Failed to retrieve", "Status code:")
+
+
+class TracebackFrame:
+    def __init__(self, filename, line, function, source=None):
+        self.filename = filename
+        self.line = line
+        self.function = function
+        self.source = source
+
+    def __str__(self):
+        text = f'  File "{self.filename}", line {self.line}, in {self.function}'
+        return text + (f"\n    {self.source}" if self.source else "")
+
+
+# Outcome of one execution. The output is scanned once on construction for the
+# last traceback (frames, exception type and message) and for the failure
+# markers; `failed` and `digest()` are derived from that. Unpacks like the old
+# (stdout, stderr, artifacts) tuple.
+class ExecutionResult:
+    def __init__(self, stdout="", stderr="", artifacts=None, exitCode=None, timedOut=False):
+        self.stdout = stdout or ""
+        self.stderr = stderr or ""
+        self.artifacts = artifacts or []
+        self.exitCode = exitCode
+        self.timedOut = timedOut
+        self.frames = []
+        self.exceptionType = None
+        self.exceptionMessage = None
+        self.markers = []
+        self._scan()
+
+    def __iter__(self):
+        return iter((self.stdout, self.stderr, self.artifacts))
+
+    @property
+    def output(self):
+        return self.stdout + ("\n" + self.stderr if self.stderr else "")
+
+    @property
+    def failed(self):
+        # E2B reports some benign progress messages on stderr that say "completed"
+        stderrFailed = bool(self.stderr.strip()) and "completed" not in self.stderr
+        return (self.timedOut or bool(self.exitCode) or self.exceptionType is not None
+                or bool(self.markers) or stderrFailed)
+
+    # Identifies "the same failure" across attempts: exception type plus the
+    # innermost frame's function, or the last output line with numbers blanked
+    def fingerprint(self):
+        if self.exceptionType:
+            where = self.frames[-1].function if self.frames else ""
+            key = f"{self.exceptionType}@{where}"
+        else:
+            lines = [line for line in self.output.splitlines() if line.strip()]
+            key = re.sub(r"0x[0-9a-fA-F]+|\d+", "#", lines[-1] if lines else "")
+        if self.timedOut:
+            key = "timeout:" + key
+        return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+    # Compact description of the failure for the correction prompt: status,
+    # exception, the innermost frames and the head and tail of the output,
+    # kept within roughly `maxTokens` tokens
+    def digest(self, maxTokens=ERROR_DIGEST_MAX_TOKENS):
+        budget = maxTokens * CHARS_PER_TOKEN
+        parts = []
+        status = "timed out" if self.timedOut else f"exit code {self.exitCode}" if self.exitCode is not None else "unknown exit code"
+        parts.append(f"Status: {status}")
+        if self.exceptionType:
+            parts.append(f"Exception: {self.exceptionType}: {self.exceptionMessage or ''}".rstrip(": "))
+        if self.frames:
+            parts.append("Traceback (innermost last):\n" + "\n".join(str(frame) for frame in self.frames[-5:]))
+        if self.markers:
+            parts.append("Failure markers: " + ", ".join(self.markers))
+        header = "\n".join(parts)
+        remaining = budget - len(header)
+        output = self.output.strip()
+        if len(output) > remaining > 0:
+            head = remaining // 3
+            tail = remaining - head
+            output = f"{output[:head]}\n... [{len(output) - head - tail} characters omitted] ...\n{output[-tail:]}"
+        elif remaining <= 0:
+            output = ""
+        return header + ("\nOutput:\n" + output if output else "")
+
+    def _scan(self):
+        inTraceback = False
+        lastFrame = None
+        for line in (self.stdout + "\n" + self.stderr).splitlines():
+            if line.startswith("Traceback (most recent call last)"):
+                inTraceback = True
+                self.frames = []
+                lastFrame = None
+                continue
+            if not inTraceback and line.startswith("  File ") and FRAME_PATTERN.match(line):
+                # A SyntaxError in the script itself is reported without the header
+                inTraceback = True
+                self.frames = []
+            if not inTraceback:
+                for marker in FAILURE_MARKERS:
+                    if marker in line and marker not in self.markers:
+                        self.markers.append(marker)
+                continue
+            frame = FRAME_PATTERN.match(line)
+            if frame:
+                lastFrame = TracebackFrame(frame["file"], int(frame["line"]), frame["function"] or "<module>")
+                self.frames.append(lastFrame)
+            elif line.startswith(" "):
+                if lastFrame is not None and lastFrame.source is None and line.strip().strip("^~ "):
+                    lastFrame.source = line.strip()
+            elif line.strip():
+                exception = EXCEPTION_PATTERN.match(line.strip())
+                if exception:
+                    self.exceptionType = exception["type"]
+                    self.exceptionMessage = exception["message"]
+                    inTraceback = False
@@ -0,0 +1,310 @@
+import os
+import uuid
+import asyncio
+import functools
+import threading
+import importlib.util
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+from utils.sandboxPool import getSandboxPool
+from utils.packageCache import getPackageCache
+from utils.localRunner import getLocalRunner
+from utils.sessions import getSessionManager
+from utils.executionResult import ExecutionResult
+from utils.artifactStore import getArtifactStore, ArtifactTooLarge
+from utils.outputStream import OutputStream
+from utils.telemetry import span, outputBytes, artifactBytes
+
+load_dotenv()
+
+
+# asyncio front end for code execution. The E2B SDK and the local runner are
+# blocking, so every call is pushed onto a bounded thread pool and awaited;
+# the event loop stays free for LLM calls and other sessions meanwhile.
+# Output is streamed into an OutputStream while the code runs. Once a
+# traceback has been printed the run gets `tracebackGrace` seconds to exit on
+# its own before it is stopped, so the correction can start (0 waits for the
+# process however long it takes).
+class AsyncExecutor:
+    def __init__(self, maxWorkers=8, timeout=300, local=False, tracebackGrace=2.0):
+        self.timeout = timeout
+        self.local = local
+        self.tracebackGrace = tracebackGrace
+        self._threads = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="executor")
+
+    async def offload(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._threads, functools.partial(fn, *args, **kwargs))
+
+    # Install a pip block. Locally this builds (or reuses) the cached
+    # virtualenv; remotely it needs the sandbox the code will run in.
+    async def install(self, packages, sandbox=None):
+        with span("install", local=self.local):
+            if self.local:
+                return await self.offload(getPackageCache().prepare, packages)
+            return await self.offload(getPackageCache().installInto, sandbox, packages)
+
+    # Whether the interpreter the code runs in can import top-level `module`
+    # without installing anything. Remotely that is what the sandbox image
+    # has; until the pool created a sandbox this interpreter stands in for it.
+    def hasModule(self, module):
+        modules = None if self.local else getSandboxPool().modules
+        if modules is not None:
+            return "." not in module and module in modules
+        try:
+            return importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            return False
+
+    # Install a pip block ahead of run(), e.g. while the LLM is still writing
+    # the code. Remotely the packages go into a pooled sandbox that run() will
+    # then prefer; for a run in a `session` they go into the session. Failures
+    # are left for run() to surface.
+    async def prefetch(self, packages, session=None):
+        try:
+            if session:
+                await self.offload(getSessionManager().install, session, packages)
+                return
+            if self.local:
+                await self.install(packages)
+                return
+            pool = getSandboxPool()
+            entry = await self._acquire(pool, getPackageCache().hasInstalled(packages))
+            discard = True
+            try:
+                await self.install(packages, sandbox=entry.sandbox)
+                discard = False
+            finally:
+                pool.release(entry, discard=discard, reset=False)
+        except Exception:
+            pass
+
+    # Stream a sandbox artifact into the artifact store; oversized files are
+    # left out of the result
+    def store(self, artifact):
+        try:
+            return getArtifactStore().ingestSandboxArtifact(artifact)
+        except ArtifactTooLarge:
+            return None
+
+    # Download the artifacts run_python reported into the store, all at once on
+    # the thread pool. Only called once the code has exited, so no file is
+    # fetched while the script may still be writing it.
+    async def download(self, artifacts):
+        unique = list({artifact.name: artifact for artifact in artifacts}.values())
+        with span("artifacts.download", artifacts=len(unique)):
+            stored = await asyncio.gather(*(self.offload(self.store, artifact) for artifact in unique))
+        return [artifact for artifact in stored if artifact is not None]
+
+    # Run code and return an ExecutionResult. Output goes to `output` (an
+    # OutputStream) as it is produced. A run that exceeds `timeout` seconds is
+    # stopped and comes back with timedOut set and the output so far; a timed
+    # out, stopped or cancelled sandbox is closed instead of being returned to
+    # the pool. With a `session` key the code runs in that conversation's
+    # persistent Python session (utils/sessions.py) instead of a fresh process.
+    async def run(self, code, packages=None, timeout=None, output=None, session=None):
+        output = output or OutputStream()
+        timeout = self.timeout if timeout is None else timeout
+        with span("run", local=self.local, session=bool(session)) as current:
+            try:
+                if session:
+                    result = await self._runInSession(session, code, packages, timeout, output)
+                else:
+                    result = await self._run(code, packages, timeout, output)
+            finally:
+                output.close()
+            size = len(result.stdout.encode()) + len(result.stderr.encode())
+            outputBytes.inc(size)
+            for artifact in result.artifacts:
+                artifactBytes.observe(artifact.size)
+            current.set(exitCode=result.exitCode, timedOut=result.timedOut, failed=result.failed, outputBytes=size,
+                        artifacts=len(result.artifacts), artifactBytes=sum(artifact.size for artifact in result.artifacts))
+            return result
+
+    async def _run(self, code, packages, timeout, output):
+        if self.local:
+            cache = getPackageCache()
+            with span("install", local=True):
+                future = asyncio.ensure_future(self.offload(cache.prepare, packages, hold=True))
+                try:
+                    python = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    future.add_done_callback(lambda done: done.cancelled() or done.exception()
+                                             or done.result() is None or cache.release(packages))
+                    raise
+            try:
+                return await self._runLocal(code, python, timeout, output)
+            finally:
+                # The environment may be evicted once nothing runs in it
+                if python is not None:
+                    cache.release(packages)
+
+        pool = getSandboxPool()
+        try:
+            entry = await self._acquire(pool, getPackageCache().hasInstalled(packages))
+        except TimeoutError as error:
+            # Nothing ran, so this is not the code timing out
+            return self._result(output, [], error=f"No sandbox available: {error}", exitCode=1)
+        discard = True
+        exitStatus = {}
+        work = None
+        try:
+            # Packages pip cannot install are left out; the ImportError that
+            # follows is for the correction to fix
+            await self.install(packages, sandbox=entry.sandbox)
+            with span("run_python") as current:
+                work = asyncio.ensure_future(self.offload(
+                    entry.sandbox.run_python, code, timeout=timeout, env_vars={"PYTHONUNBUFFERED": "1"},
+                    on_stdout=lambda message: output.write(message.line + "\n", "stdout"),
+                    on_stderr=lambda message: output.write(message.line + "\n", "stderr"),
+                    on_exit=lambda status: exitStatus.setdefault("code", status)))
+                stopped = await self._waitOrStop(work, output, timeout)
+                current.set(stoppedAfterTraceback=stopped)
+            if stopped:
+                # Leave the sandbox to be closed. Its process may still be
+                # running and writing files, so they are not collected.
+                return self._result(output, [], exitCode=exitStatus.get("code") or 1)
+            try:
+                _, _, artifacts = work.result()
+            except Exception as error:
+                # The SDK's own timeout (the same `timeout`) or a sandbox that
+                # went away; either way the sandbox is not reused
+                if type(error).__name__ == "TimeoutException":
+                    return self._result(output, [], error=f"Execution timed out after {timeout}s", timedOut=True)
+                return self._result(output, [], error=f"Execution failed: {type(error).__name__}: {error}",
+                                    exitCode=1)
+            try:
+                artifacts = await self.download(artifacts)
+            except Exception as error:
+                discard = False
+                return self._result(output, [], error=f"Downloading the artifacts failed: {error}",
+                                    exitCode=exitStatus.get("code") or 1)
+            discard = False
+        except asyncio.TimeoutError:
+            return self._result(output, [], error=f"Execution timed out after {timeout}s", timedOut=True)
+        finally:
+            if work is not None:
+                # Stops waiting for run_python; closing the sandbox ends it
+                work.cancel()
+            pool.release(entry, discard=discard)
+        return self._result(output, artifacts, exitCode=exitStatus.get("code"))
+
+    # Wait for `work`; returns True when it was given up on because a
+    # traceback appeared more than tracebackGrace seconds ago, and raises
+    # asyncio.TimeoutError after `timeout` seconds
+    async def _waitOrStop(self, work, output, timeout=None):
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        def onTraceback(line):
+            # Streams made outside a loop call listeners on the writer's thread
+            try:
+                loop.call_soon_threadsafe(loop.call_later, self.tracebackGrace,
+                                          lambda: stop.done() or stop.set_result(line))
+            except RuntimeError:
+                # The run is over and its loop closed
+                pass
+        if self.tracebackGrace:
+            output.onTraceback(onTraceback)
+        try:
+            done, _ = await asyncio.wait({work, stop}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+        if not done:
+            raise asyncio.TimeoutError()
+        return work not in done
+
+    def _result(self, output, artifacts, error="", **kwargs):
+        stderr = output.text("stderr")
+        if error:
+            stderr = f"{stderr}\n{error}" if stderr else error
+        return ExecutionResult(output.text("stdout"), stderr, artifacts + output.spilledArtifacts(), **kwargs)
+
+    async def _acquire(self, pool, prefer):
+        future = asyncio.ensure_future(self.offload(pool.acquire, prefer=prefer))
+        try:
+            with span("sandbox.acquire"):
+                return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker thread still hands out a sandbox; give it straight back
+            future.add_done_callback(
+                lambda done: done.cancelled() or done.exception() or pool.release(done.result()))
+            raise
+
+    # The session enforces the timeout itself by restarting its kernel; a
+    # cancelled run kills the kernel, or never starts if it was still waiting
+    # for an earlier command of the conversation
+    async def _runInSession(self, key, code, packages, timeout, output):
+        sessions = getSessionManager()
+        cellId = uuid.uuid4().hex
+        with span("session.run") as current:
+            try:
+                result = await self.offload(sessions.execute, key, code, packages, output, timeout, cellId)
+            except asyncio.CancelledError:
+                sessions.cancel(key, cellId)
+                raise
+            session = sessions.peek(key)
+            current.set(cells=session.cells if session else 0)
+            return result
+
+    # run.wait() on a thread of its own. Runs waiting in start() for a slot
+    # hold pool threads, so a wait queued behind them on the pool would never
+    # get to free one.
+    def _wait(self, run):
+        future = Future()
+        def wait():
+            try:
+                future.set_result(run.wait())
+            except BaseException as error:
+                future.set_exception(error)
+        threading.Thread(target=wait, name="local-run-wait", daemon=True).start()
+        return asyncio.wrap_future(future)
+
+    # The local runner enforces the timeout itself by killing the process
+    async def _runLocal(self, code, python, timeout, output):
+        with span("local.start"):
+            run = await self.offload(getLocalRunner().start, code, python, timeout, output)
+        try:
+            with span("local.run") as current:
+                work = asyncio.ensure_future(self._wait(run))
+                stopped = await self._waitOrStop(work, output)
+                current.set(stoppedAfterTraceback=stopped)
+                if stopped:
+                    run.kill()
+                return await work
+        except asyncio.CancelledError:
+            # The wait already running on the pool returns once the process is gone
+            run.kill()
+            raise
+
+
+_executor = None
+_executorLock = threading.Lock()
+
+# Replace the executor for the whole process, e.g. with a
+# utils.fakes.FakeExecutor for benchmarks. Anything with async run(code,
+# packages, timeout, output, session) -> ExecutionResult and async
+# prefetch(packages, session) works.
+def setExecutor(executor):
+    global _executor
+    with _executorLock:
+        _executor = executor
+
+
+def getExecutor():
+    global _executor
+    with _executorLock:
+        if _executor is None and os.getenv("EXECUTOR_BACKEND", "e2b") == "fake":
+            from utils.fakes import fakeExecutorFromEnv
+            _executor = fakeExecutorFromEnv()
+        if _executor is None:
+            _executor = AsyncExecutor(
+                maxWorkers=int(os.getenv("EXECUTOR_MAX_WORKERS", "8")),
+                timeout=float(os.getenv("EXECUTOR_TIMEOUT_SECONDS", "300")),
+                local=os.getenv("EXECUTE_LOCALLY") == "True",
+                tracebackGrace=float(os.getenv("EXECUTION_TRACEBACK_GRACE_SECONDS", "2")),
+            )
+        return _executor
+
+
+async def execute_code(code, packages=None, timeout=None, output=None, session=None):
+    return await getExecutor().run(code, packages, timeout, output=output, session=session)
@@ -0,0 +1,178 @@
+import os
+import asyncio
+import hashlib
+import random
+import threading
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from utils.executionResult import ExecutionResult
+
+load_dotenv()
+
+# Marker the fake LLM puts into code that is meant to fail; FakeExecutor fails
+# such code and the local runner fails it for real because it raises
+FAIL_MARKER = "# fake: fail"
+
+
+def _random(seed, *parts):
+    return random.Random(hashlib.sha256("\x00".join([str(seed)] + [str(part) for part in parts]).encode()).digest())
+
+
+def _requestText(kwargs):
+    blocks = list(kwargs.get("system") or [])
+    for message in kwargs.get("messages", []):
+        content = message["content"]
+        blocks += [{"type": "text", "text": content}] if isinstance(content, str) else content
+    return blocks
+
+
+# Stand-in for anthropic.AsyncAnthropic that answers messages.stream() locally.
+# Answers depend only on the prompt and the seed, so a benchmark run is
+# repeatable:
+#   - generation and correction prompts get python code that prints
+#     `outputSize` bytes, after a pip block when `packages` is set; with
+#     probability failureRate the code raises instead (corrections fail with
+#     the same probability again)
+#   - analysis prompts ("Summary:") get a short summary
+# Every response takes `latency` seconds (+/- jitter) spread over the streamed
+# chunks. Usage reports prompt tokens at ~4 characters per token; prefix
+# blocks marked with cache_control count as cache reads once they were sent
+# before.
+class FakeAnthropic:
+    def __init__(self, latency=0.5, jitter=0.2, failureRate=0.3, outputSize=200, packages=None, chunks=8, seed=0):
+        self.latency = latency
+        self.packages = packages
+        self.jitter = jitter
+        self.failureRate = failureRate
+        self.outputSize = outputSize
+        self.chunks = chunks
+        self.seed = seed
+        self.calls = 0
+        self._cached = set()
+        self._lock = threading.Lock()
+        self.messages = SimpleNamespace(stream=self.stream)
+
+    def stream(self, **kwargs):
+        blocks = _requestText(kwargs)
+        text = "".join(block["text"] for block in blocks)
+        rng = _random(self.seed, text)
+        with self._lock:
+            self.calls += 1
+            callId = self.calls
+            cacheRead = cacheWrite = 0
+            for block in blocks:
+                if block.get("cache_control"):
+                    tokens = len(block["text"]) // 4
+                    if block["text"] in self._cached:
+                        cacheRead += tokens
+                    else:
+                        self._cached.add(block["text"])
+                        cacheWrite += tokens
+        inputTokens = max(1, len(text) // 4 - cacheRead - cacheWrite)
+        response = self._respond(text, rng)
+        latency = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter) * self.latency)
+        message = SimpleNamespace(
+            id=f"fake-{callId}",
+            content=[SimpleNamespace(type="text", text=response)],
+            usage=SimpleNamespace(input_tokens=inputTokens, output_tokens=max(1, len(response) // 4),
+                                  cache_read_input_tokens=cacheRead, cache_creation_input_tokens=cacheWrite),
+        )
+        return _FakeStream(message, response, latency, self.chunks)
+
+    def _respond(self, text, rng):
+        if "Summary:" in text:
+            return "The request was carried out and the code printed its results."
+        fails = rng.random() < self.failureRate
+        lines = [f"print('x' * {self.outputSize})"]
+        if fails:
+            lines = [FAIL_MARKER, "raise RuntimeError('fake failure')"]
+        pip = f"```pip\npip install {self.packages}\n```\n" if self.packages else ""
+        return pip + "```python\n" + "\n".join(lines) + "\n```\n"
+
+
+class _FakeStream:
+    def __init__(self, message, text, latency, chunks):
+        self.message = message
+        self.text = text
+        self.latency = latency
+        self.chunks = max(1, chunks)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        return self._stream()
+
+    async def _stream(self):
+        size = -(-len(self.text) // self.chunks)
+        for start in range(0, len(self.text), size):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield self.text[start:start + size]
+
+    async def get_final_message(self):
+        return self.message
+
+
+# Stand-in for AsyncExecutor that never runs anything. Code with FAIL_MARKER
+# comes back with a traceback, anything else with `outputSize` bytes of
+# output, after `latency` seconds (+/- jitter). At most `slots` runs proceed at
+# once, like a sandbox pool of that size. There is no state between runs, so
+# `session` is ignored.
+class FakeExecutor:
+    def __init__(self, latency=1.0, jitter=0.2, outputSize=200, installLatency=0.0, slots=4, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.outputSize = outputSize
+        self.installLatency = installLatency
+        self.seed = seed
+        self.runs = 0
+        self._slots = threading.BoundedSemaphore(slots)
+
+    async def prefetch(self, packages, session=None):
+        await asyncio.sleep(self.installLatency)
+
+    async def run(self, code, packages=None, timeout=None, output=None, session=None):
+        rng = _random(self.seed, code)
+        latency = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter) * self.latency)
+        # The slot is a thread semaphore so separate event loops share it
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+        try:
+            self.runs += 1
+            if packages:
+                await asyncio.sleep(self.installLatency)
+            await asyncio.sleep(latency)
+        finally:
+            self._slots.release()
+        if FAIL_MARKER in (code or ""):
+            stderr = ('Traceback (most recent call last):\n  File "/tmp/main.py", line 2, in <module>\n'
+                      "    raise RuntimeError('fake failure')\nRuntimeError: fake failure\n")
+            result = ExecutionResult("", stderr, exitCode=1)
+        else:
+            result = ExecutionResult("x" * self.outputSize + "\n", "", exitCode=0)
+        if output:
+            output.write(result.stdout, "stdout")
+            output.write(result.stderr, "stderr")
+        return result
+
+
+def fakeAnthropicFromEnv():
+    return FakeAnthropic(
+        latency=float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0.5")),
+        failureRate=float(os.getenv("FAKE_FAILURE_RATE", "0.3")),
+        outputSize=int(os.getenv("FAKE_OUTPUT_BYTES", "200")),
+        seed=int(os.getenv("FAKE_SEED", "0")),
+    )
+
+
+def fakeExecutorFromEnv():
+    return FakeExecutor(
+        latency=float(os.getenv("FAKE_EXEC_LATENCY_SECONDS", "1.0")),
+        outputSize=int(os.getenv("FAKE_OUTPUT_BYTES", "200")),
+        slots=int(os.getenv("SANDBOX_POOL_MAX_SIZE", "4")),
+        seed=int(os.getenv("FAKE_SEED", "0")),
+    )
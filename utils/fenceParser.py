@@ -0,0 +1,55 @@
+# Incremental parser for ``` fenced blocks in a streamed LLM response. Feed it
+# text chunks as they arrive; every call returns the (lang, body) pairs of the
+# blocks that were closed by that chunk, e.g. ("pip", "pip install requests")
+# as soon as the pip block ends, while the python block is still streaming.
+class FenceParser:
+    FENCE = "```"
+
+    def __init__(self):
+        self.text = ""
+        self.blocks = []
+        self._pos = 0
+        self._lang = None
+        self._bodyStart = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        closed = []
+        while True:
+            fence = self.text.find(self.FENCE, self._pos)
+            if fence == -1:
+                # Keep a possible partial fence at the end for the next chunk
+                self._pos = max(self._pos, len(self.text) - len(self.FENCE) + 1)
+                return closed
+            if self._lang is None:
+                start = fence + len(self.FENCE)
+                end = start
+                while end < len(self.text) and not self.text[end].isspace():
+                    end += 1
+                if end == len(self.text):
+                    # Language tag not complete yet
+                    self._pos = fence
+                    return closed
+                self._lang = self.text[start:end].lower()
+                self._bodyStart = end
+                self._pos = end
+            else:
+                block = (self._lang, self.text[self._bodyStart:fence].strip())
+                self.blocks.append(block)
+                closed.append(block)
+                self._lang = None
+                self._pos = fence + len(self.FENCE)
+
+    # First block of the given language seen so far, or None
+    def first(self, lang):
+        for blockLang, body in self.blocks:
+            if blockLang == lang:
+                return body
+        return None
+
+    # (lang, body) of a block that was opened but not closed, e.g. a response
+    # cut off by the token limit, or None
+    def unclosed(self):
+        if self._lang is None:
+            return None
+        return self._lang, self.text[self._bodyStart:].strip()
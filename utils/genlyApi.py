@@ -1,7 +1,15 @@
 import requests
 import json
 import os
+import re
+import random
+import asyncio
+import hashlib
+import threading
+import httpx
 from dotenv import load_dotenv
+from utils.clients import getHttpSession, getAsyncHttpClient, HTTP_TIMEOUT_SECONDS
+from utils.resultStore import CoalescingStore
 
 load_dotenv()
 
@@ -18,9 +26,19 @@ class PreferenceCommand:
             "providersToUse": self.providersToUse
         }
 
+    # Same request regardless of spacing, letter case or provider order
+    def normalized(self):
+        return {
+            "command": " ".join(self.command.split()),
+            "capabilityCategory": " ".join((self.capabilityCategory or "").split()).lower(),
+            "providersToUse": sorted({provider.strip().lower() for provider in self.providersToUse or []}),
+        }
+
 class GenlyApi:
-    def __init__(self, url):
+    def __init__(self, url, session=None, timeout=HTTP_TIMEOUT_SECONDS):
         self.url = url
+        self.session = session or getHttpSession()
+        self.timeout = timeout
         self.headers = {
             'Content-Type': 'application/json',
             'accept': 'application/json',
@@ -29,7 +47,7 @@ class GenlyApi:
         data = {
             "commands": commands
         }
-        response = requests.post(self.url+"/generate-provider-recommendations", headers=self.headers, data=json.dumps(data))
+        response = self.session.post(self.url+"/generate-provider-recommendations", headers=self.headers, data=json.dumps(data), timeout=self.timeout)
         return response.json()
     
     def generatePreferredTaskSummary(self, preferenceCommands: list[PreferenceCommand]):
@@ -38,7 +56,7 @@ class GenlyApi:
             "channelID": os.getenv("GENLY_API_STREAMLIT_CHANNELID"),
             "preferences": prefs
         }
-        response = requests.post(self.url+"/process-preferred-task-summary", headers=self.headers, data=json.dumps(data))
+        response = self.session.post(self.url+"/process-preferred-task-summary", headers=self.headers, data=json.dumps(data), timeout=self.timeout)
         return response.text
     
     
@@ -51,15 +69,149 @@ class GenlyApi:
         print(response.json())
         return response.json()
 
-if __name__ == "__main__":
-    
-    url = os.getenv("GENLY_API_URL")
-    genlyApi = GenlyApi(url)
-    # res = genlyApi.generateMoon()
-    # commands = ["Add new contacts to my CRM system",]
-    # print(genlyApi.generateProviderRecommendations(commands))
+# Status codes worth another try
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class GenlyApiError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# asyncio client for the Genly API. Requests time out after `timeout` seconds
+# and are retried with exponential backoff (honouring Retry-After) on
+# connection errors and RETRY_STATUS. Preferences are sent normalized, so
+# task summaries are cached for `cacheTtl` seconds per channel ID and
+# normalized preference list, exactly what was sent; identical requests in
+# flight, also from other sessions, share one call.
+class AsyncGenlyApi:
+    def __init__(self, url, channelId=None, timeout=HTTP_TIMEOUT_SECONDS, retries=3, backoff=0.5,
+                 cacheTtl=600, maxEntries=256, maxConcurrency=4):
+        self.url = url.rstrip("/")
+        self.channelId = channelId
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxConcurrency = maxConcurrency
+        self.batching = None
+        self.summaries = CoalescingStore(maxEntries, cacheTtl)
+        self.recommendations = CoalescingStore(maxEntries, cacheTtl)
+        self.headers = {
+            'Content-Type': 'application/json',
+            'accept': 'application/json',
+        }
+
+    def summaryKey(self, preferenceCommands):
+        payload = json.dumps([self.channelId, [pref.normalized() for pref in preferenceCommands]], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def generateProviderRecommendations(self, commands: list[str]):
+        key = hashlib.sha256(json.dumps([" ".join(command.split()) for command in commands]).encode()).hexdigest()
+        async def fetch():
+            return (await self._post("/generate-provider-recommendations", {"commands": commands})).json()
+        recommendations, _ = await self.recommendations.run(key, fetch)
+        return recommendations
+
+    async def generatePreferredTaskSummary(self, preferenceCommands: list[PreferenceCommand]):
+        summary, _ = await self.summaries.run(self.summaryKey(preferenceCommands),
+                                              lambda: self._fetchSummary(preferenceCommands))
+        return summary
+
+    # Summaries for many preference lists, one per list, in input order.
+    # Cached and duplicate lists cost nothing; the rest go out in one call to
+    # /process-preferred-task-summaries. A server without that endpoint gets
+    # one request per list instead, at most maxConcurrency at a time.
+    async def generatePreferredTaskSummaries(self, preferenceLists: list[list[PreferenceCommand]]):
+        slots = asyncio.Semaphore(self.maxConcurrency)
+        unique = {}
+        for preferenceCommands in preferenceLists:
+            unique.setdefault(self.summaryKey(preferenceCommands), preferenceCommands)
+        missing = {key: prefs for key, prefs in unique.items() if self.summaries.get(key) is None}
+        batch = asyncio.ensure_future(self._fetchSummaries(missing)) if len(missing) > 1 else None
+
+        async def one(key, preferenceCommands):
+            async def fetch():
+                if key in missing and batch is not None:
+                    summaries = await asyncio.shield(batch)
+                    if summaries is not None:
+                        return summaries[key]
+                async with slots:
+                    return await self._fetchSummary(preferenceCommands)
+            summary, _ = await self.summaries.run(key, fetch)
+            return summary
+
+        try:
+            summaries = dict(zip(unique, await asyncio.gather(*(one(*item) for item in unique.items()))))
+        finally:
+            if batch is not None and not batch.done():
+                batch.cancel()
+        return [summaries[self.summaryKey(prefs)] for prefs in preferenceLists]
+
+    async def _fetchSummary(self, preferenceCommands):
+        data = {
+            "channelID": self.channelId,
+            "preferences": [pref.normalized() for pref in preferenceCommands],
+        }
+        return (await self._post("/process-preferred-task-summary", data)).text
+
+    # {key: summary} for {key: preference list} in one call, or None when the
+    # server has no batch endpoint
+    async def _fetchSummaries(self, preferenceLists):
+        if self.batching is False:
+            return None
+        data = {
+            "channelID": self.channelId,
+            "batches": [{"preferences": [pref.normalized() for pref in prefs]} for prefs in preferenceLists.values()],
+        }
+        try:
+            summaries = (await self._post("/process-preferred-task-summaries", data)).json()["summaries"]
+        except GenlyApiError as error:
+            if error.status not in (404, 405):
+                raise
+            self.batching = False
+            return None
+        self.batching = True
+        return dict(zip(preferenceLists, summaries))
+
+    async def _post(self, path, data):
+        client = getAsyncHttpClient()
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt * (0.5 + random.random() / 2)
+            try:
+                response = await client.post(self.url + path, headers=self.headers, content=json.dumps(data),
+                                             timeout=self.timeout)
+            except httpx.TransportError as error:
+                if attempt == self.retries:
+                    raise GenlyApiError(f"{path} failed: {type(error).__name__}: {error}") from error
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code >= 400:
+                        raise GenlyApiError(f"{path} returned {response.status_code}: {response.text[:200]}",
+                                        response.status_code)
+                    return response
+                if attempt == self.retries:
+                    raise GenlyApiError(f"{path} returned {response.status_code} after {attempt + 1} attempts",
+                                        response.status_code)
+                retryAfter = response.headers.get("Retry-After", "")
+                if re.fullmatch(r"\d+(\.\d+)?", retryAfter):
+                    delay = max(delay, float(retryAfter))
+            await asyncio.sleep(delay)
+
 
-    prefCmd1 = PreferenceCommand("Add new contacts to my CRM system", "CRM", ["Salesforce", "HubSpot"])
-    prefCmd2 = PreferenceCommand("Add new songs to my playlist", "Entertainment", ["Spotify", "Youtube"])
-    print(genlyApi.generatePreferredTaskSummary([prefCmd1, prefCmd2]))
+_api = None
+_apiLock = threading.Lock()
 
+def getGenlyApi():
+    global _api
+    with _apiLock:
+        if _api is None:
+            _api = AsyncGenlyApi(
+                os.getenv("GENLY_API_URL", ""),
+                channelId=os.getenv("GENLY_API_STREAMLIT_CHANNELID"),
+                timeout=float(os.getenv("GENLY_API_TIMEOUT_SECONDS", os.getenv("HTTP_TIMEOUT_SECONDS", "60"))),
+                retries=int(os.getenv("GENLY_API_MAX_RETRIES", "3")),
+                cacheTtl=float(os.getenv("GENLY_SUMMARY_TTL_SECONDS", "600")),
+                maxConcurrency=int(os.getenv("GENLY_API_MAX_CONCURRENCY", "4")),
+            )
+        return _api
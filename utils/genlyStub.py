@@ -0,0 +1,116 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the Genly API with the endpoints the app calls. It
+# answers with deterministic bodies built from the request, can add latency
+# and can fail the first `failures` requests with 503 (with a Retry-After of
+# `retryAfter` seconds when set) to exercise retries. With batching=False it
+# has no batch summary endpoint, like an older server.
+# Every request body is kept in `requests` so callers can check what was sent.
+#
+#   with GenlyStubServer(delay=0.2, failures=1) as stub:
+#       api = AsyncGenlyApi(stub.url)
+class GenlyStubServer:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, failures=0, retryAfter=None, batching=True):
+        self.delay = delay
+        self.batching = batching
+        self.failures = failures
+        self.retryAfter = retryAfter
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="genly-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _respond(self, path, body):
+        with self._lock:
+            self.requests.append((path, body))
+            fail = self.failures > 0
+            if fail:
+                self.failures -= 1
+        time.sleep(self.delay)
+        if fail:
+            return 503, "text/plain", "stub failure"
+        if path == "/process-preferred-task-summary":
+            return 200, "text/plain", self._summary(body.get("channelID"), body.get("preferences", []))
+        if path == "/process-preferred-task-summaries" and self.batching:
+            summaries = [self._summary(body.get("channelID"), batch.get("preferences", []))
+                         for batch in body.get("batches", [])]
+            return 200, "application/json", json.dumps({"summaries": summaries})
+        if path == "/generate-provider-recommendations":
+            recommendations = [{"command": command, "providers": ["stub-provider"]} for command in body.get("commands", [])]
+            return 200, "application/json", json.dumps({"recommendations": recommendations})
+        return 404, "text/plain", "not found"
+
+    @staticmethod
+    def _summary(channelId, preferences):
+        lines = [f"Channel: {channelId}", "Plan Summary:"]
+        for index, pref in enumerate(preferences, 1):
+            providers = ", ".join(pref.get("providersToUse") or [])
+            lines.append(f"{index}. {pref.get('command')} [{pref.get('capabilityCategory')}] via {providers}")
+        return "\n".join(lines)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = {}
+                status, contentType, text = stub._respond(self.path, body)
+                data = text.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(data)))
+                if status == 503 and stub.retryAfter is not None:
+                    self.send_header("Retry-After", str(stub.retryAfter))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Genly API stub (point GENLY_API_URL at it)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--failures", type=int, default=0, help="answer the first N requests with 503")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with the 503s")
+    parser.add_argument("--no-batching", action="store_true", help="leave out the batch summary endpoint")
+    args = parser.parse_args()
+    stub = GenlyStubServer(port=args.port, delay=args.delay, failures=args.failures, retryAfter=args.retry_after,
+                           batching=not args.no_batching)
+    print(f"Genly API stub listening on {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
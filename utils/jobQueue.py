@@ -0,0 +1,274 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import deque, OrderedDict
+from dotenv import load_dotenv
+from utils.pipeline import runPipeline, PipelineHooks
+from utils.resultStore import getPipelineResultStore
+from utils.llmScheduler import setRequester
+from utils.telemetry import registry
+
+load_dotenv()
+
+jobCount = registry.counter("genly_jobs_total", "Jobs by outcome (accepted, rejected, succeeded, failed, error, cancelled)")
+jobGauge = registry.gauge("genly_job_queue", "Queued and running jobs")
+jobWait = registry.histogram("genly_job_wait_seconds", "Time jobs spend queued before a worker takes them")
+
+# Events kept per job for /events; a client that connects late sees the
+# last JOB_MAX_EVENTS (the seq numbers show what was skipped)
+JOB_MAX_EVENTS = int(os.getenv("JOB_MAX_EVENTS", "5000"))
+
+
+class QueueFull(Exception):
+    def __init__(self, retryAfter):
+        super().__init__(f"Job queue is full; retry in {retryAfter}s")
+        self.retryAfter = retryAfter
+
+
+class Job:
+    def __init__(self, command, context=None, analyze=True, session=None, reuse=False):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.context = context
+        self.analyze = analyze
+        self.session = session
+        self.reuse = reuse
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.events = deque(maxlen=JOB_MAX_EVENTS)
+        self.seq = 0
+        self._task = None
+        self._changed = asyncio.get_running_loop().create_future()
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed", "error", "cancelled")
+
+    def emit(self, type, **fields):
+        self.seq += 1
+        self.events.append({"seq": self.seq, "type": type, **fields})
+        changed, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        changed.set_result(None)
+
+    # Events with seq > `after` as they happen, until the job is done
+    async def follow(self, after=0):
+        while True:
+            changed = self._changed
+            for event in list(self.events):
+                if event["seq"] > after:
+                    after = event["seq"]
+                    yield event
+            if self.done:
+                return
+            await changed
+
+    def toDict(self):
+        return {
+            "id": self.id,
+            "command": self.command,
+            "session": self.session,
+            "reuse": self.reuse,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result.toDict() if self.result else None,
+            "error": self.error,
+        }
+
+
+# Turns pipeline callbacks into job events
+class JobHooks(PipelineHooks):
+    def __init__(self, job):
+        self.job = job
+
+    def onStage(self, stage):
+        self.job.emit("stage", stage=stage)
+
+    def generationStream(self):
+        return lambda text: self.job.emit("generation", text=text)
+
+    def onGenerated(self, response):
+        self.job.emit("generated", response=response)
+
+    def executionStream(self):
+        return lambda stream, text: self.job.emit("output", stream=stream, text=text)
+
+    def onExecuted(self, result):
+        self.job.emit("executed", failed=result.failed, exitCode=result.exitCode)
+
+    def correctionStream(self, index):
+        return lambda text: self.job.emit("correction", attempt=index + 1, text=text)
+
+    def onCorrection(self, candidate):
+        self.job.emit("attempt", attempt=candidate.index + 1, failed=candidate.failed)
+
+    def onRepairStopped(self, repair):
+        self.job.emit("repairStopped", reason=repair.reason)
+
+    def analysisStream(self):
+        return lambda text: self.job.emit("analysis", text=text)
+
+    def onAnalysis(self, analysis):
+        self.job.emit("analyzed", analysis=analysis)
+
+
+# Bounded job queue served by `workers` tasks on the running event loop.
+# submit() rejects work with QueueFull once `maxQueued` jobs are waiting, with
+# a retry hint from the recent job durations, so callers get backpressure
+# instead of unbounded latency. Finished jobs are kept for `ttl` seconds (at
+# most `maxJobs` of them) for polling. Identical jobs running at the same time
+# share one pipeline run through the PipelineResultStore; a job only gets an
+# earlier job's stored result when it asks for it with `reuse`. Jobs with the
+# same `session` key run one at a time in one persistent Python session and
+# always run themselves.
+class JobQueue:
+    def __init__(self, workers=4, maxQueued=16, maxJobs=1000, ttl=3600, llmSlots=None, execSlots=None):
+        self.workers = workers
+        self.maxQueued = maxQueued
+        self.maxJobs = maxJobs
+        self.ttl = ttl
+        self.llmSlots = llmSlots
+        self.execSlots = execSlots
+        self.running = 0
+        self.accepting = True
+        self._queue = asyncio.Queue(maxsize=maxQueued)
+        self._jobs = OrderedDict()
+        self._durations = deque(maxlen=50)
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        return self
+
+    # Stop taking jobs and give running ones up to `grace` seconds
+    async def stop(self, grace=30):
+        self.accepting = False
+        for job in list(self._jobs.values()):
+            if job.status == "queued":
+                self._finish(job, "cancelled")
+        running = [job._task for job in self._jobs.values() if job._task and not job._task.done()]
+        if running:
+            await asyncio.wait(running, timeout=grace)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {"workers": self.workers, "running": self.running, "queued": self.queued,
+                "maxQueued": self.maxQueued, "jobs": len(self._jobs), "accepting": self.accepting}
+
+    # Seconds until a queue slot is likely to free up
+    def retryAfter(self):
+        average = sum(self._durations) / len(self._durations) if self._durations else 10.0
+        return max(1, round(average * (self.queued + 1) / self.workers))
+
+    def submit(self, command, context=None, analyze=True, session=None, reuse=False):
+        if not self.accepting:
+            raise QueueFull(self.retryAfter())
+        job = Job(command, context, analyze, session, reuse)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            jobCount.inc(outcome="rejected")
+            raise QueueFull(self.retryAfter())
+        self._evict()
+        self._jobs[job.id] = job
+        jobCount.inc(outcome="accepted")
+        self._report()
+        job.emit("queued", position=self.queued)
+        return job
+
+    def get(self, jobId):
+        return self._jobs.get(jobId)
+
+    def cancel(self, job):
+        if job.done:
+            return False
+        if job._task is not None:
+            job._task.cancel()
+        else:
+            # The worker skips it when it comes up
+            self._finish(job, "cancelled")
+        return True
+
+    def _evict(self):
+        now = time.time()
+        for jobId, job in list(self._jobs.items()):
+            if len(self._jobs) < self.maxJobs and not (job.done and now - job.finished > self.ttl):
+                continue
+            if job.done:
+                del self._jobs[jobId]
+
+    def _report(self):
+        jobGauge.set(self.queued, state="queued")
+        jobGauge.set(self.running, state="running")
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        jobCount.inc(outcome=status)
+        job.emit("done", status=status, error=error, result=job.result.toDict() if job.result else None)
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.done:
+                    continue
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        job.started = time.time()
+        jobWait.observe(job.started - job.created)
+        self.running += 1
+        self._report()
+        job.emit("started")
+        job._task = asyncio.create_task(self._pipeline(job))
+        try:
+            job.result = await job._task
+            self._finish(job, "succeeded" if job.result.success else "failed")
+        except asyncio.CancelledError:
+            if not job._task.cancelled():
+                # The worker itself is being stopped
+                job._task.cancel()
+                self._finish(job, "cancelled")
+                raise
+            self._finish(job, "cancelled")
+        except Exception as error:
+            self._finish(job, "error", f"{type(error).__name__}: {error}")
+        finally:
+            self.running -= 1
+            self._durations.append(time.time() - job.started)
+            self._report()
+
+    async def _pipeline(self, job):
+        # Jobs yield the LLM to interactive use and take turns by session
+        setRequester(job.session or job.id, background=True)
+        hooks = JobHooks(job)
+        run = lambda: runPipeline(job.command, job.context, hooks=hooks, analyze=job.analyze, llmSlots=self.llmSlots,
+                                  execSlots=self.execSlots, session=job.session)
+        # A run in a session depends on the jobs before it, so it is never shared
+        if job.session:
+            return await run()
+        store = getPipelineResultStore()
+        key = store.key(job.command, None, job.context)
+        if not job.analyze:
+            key += ":no-analysis"
+        result, ran = await store.run(key, run, keep=job.reuse)
+        if not ran:
+            result.replay(hooks)
+        return result
@@ -0,0 +1,120 @@
+# Persistent Python process for conversation sessions (utils/sessions.py).
+# Started as `python -u kernel.py` on this machine or inside a sandbox; only
+# uses the standard library. Every line on stdin is a JSON cell
+# {"id": ..., "code": ...}; the code runs in one namespace that lives as long
+# as the process, so variables and imports carry over between commands. A cell
+# that fails leaves the namespace bound to what it was before the cell, so an
+# attempt that went wrong (e.g. one of several repair candidates) does not
+# leave half its globals behind; objects it changed in place stay changed. After
+# each cell a SENTINEL-prefixed line goes to stderr and then one with the
+# outcome and a summary of the namespace to stdout (output that did not end
+# with a newline runs straight into it):
+#
+#   \x1e{"id": ..., "stream": "stderr"}
+#   \x1e{"id": ..., "stream": "stdout", "ok": true, "rss": ..., "state": {...}}
+import os
+import io
+import sys
+import json
+import site
+import types
+import builtins
+import importlib
+import traceback
+
+SENTINEL = "\x1e"
+MAX_STATE_ITEMS = 40
+MAX_REPR_CHARS = 60
+
+
+def _extendPath():
+    paths = os.environ.get("GENLY_KERNEL_PATH", "").split(os.pathsep)
+    for path in paths + [site.getusersitepackages()]:
+        if path and os.path.isdir(path) and path not in sys.path:
+            sys.path.append(path)
+    # Packages installed since the last cell must be importable
+    importlib.invalidate_caches()
+
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return 0
+
+
+def _describe(value):
+    text = type(value).__name__
+    shape = getattr(value, "shape", None)
+    if isinstance(shape, tuple):
+        text += f" {shape}"
+    elif isinstance(value, (list, tuple, dict, set)):
+        text += f" of {len(value)}"
+    elif isinstance(value, (str, int, float, bool)):
+        short = repr(value)
+        text += f" = {short if len(short) <= MAX_REPR_CHARS else short[:MAX_REPR_CHARS] + '...'}"
+    return text
+
+
+def _state(namespace):
+    modules, variables, functions = [], [], []
+    for name, value in namespace.items():
+        if name.startswith("_"):
+            continue
+        if isinstance(value, types.ModuleType):
+            modules.append(name if value.__name__ == name else f"{name} ({value.__name__})")
+        elif isinstance(value, (types.FunctionType, type)):
+            functions.append(name)
+        else:
+            variables.append(f"{name}: {_describe(value)}")
+    try:
+        files = sorted(os.listdir("."))
+    except OSError:
+        files = []
+    return {
+        "modules": modules[:MAX_STATE_ITEMS],
+        "variables": variables[:MAX_STATE_ITEMS],
+        "functions": functions[:MAX_STATE_ITEMS],
+        "files": [name for name in files if not name.startswith(".")][:MAX_STATE_ITEMS],
+    }
+
+
+def main():
+    protocol = sys.stdin
+    # input() in generated code must not swallow the next cell
+    sys.stdin = io.StringIO("")
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    for count, line in enumerate(protocol, 1):
+        try:
+            cell = json.loads(line)
+        except ValueError:
+            continue
+        _extendPath()
+        ok = True
+        snapshot = dict(namespace)
+        try:
+            exec(compile(cell["code"], f"<cell {count}>", "exec"), namespace)
+        except SystemExit as error:
+            ok = error.code in (None, 0)
+        except BaseException as error:
+            ok = False
+            # Leave the kernel's own frame out of the traceback
+            traceback.print_exception(type(error), error, error.__traceback__.tb_next)
+        if not ok:
+            namespace.clear()
+            namespace.update(snapshot)
+        sys.stdout.flush()
+        sys.stderr.write(SENTINEL + json.dumps({"id": cell.get("id"), "stream": "stderr"}) + "\n")
+        sys.stderr.flush()
+        status = {"id": cell.get("id"), "stream": "stdout", "ok": ok, "rss": _rss(), "state": _state(namespace)}
+        sys.stdout.write(SENTINEL + json.dumps(status) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
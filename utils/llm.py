@@ -0,0 +1,161 @@
+import os
+import sys
+import threading
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from utils.fenceParser import FenceParser
+from utils.telemetry import span, llmTokens
+from utils.llmScheduler import getLlmScheduler, estimateTokens, RATE_LIMIT_STATUSES
+
+load_dotenv()
+
+LOG_PROMPT_USAGE = os.getenv("LOG_PROMPT_USAGE", "False") == "True"
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "2"))
+
+
+# Token totals of every LLM call made while it is the active tracker.
+# inputTokens counts uncached input only; prompt-cache reads and writes are
+# counted separately.
+class Usage:
+    def __init__(self):
+        self.inputTokens = 0
+        self.outputTokens = 0
+        self.cacheReadTokens = 0
+        self.cacheWriteTokens = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def totalTokens(self):
+        return self.inputTokens + self.cacheReadTokens + self.cacheWriteTokens + self.outputTokens
+
+    # Share of the prompt tokens that were served from the prompt cache
+    @property
+    def cacheHitRate(self):
+        prompt = self.inputTokens + self.cacheReadTokens + self.cacheWriteTokens
+        return self.cacheReadTokens / prompt if prompt else 0.0
+
+    def add(self, usage):
+        with self._lock:
+            self.inputTokens += usage.input_tokens
+            self.outputTokens += usage.output_tokens
+            self.cacheReadTokens += getattr(usage, "cache_read_input_tokens", None) or 0
+            self.cacheWriteTokens += getattr(usage, "cache_creation_input_tokens", None) or 0
+            self.calls += 1
+
+    # Add the counts of another Usage, e.g. of the tasks of a plan
+    def merge(self, other):
+        with self._lock:
+            self.inputTokens += other.inputTokens
+            self.outputTokens += other.outputTokens
+            self.cacheReadTokens += other.cacheReadTokens
+            self.cacheWriteTokens += other.cacheWriteTokens
+            self.calls += other.calls
+
+    def toDict(self):
+        return {
+            "inputTokens": self.inputTokens,
+            "outputTokens": self.outputTokens,
+            "cacheReadTokens": self.cacheReadTokens,
+            "cacheWriteTokens": self.cacheWriteTokens,
+            "cacheHitRate": round(self.cacheHitRate, 3),
+            "calls": self.calls,
+        }
+
+
+# Process-wide totals per prompt label, e.g. "correction"
+_promptUsage = {}
+_promptUsageLock = threading.Lock()
+
+def promptUsage():
+    with _promptUsageLock:
+        return {label: usage.toDict() for label, usage in _promptUsage.items()}
+
+
+def _recordPromptUsage(label, usage):
+    with _promptUsageLock:
+        total = _promptUsage.setdefault(label, Usage())
+    total.add(usage)
+
+
+# Every token of one response, cached prompt tokens included
+def totalTokens(usage):
+    return (usage.input_tokens + usage.output_tokens + (getattr(usage, "cache_read_input_tokens", None) or 0)
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0))
+
+
+_usage = ContextVar("usage", default=None)
+
+# Start counting tokens for the current task and the tasks it spawns
+def trackUsage():
+    usage = Usage()
+    _usage.set(usage)
+    return usage
+
+
+# Run a messages request through the Anthropic streaming API. Text deltas go to
+# onText as they arrive and every closed ``` block goes to onFence(lang, body)
+# right away, so callers can act on the pip block before the code is finished.
+# Returns the final Message, same as messages.create would. `label` names the
+# prompt in promptUsage() and in the per-call token line on stderr, and picks
+# its priority in the LLM scheduler, which every call waits for. A call the
+# API still rate limits after the SDK's own retries goes back to the scheduler
+# (and so waits out the backoff) up to LLM_RATE_LIMIT_RETRIES times, as long
+# as none of its text was streamed yet.
+async def streamMessage(client, onText=None, onFence=None, label=None, **kwargs):
+    scheduler = getLlmScheduler()
+    estimate = estimateTokens(kwargs)
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        parser = FenceParser() if onFence else None
+        streamed = False
+        with span(f"llm.{label}" if label else "llm", prompt=label or "", model=kwargs.get("model") or "") as current:
+            grant = await scheduler.acquire(estimate, label)
+            current.set(queued=round(grant.waited, 3), attempt=attempt)
+            try:
+                async with client.messages.stream(**kwargs) as stream:
+                    async for text in stream.text_stream:
+                        streamed = True
+                        if onText:
+                            onText(text)
+                        if parser:
+                            for lang, body in parser.feed(text):
+                                onFence(lang, body)
+                    message = await stream.get_final_message()
+            except Exception as error:
+                if getattr(error, "status_code", None) in RATE_LIMIT_STATUSES and not streamed \
+                        and attempt < LLM_RATE_LIMIT_RETRIES:
+                    continue
+                raise
+            usage = message.usage
+            tokens = {
+                "input": usage.input_tokens,
+                "output": usage.output_tokens,
+                "cache_read": getattr(usage, "cache_read_input_tokens", None) or 0,
+                "cache_write": getattr(usage, "cache_creation_input_tokens", None) or 0,
+            }
+            # Cache reads do not count towards the input tokens rate limit
+            scheduler.settle(grant, totalTokens(usage) - tokens["cache_read"])
+            current.set(**{f"tokens.{kind}": count for kind, count in tokens.items()})
+            for kind, count in tokens.items():
+                llmTokens.inc(count, prompt=label or "", kind=kind)
+        break
+    if _usage.get() is not None:
+        _usage.get().add(message.usage)
+    if label:
+        _recordPromptUsage(label, message.usage)
+        if LOG_PROMPT_USAGE:
+            usage = message.usage
+            print(f"[llm] {label}: {usage.input_tokens} input, {getattr(usage, 'cache_read_input_tokens', None) or 0} cache read, "
+                  f"{getattr(usage, 'cache_creation_input_tokens', None) or 0} cache write, {usage.output_tokens} output tokens",
+                  file=sys.stderr)
+    return message
+
+
+# Feed an already complete response (e.g. from the response cache) through the
+# same callbacks streamMessage would have used
+def replayText(text, onText=None, onFence=None):
+    if onText:
+        onText(text)
+    if onFence:
+        for lang, body in FenceParser().feed(text):
+            onFence(lang, body)
@@ -0,0 +1,313 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from datetime import datetime
+from dotenv import load_dotenv
+from utils.telemetry import registry
+
+load_dotenv()
+
+queueDepth = registry.gauge("genly_llm_queue_depth", "LLM requests waiting for the scheduler by priority class")
+queueWait = registry.histogram("genly_llm_queue_wait_seconds", "Time LLM requests waited for the scheduler by priority class")
+rateLimited = registry.counter("genly_llm_rate_limited_total", "Anthropic responses that were rate limited (429) or overloaded (529)")
+bucketGauge = registry.gauge("genly_llm_bucket", "Scheduler token buckets by bucket (requests, tokens) and field (level, capacity)")
+backoffGauge = registry.gauge("genly_llm_backoff_seconds", "Seconds left until the scheduler lets requests through again")
+
+RATE_LIMIT_STATUSES = (429, 529)
+
+# Priority of each prompt (its label in streamMessage); lower goes first. The
+# first answer to a command is what a user waits for, the analysis comes last.
+STAGE_PRIORITIES = {
+    "generation": 0,
+    "task-generation": 0,
+    "task-step": 0,
+    "correction": 1,
+    "analysis": 2,
+}
+STAGE_NAMES = ("generation", "correction", "analysis")
+
+
+# Requests per minute or tokens per minute. A bucket with no capacity does not
+# limit anything until the rate-limit headers of a response tell it the limit.
+class TokenBucket:
+    def __init__(self, name, perMinute=0):
+        self.name = name
+        self.capacity = float(perMinute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    # Seconds until `amount` can be taken; requests larger than the bucket
+    # wait for a full bucket
+    def delay(self, amount, now):
+        self._refill(now)
+        if not self.capacity:
+            return 0.0
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    # Negative amounts give back what an estimate took too much; the level may
+    # go below zero when a response used more than was estimated
+    def take(self, amount, now):
+        self._refill(now)
+        if self.capacity:
+            self.level = min(self.capacity, self.level - amount)
+
+    # Adopt what the API reports: a lower limit than configured, and a lower
+    # remaining count than this bucket believes
+    def sync(self, limit, remaining, now):
+        self._refill(now)
+        if limit and (not self.capacity or limit < self.capacity):
+            self.level = limit if not self.capacity else self.level * limit / self.capacity
+            self.capacity = float(limit)
+        if remaining is not None and self.capacity:
+            self.level = min(self.level, remaining)
+
+    def report(self):
+        bucketGauge.set(round(self.level, 1), bucket=self.name, field="level")
+        bucketGauge.set(self.capacity, bucket=self.name, field="capacity")
+
+
+class _Waiter:
+    def __init__(self, priority, requester, cost, loop):
+        self.priority = priority
+        self.requester = requester
+        self.cost = cost
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+        self.enqueued = time.monotonic()
+
+
+# What a granted request took from the token bucket; settle() corrects it once
+# the response says how many tokens the call used
+class Grant:
+    def __init__(self, cost, waited):
+        self.cost = cost
+        self.waited = waited
+
+
+_requester = ContextVar("llmRequester", default=(None, False))
+
+# Name who the LLM calls of the current task (and the tasks it spawns) are
+# made for. Waiting calls of different requesters take turns within a
+# priority class; background requesters (batch runs, service jobs) only get
+# through when no interactive call of any class is waiting.
+def setRequester(requester, background=False):
+    _requester.set((requester, background))
+
+
+# Admits LLM calls of every session of the process, across event loops,
+# within a requests-per-minute and a tokens-per-minute budget. Waiting calls
+# go by priority class (interactive before background, then by stage), and
+# round robin between requesters within a class, oldest call first for each.
+# A 429/529 stops all admissions for the retry-after the API asked for, or for
+# an exponential backoff when it gave none; the remaining-requests/tokens
+# headers of every response keep the buckets in line with the API's own count.
+class LlmScheduler:
+    def __init__(self, requestsPerMinute=0, tokensPerMinute=0, backoff=1.0, maxBackoff=60.0):
+        self.requests = TokenBucket("requests", requestsPerMinute)
+        self.tokens = TokenBucket("tokens", tokensPerMinute)
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.pausedUntil = 0.0
+        self.rateLimited = 0
+        self._strikes = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def priorityOf(label, background=False):
+        stage = STAGE_PRIORITIES.get(label, 0)
+        return stage + (len(STAGE_NAMES) if background else 0)
+
+    @staticmethod
+    def className(priority):
+        return ("background" if priority >= len(STAGE_NAMES) else "interactive") + "/" + STAGE_NAMES[
+            priority % len(STAGE_NAMES)]
+
+    # Wait until a call of `label` estimated at `cost` tokens may go out
+    async def acquire(self, cost, label=None):
+        requester, background = _requester.get()
+        waiter = _Waiter(self.priorityOf(label, background), requester, cost, asyncio.get_running_loop())
+        with self._lock:
+            self._queues.setdefault(waiter.priority, OrderedDict()).setdefault(requester, deque()).append(waiter)
+            delay = self._dispatch()
+        try:
+            while not waiter.granted:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), max(delay, 0.005))
+                except asyncio.TimeoutError:
+                    pass
+                with self._lock:
+                    delay = self._dispatch()
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    self._remove(waiter)
+                self._dispatch()
+            raise
+        waited = time.monotonic() - waiter.enqueued
+        queueWait.observe(waited, priority=self.className(waiter.priority))
+        return Grant(cost, waited)
+
+    # Charge what the call really used instead of the estimate
+    def settle(self, grant, tokens):
+        with self._lock:
+            self.tokens.take(tokens - grant.cost, time.monotonic())
+            grant.cost = tokens
+            self._dispatch()
+
+    # Rate-limit headers and status of an Anthropic response; called by the
+    # client transport for every response, SDK retries included
+    def observe(self, status, headers):
+        now = time.monotonic()
+        with self._lock:
+            for bucket, kinds in ((self.requests, ("requests",)), (self.tokens, ("tokens", "input-tokens"))):
+                for kind in kinds:
+                    limit = _number(headers.get(f"anthropic-ratelimit-{kind}-limit"))
+                    remaining = _number(headers.get(f"anthropic-ratelimit-{kind}-remaining"))
+                    if limit is None and remaining is None:
+                        continue
+                    bucket.sync(limit, remaining, now)
+                    if remaining is not None and remaining <= 0:
+                        self._pause(_untilReset(headers.get(f"anthropic-ratelimit-{kind}-reset")), now)
+                    break
+            if status in RATE_LIMIT_STATUSES:
+                rateLimited.inc(status=status)
+                self.rateLimited += 1
+                retryAfter = _number(headers.get("retry-after"))
+                if retryAfter is None:
+                    retryAfter = min(self.maxBackoff, self.backoff * 2 ** self._strikes)
+                self._strikes += 1
+                self._pause(retryAfter, now)
+            elif status < 400:
+                self._strikes = 0
+            self._dispatch()
+
+    def _pause(self, seconds, now):
+        if seconds:
+            self.pausedUntil = max(self.pausedUntil, now + min(seconds, self.maxBackoff))
+
+    def _remove(self, waiter):
+        requesters = self._queues.get(waiter.priority, {})
+        queue = requesters.get(waiter.requester)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del requesters[waiter.requester]
+
+    # Admit waiting calls in order while the budget allows; returns the
+    # seconds until the next one could go out (0 when nothing waits)
+    def _dispatch(self):
+        now = time.monotonic()
+        delay = 0.0
+        if now < self.pausedUntil:
+            delay = self.pausedUntil - now
+        else:
+            for priority in sorted(self._queues):
+                requesters = self._queues[priority]
+                while requesters:
+                    requester, queue = next(iter(requesters.items()))
+                    waiter = queue[0]
+                    delay = max(self.requests.delay(1, now), self.tokens.delay(waiter.cost, now))
+                    if delay:
+                        break
+                    self.requests.take(1, now)
+                    self.tokens.take(waiter.cost, now)
+                    queue.popleft()
+                    # The requester goes to the back of its class
+                    del requesters[requester]
+                    if queue:
+                        requesters[requester] = queue
+                    waiter.granted = True
+                    try:
+                        waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+                    except RuntimeError:
+                        # The waiter's loop is closed; nobody is left to wake
+                        pass
+                if delay:
+                    break
+        self._report(now)
+        return delay
+
+    def _report(self, now):
+        for priority, requesters in self._queues.items():
+            queueDepth.set(sum(len(queue) for queue in requesters.values()), priority=self.className(priority))
+        self.requests.report()
+        self.tokens.report()
+        backoffGauge.set(round(max(0.0, self.pausedUntil - now), 3))
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "waiting": {self.className(priority): sum(len(queue) for queue in requesters.values())
+                            for priority, requesters in sorted(self._queues.items())},
+                "requests": {"level": round(self.requests.level, 1), "capacity": self.requests.capacity},
+                "tokens": {"level": round(self.tokens.level, 1), "capacity": self.tokens.capacity},
+                "backoffSeconds": round(max(0.0, self.pausedUntil - now), 3),
+                "rateLimited": self.rateLimited,
+            }
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Seconds until an RFC 3339 reset time, e.g. "2024-05-01T12:00:30Z"
+def _untilReset(value):
+    if not value:
+        return None
+    try:
+        reset = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return max(0.0, reset.timestamp() - time.time())
+
+
+# Prompt tokens of a messages request at ~4 characters per token, plus nothing
+# for the output: the call is charged its real usage once it finished
+def estimateTokens(request):
+    characters = sum(len(block.get("text", "")) for block in request.get("system") or [] if isinstance(block, dict))
+    if isinstance(request.get("system"), str):
+        characters += len(request["system"])
+    for message in request.get("messages", []):
+        content = message["content"]
+        characters += len(content) if isinstance(content, str) else sum(
+            len(block.get("text", "")) for block in content if isinstance(block, dict))
+    return max(1, characters // 4)
+
+
+_scheduler = None
+_schedulerLock = threading.Lock()
+
+# LLM_REQUESTS_PER_MINUTE and LLM_TOKENS_PER_MINUTE set the budgets (0 learns
+# them from the API's rate-limit headers); LLM_BACKOFF_SECONDS doubles per
+# consecutive 429 without retry-after, up to LLM_MAX_BACKOFF_SECONDS
+def getLlmScheduler():
+    global _scheduler
+    with _schedulerLock:
+        if _scheduler is None:
+            _scheduler = LlmScheduler(
+                requestsPerMinute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+                tokensPerMinute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+                backoff=float(os.getenv("LLM_BACKOFF_SECONDS", "1")),
+                maxBackoff=float(os.getenv("LLM_MAX_BACKOFF_SECONDS", "60")),
+            )
+        return _scheduler
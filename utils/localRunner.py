@@ -0,0 +1,176 @@
+import os
+import sys
+import shutil
+import codecs
+import signal
+import tempfile
+import threading
+import subprocess
+from dotenv import load_dotenv
+from utils.executionResult import ExecutionResult
+from utils.artifactStore import getArtifactStore, ArtifactTooLarge
+from utils.outputStream import OutputStream
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+load_dotenv()
+
+
+# Runs generated code on this machine. Every run gets its own temporary
+# directory and subprocess, output is read from a pipe into an OutputStream as
+# it is produced, and CPU, memory and wall-clock limits are applied per run. At most maxParallel runs execute
+# at once; further runs wait for a free slot.
+class LocalRunner:
+    def __init__(self, maxParallel=4, timeout=300, cpuSeconds=None, memoryBytes=None, sharedFiles=()):
+        self.timeout = timeout
+        self.cpuSeconds = cpuSeconds
+        self.memoryBytes = memoryBytes
+        self.sharedFiles = [os.path.abspath(path) for path in sharedFiles]
+        self._slots = threading.BoundedSemaphore(maxParallel)
+
+    # Start a run; blocks until a slot is free. Call wait() on the result to
+    # collect the ExecutionResult and release the slot.
+    def start(self, code, python=None, timeout=None, output=None):
+        self._slots.acquire()
+        try:
+            return LocalRun(self, code, python or sys.executable, self.timeout if timeout is None else timeout, output)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def run(self, code, python=None, timeout=None, output=None):
+        return self.start(code, python, timeout, output).wait()
+
+    # preexec_fn for the run's Popen, or None when no limit is configured:
+    # runs start from the executor's thread pool, where preexec_fn can
+    # deadlock the child, so it is only used when there is a limit to set
+    def preexec(self):
+        if os.name != "posix" or resource is None or not (self.cpuSeconds or self.memoryBytes):
+            return None
+        return self._limits
+
+    def _limits(self):
+        if self.cpuSeconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (self.cpuSeconds, self.cpuSeconds))
+        if self.memoryBytes:
+            resource.setrlimit(resource.RLIMIT_AS, (self.memoryBytes, self.memoryBytes))
+
+
+class LocalRun:
+    def __init__(self, runner, code, python, timeout, output=None):
+        self.runner = runner
+        self.timeout = timeout
+        self.output = output or OutputStream()
+        self._ownsOutput = output is None
+        self.dir = tempfile.mkdtemp(prefix="genly-run-")
+        self._done = False
+        try:
+            # Files the generated code expects next to it, e.g. OAuth credentials.json
+            for path in runner.sharedFiles:
+                if os.path.exists(path):
+                    os.symlink(path, os.path.join(self.dir, os.path.basename(path)))
+            os.makedirs(os.path.join(self.dir, "artifacts"))
+            with open(os.path.join(self.dir, "main.py"), "w") as file:
+                file.write(code)
+            self.process = subprocess.Popen(
+                [python, "main.py"],
+                cwd=self.dir,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                # Unbuffered, so prints show up while the script is still running
+                env=dict(os.environ, PYTHONUNBUFFERED="1"),
+                start_new_session=os.name == "posix",
+                preexec_fn=runner.preexec(),
+            )
+        except BaseException:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            raise
+        self._reader = threading.Thread(target=self._read, name="local-run-output", daemon=True)
+        self._reader.start()
+
+    # Copy whatever the process writes into the output stream, chunk by chunk
+    # rather than line by line so progress output without newlines shows too
+    def _read(self):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pipe = self.process.stdout
+        while True:
+            chunk = pipe.read1(65536)
+            if not chunk:
+                break
+            self.output.write(decoder.decode(chunk))
+        self.output.write(decoder.decode(b"", final=True))
+        pipe.close()
+
+    def wait(self):
+        errors = ""
+        timedOut = False
+        try:
+            try:
+                self.process.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self.kill()
+                self.process.wait()
+                errors = f"Execution timed out after {self.timeout}s"
+                timedOut = True
+            self._reader.join()
+            artifacts = self._artifacts() + self.output.spilledArtifacts()
+            return ExecutionResult(self.output.text("stdout"), errors, artifacts,
+                                   exitCode=self.process.returncode, timedOut=timedOut)
+        finally:
+            self._finish()
+
+    def _artifacts(self):
+        artifacts = []
+        store = getArtifactStore()
+        for folder, _, names in os.walk(os.path.join(self.dir, "artifacts")):
+            for name in sorted(names):
+                path = os.path.join(folder, name)
+                if os.path.islink(path):
+                    continue
+                try:
+                    artifacts.append(store.ingestFile(path, name))
+                except ArtifactTooLarge:
+                    continue
+        return artifacts
+
+    def kill(self):
+        if self.process.poll() is not None:
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except ProcessLookupError:
+            pass
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        if self._ownsOutput:
+            self.output.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.runner._slots.release()
+
+
+_runner = None
+_runnerLock = threading.Lock()
+
+def getLocalRunner():
+    global _runner
+    with _runnerLock:
+        if _runner is None:
+            memoryMb = int(os.getenv("LOCAL_RUN_MEMORY_MB", "0"))
+            _runner = LocalRunner(
+                maxParallel=int(os.getenv("LOCAL_RUN_MAX_PARALLEL", "4")),
+                timeout=float(os.getenv("LOCAL_RUN_TIMEOUT_SECONDS", os.getenv("EXECUTOR_TIMEOUT_SECONDS", "300"))),
+                cpuSeconds=int(os.getenv("LOCAL_RUN_CPU_SECONDS", "0")) or None,
+                memoryBytes=memoryMb * 1024 * 1024 or None,
+                sharedFiles=[name for name in os.getenv("LOCAL_RUN_SHARED_FILES", "credentials.json").split(",") if name],
+            )
+        return _runner
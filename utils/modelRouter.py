@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils.telemetry import routeSeconds, routeOutcomes, currentSpan
+
+load_dotenv()
+
+STAGES = ("generation", "correction", "analysis")
+
+
+# A model with the request settings it is called with
+class Route:
+    def __init__(self, name, model, maxTokens, temperature):
+        self.name = name
+        self.model = model
+        self.maxTokens = maxTokens
+        self.temperature = temperature
+
+    # Keyword arguments for messages.create/stream
+    def params(self):
+        return {"model": self.model, "max_tokens": self.maxTokens, "temperature": self.temperature}
+
+    def key(self):
+        return [self.model, self.maxTokens, self.temperature]
+
+
+# Picks the route for each LLM call by stage and attempt. `stages` maps a stage
+# to a list of route names: attempt N uses entry N, and the last entry for
+# every attempt after that, so ["fast", "default"] tries the first repair on
+# the fast model and escalates once it failed. `overrides` maps a stage to
+# maxTokens/temperature that replace the route's own (e.g. the analysis runs
+# at a higher temperature than code generation).
+class ModelRouter:
+    def __init__(self, routes, stages, overrides=None):
+        for stage, names in stages.items():
+            for name in names:
+                if name not in routes:
+                    raise ValueError(f"Unknown route {name!r} for stage {stage!r}; known routes: {', '.join(routes)}")
+        self.routes = routes
+        self.stages = stages
+        self.overrides = overrides or {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def route(self, stage, attempt=0):
+        names = self.stages.get(stage) or ["default"]
+        route = self.routes[names[min(attempt, len(names) - 1)]]
+        override = self.overrides.get(stage)
+        if not override:
+            return route
+        return Route(route.name, route.model, override.get("maxTokens", route.maxTokens),
+                     override.get("temperature", route.temperature))
+
+    # Time one call on `route`; calls that raise count as errors
+    @contextmanager
+    def timed(self, stage, route):
+        started = time.monotonic()
+        span = currentSpan()
+        if span:
+            span.set(route=route.name)
+        try:
+            yield
+        except BaseException:
+            self._count(stage, route, "error")
+            raise
+        finally:
+            routeSeconds.observe(time.monotonic() - started, stage=stage, route=route.name, model=route.model)
+        self._count(stage, route, "ok")
+
+    # Whether the code a generation or correction call wrote ran successfully
+    def recordOutcome(self, stage, route, success):
+        self._count(stage, route, "succeeded" if success else "failed")
+
+    def _count(self, stage, route, outcome):
+        routeOutcomes.inc(stage=stage, route=route.name, outcome=outcome)
+        with self._lock:
+            counts = self._counts.setdefault((stage, route.name, route.model), {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    # Calls, errors, code success rate and p50/p90/p99 latency per stage and route
+    def stats(self):
+        with self._lock:
+            items = [(key, dict(counts)) for key, counts in sorted(self._counts.items())]
+        stats = {}
+        for (stage, name, model), counts in items:
+            judged = counts.get("succeeded", 0) + counts.get("failed", 0)
+            quantiles = routeSeconds.quantiles(stage=stage, route=name, model=model)
+            stats[f"{stage}/{name}"] = {
+                "model": model,
+                "calls": counts.get("ok", 0) + counts.get("error", 0),
+                "errors": counts.get("error", 0),
+                "successRate": counts.get("succeeded", 0) / judged if judged else None,
+                **{f"p{int(q * 100)}": value for q, value in quantiles.items()},
+            }
+        return stats
+
+
+def _routeFromEnv(name, prefix, default):
+    return Route(
+        name,
+        os.getenv(f"{prefix}MODEL") or default.model,
+        int(os.getenv(f"{prefix}MODEL_MAX_TOKENS") or default.maxTokens),
+        float(os.getenv(f"{prefix}MODEL_TEMPERATURE") or default.temperature),
+    )
+
+
+_router = None
+_routerLock = threading.Lock()
+
+# Routes: "default" is ANTHROPIC_MODEL/MODEL_MAX_TOKENS/MODEL_TEMPERATURE and
+# "fast" is FAST_MODEL/FAST_MODEL_MAX_TOKENS/FAST_MODEL_TEMPERATURE (each falling
+# back to the default route's value). <STAGE>_ROUTES lists the routes per
+# attempt; <STAGE>_MAX_TOKENS and <STAGE>_TEMPERATURE override them per stage.
+def getModelRouter():
+    global _router
+    with _routerLock:
+        if _router is None:
+            default = Route("default", os.getenv("ANTHROPIC_MODEL"), int(os.getenv("MODEL_MAX_TOKENS")),
+                            float(os.getenv("MODEL_TEMPERATURE")))
+            routes = {"default": default, "fast": _routeFromEnv("fast", "FAST_", default)}
+            defaults = {"generation": "default", "correction": "fast,default", "analysis": "fast"}
+            stages, overrides = {}, {}
+            for stage in STAGES:
+                prefix = stage.upper()
+                stages[stage] = [name.strip() for name in os.getenv(f"{prefix}_ROUTES", defaults[stage]).split(",")
+                                 if name.strip()]
+                override = {}
+                if os.getenv(f"{prefix}_MAX_TOKENS"):
+                    override["maxTokens"] = int(os.getenv(f"{prefix}_MAX_TOKENS"))
+                temperature = os.getenv(f"{prefix}_TEMPERATURE", "0.8" if stage == "analysis" else "")
+                if temperature:
+                    override["temperature"] = float(temperature)
+                if override:
+                    overrides[stage] = override
+            _router = ModelRouter(routes, stages, overrides)
+        return _router
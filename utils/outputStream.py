@@ -0,0 +1,206 @@
+import os
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from dotenv import load_dotenv
+from utils.executionResult import FRAME_PATTERN, EXCEPTION_PATTERN
+from utils.artifactStore import getArtifactStore, ArtifactTooLarge
+
+load_dotenv()
+
+# Characters of each stream kept in memory; anything older goes to a file
+OUTPUT_BUFFER_MAX_CHARS = int(os.getenv("OUTPUT_BUFFER_MAX_CHARS", str(1024 * 1024)))
+OUTPUT_SPILL_DIR = os.path.expanduser(os.getenv("OUTPUT_SPILL_DIR", "")) or None
+
+
+# Spots the end of a traceback in output that arrives in arbitrary chunks:
+# feed() returns the exception line ("ValueError: ...") once a
+# "Traceback (most recent call last)" block is complete
+class TracebackDetector:
+    def __init__(self):
+        self._partial = ""
+        self._inTraceback = False
+
+    def feed(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            if line.startswith("Traceback (most recent call last)"):
+                self._inTraceback = True
+                continue
+            if not self._inTraceback or not line.strip() or line.startswith(" ") or FRAME_PATTERN.match(line):
+                continue
+            if EXCEPTION_PATTERN.match(line.strip()):
+                self._inTraceback = False
+                return line.strip()
+        return None
+
+
+# The last `maxChars` characters of one stream. Text pushed out of memory is
+# appended to a temporary file, so the head of the output and, via save(), the
+# complete output stay available.
+class _SpillBuffer:
+    def __init__(self, maxChars, spillDir):
+        self.maxChars = maxChars
+        self.spillDir = spillDir
+        self.total = 0
+        self._chunks = deque()
+        self._size = 0
+        self._file = None
+        self._saved = False
+
+    def write(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        self.total += len(text)
+        excess = self._size - self.maxChars
+        while excess > 0:
+            chunk = self._chunks[0]
+            if len(chunk) <= excess:
+                self._chunks.popleft()
+            else:
+                self._chunks[0] = chunk[excess:]
+                chunk = chunk[:excess]
+            self._spill(chunk)
+            self._size -= len(chunk)
+            excess -= len(chunk)
+
+    def _spill(self, text):
+        if self._file is None:
+            self._file = tempfile.NamedTemporaryFile("w+", prefix="genly-output-", suffix=".txt", dir=self.spillDir,
+                                                     encoding="utf-8", errors="replace", delete=False)
+        self._file.write(text)
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    # The whole stream if it fits in memory, otherwise the first quarter of
+    # `maxChars` from the file, an omission note and everything in memory
+    def text(self):
+        tail = "".join(self._chunks)
+        if self._file is None:
+            return tail
+        self._file.flush()
+        with open(self._file.name, encoding="utf-8", errors="replace") as file:
+            head = file.read(min(self.maxChars // 4, self.total - len(tail)))
+        omitted = self.total - len(head) - len(tail)
+        return f"{head}\n... [{omitted} characters omitted] ...\n{tail}"
+
+    # Path of a file with the complete stream, for spilled streams once
+    # nothing more is written
+    def save(self):
+        if not self._saved:
+            self._saved = True
+            self._file.write("".join(self._chunks))
+        self._file.flush()
+        return self._file.name
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self._file.name)
+            except OSError:
+                pass
+            self._file = None
+
+
+# Output of one execution as it is produced. Executors write() stdout and
+# stderr chunks from whatever thread they run on; subscribers get
+# callback(stream, text) and traceback listeners callback(exceptionLine) on
+# the event loop the stream was created on (or on the writer's thread when
+# there was none), so Streamlit placeholders can be updated directly. Memory
+# use is bounded by `maxChars` per stream.
+class OutputStream:
+    def __init__(self, onOutput=None, maxChars=OUTPUT_BUFFER_MAX_CHARS, spillDir=OUTPUT_SPILL_DIR):
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        self._buffers = {"stdout": _SpillBuffer(maxChars, spillDir), "stderr": _SpillBuffer(maxChars, spillDir)}
+        self._subscribers = [onOutput] if onOutput else []
+        self._tracebackListeners = []
+        self._detector = TracebackDetector()
+        self.traceback = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    # Called once when the first complete traceback shows up, right away when
+    # it already has
+    def onTraceback(self, callback):
+        with self._lock:
+            found = self.traceback
+            if found is None:
+                self._tracebackListeners.append(callback)
+        if found is not None:
+            callback(found)
+
+    def write(self, text, stream="stdout"):
+        if not text:
+            return
+        with self._lock:
+            self._buffers[stream].write(text)
+            found = self._detector.feed(text) if self.traceback is None else None
+            if found:
+                self.traceback = found
+                listeners, self._tracebackListeners = self._tracebackListeners, []
+        self._deliver(self._notify, stream, text)
+        if found:
+            self._deliver(self._notifyTraceback, listeners, found)
+
+    def _deliver(self, fn, *args):
+        if self._loop is None:
+            return fn(*args)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            return fn(*args)
+        try:
+            self._loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            # The loop is closed; nobody is listening any more
+            pass
+
+    def _notify(self, stream, text):
+        for callback in list(self._subscribers):
+            try:
+                callback(stream, text)
+            except Exception:
+                # A broken view must not break the run
+                self._subscribers.remove(callback)
+
+    def _notifyTraceback(self, listeners, line):
+        for callback in listeners:
+            callback(line)
+
+    def text(self, stream="stdout"):
+        with self._lock:
+            return self._buffers[stream].text()
+
+    @property
+    def total(self):
+        return sum(buffer.total for buffer in self._buffers.values())
+
+    # Streams that outgrew memory, stored complete as stdout.txt / stderr.txt
+    # artifacts so they can still be downloaded
+    def spilledArtifacts(self):
+        artifacts = []
+        with self._lock:
+            paths = [(stream, buffer.save()) for stream, buffer in self._buffers.items() if buffer.spilled]
+        for stream, path in paths:
+            try:
+                artifacts.append(getArtifactStore().ingestFile(path, f"{stream}.txt"))
+            except ArtifactTooLarge:
+                continue
+        return artifacts
+
+    def close(self):
+        with self._lock:
+            for buffer in self._buffers.values():
+                buffer.close()
@@ -0,0 +1,304 @@
+import os
+import re
+import sys
+import json
+import shlex
+import shutil
+import hashlib
+import threading
+import subprocess
+import weakref
+import contextlib
+from collections import Counter
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+load_dotenv()
+
+# pip options that consume the following token
+PIP_OPTIONS_WITH_VALUE = {"-r", "--requirement", "-c", "--constraint", "-i", "--index-url",
+                          "--extra-index-url", "-f", "--find-links", "--target", "-t", "--prefix"}
+
+
+def canonicalName(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+# Turn the ```pip block from the LLM into a sorted, de-duplicated list of
+# requirement specs, e.g. "pip install Requests  python_dotenv -q" ->
+# ["python-dotenv", "requests"]. Prefixes like "!pip", "pip3" and
+# "python -m pip" and any pip options are dropped.
+def parsePackages(pipBlock):
+    if not pipBlock:
+        return []
+    specs = set()
+    for line in pipBlock.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        try:
+            tokens = shlex.split(line)
+        except ValueError:
+            tokens = line.split()
+        skipNext = False
+        for token in tokens:
+            if skipNext:
+                skipNext = False
+                continue
+            if token in ("pip", "pip3", "!pip", "!pip3", "%pip", "python", "python3", "-m", "install"):
+                continue
+            if token.startswith("-"):
+                skipNext = token in PIP_OPTIONS_WITH_VALUE
+                continue
+            match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?(.*)$", token)
+            if not match:
+                continue
+            name, extras, spec = match.groups()
+            specs.add(canonicalName(name) + (extras or "").lower() + spec.replace(" ", ""))
+    return sorted(specs)
+
+
+def packageKey(specs):
+    return hashlib.sha256("\n".join(specs).encode()).hexdigest()[:20]
+
+
+# Content-addressed cache of prepared package sets. Locally every distinct set
+# gets a wheel directory and a virtualenv (built with --system-site-packages on
+# top of the current interpreter) that is reused on later runs. For sandboxes
+# the cache remembers which sets each sandbox already has installed so the pool
+# can hand out one that needs no install at all. Environments a run of this
+# process is using are held and never evicted under it.
+class PackageCache:
+    def __init__(self, root, maxEntries=16):
+        self.root = root
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sandboxHits = 0
+        self.sandboxMisses = 0
+        self._lock = threading.Lock()
+        self._keyLocks = {}
+        self._held = Counter()
+        self._sandboxKeys = weakref.WeakKeyDictionary()
+        os.makedirs(self.root, exist_ok=True)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "sandboxHits": self.sandboxHits,
+            "sandboxMisses": self.sandboxMisses,
+            "entries": len(self._entries()),
+        }
+
+    def entryDir(self, key):
+        return os.path.join(self.root, key)
+
+    def wheelDir(self, key):
+        return os.path.join(self.entryDir(key), "wheels")
+
+    def venvPython(self, key):
+        venv = os.path.join(self.entryDir(key), "venv")
+        if os.name == "nt":
+            return os.path.join(venv, "Scripts", "python.exe")
+        return os.path.join(venv, "bin", "python")
+
+    # Return the interpreter that has `pipBlock` installed, building the
+    # environment on a miss. Returns None when there is nothing to install or
+    # the install failed (the log is kept in <entry>/install.log). With
+    # hold=True the environment is kept from eviction until release(pipBlock).
+    def prepare(self, pipBlock, hold=False):
+        specs = parsePackages(pipBlock)
+        if not specs:
+            return None
+        key = packageKey(specs)
+        with self._keyLock(key):
+            if self._isReady(key):
+                with self._lock:
+                    self.hits += 1
+                    if hold:
+                        self._held[key] += 1
+                self._touch(key)
+                return self.venvPython(key)
+            with self._lock:
+                self.misses += 1
+            if not self._build(key, specs):
+                return None
+            if hold:
+                with self._lock:
+                    self._held[key] += 1
+        self._evict(keep=key)
+        return self.venvPython(key)
+
+    # The run holding the environment of `pipBlock` is done with it
+    def release(self, pipBlock):
+        specs = parsePackages(pipBlock)
+        key = packageKey(specs) if specs else None
+        with self._lock:
+            if self._held[key] > 1:
+                self._held[key] -= 1
+            else:
+                self._held.pop(key, None)
+
+    # Install `pipBlock` into a sandbox unless that sandbox already has it.
+    # When pip rejects the set as a whole, every spec is tried on its own and
+    # the ones that fail are left out. Returns the specs that were left out.
+    def installInto(self, sandbox, pipBlock):
+        specs = parsePackages(pipBlock)
+        if not specs:
+            return []
+        key = packageKey(specs)
+        installed = self._sandboxKeys.setdefault(sandbox, {})
+        if key in installed:
+            with self._lock:
+                self.sandboxHits += 1
+            return installed[key]
+        with self._lock:
+            self.sandboxMisses += 1
+        if self._installSpecs(sandbox, specs):
+            failed = []
+        else:
+            failed = [spec for spec in specs if len(specs) == 1 or not self._installSpecs(sandbox, [spec])]
+        # A set of which nothing installed is tried again next time
+        if len(failed) < len(specs):
+            installed[key] = failed
+        return failed
+
+    def _installSpecs(self, sandbox, specs):
+        try:
+            sandbox.install_python_packages(" ".join(shlex.quote(spec) for spec in specs))
+            return True
+        except Exception:
+            return False
+
+    # Predicate for SandboxPool.acquire(prefer=...): sandboxes that already
+    # have this package set installed
+    def hasInstalled(self, pipBlock):
+        specs = parsePackages(pipBlock)
+        key = packageKey(specs) if specs else None
+        return lambda sandbox: key is not None and key in self._sandboxKeys.get(sandbox, ())
+
+    # Only keys someone is waiting on or holding have a lock object
+    @contextlib.contextmanager
+    def _keyLock(self, key):
+        with self._lock:
+            lock = self._keyLocks.get(key)
+            if lock is None:
+                lock = self._keyLocks[key] = _KeyLock(os.path.join(self.root, f".{key}.lock"))
+            lock.users += 1
+        try:
+            with lock:
+                yield lock
+        finally:
+            with self._lock:
+                lock.users -= 1
+                if not lock.users:
+                    del self._keyLocks[key]
+
+    def _isReady(self, key):
+        return os.path.exists(os.path.join(self.entryDir(key), "ready"))
+
+    def _touch(self, key):
+        try:
+            os.utime(os.path.join(self.entryDir(key), "ready"))
+        except OSError:
+            pass
+
+    # Wheels for `specs` go to the entry's wheel directory. When pip rejects
+    # the set as a whole, every spec is tried on its own and the ones that
+    # fail are left out of the environment; it fails only when none is left.
+    def _build(self, key, specs):
+        entry = self.entryDir(key)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.makedirs(entry)
+        with open(os.path.join(entry, "install.log"), "w") as log:
+            def step(command):
+                return subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode == 0
+
+            def wheel(specs):
+                return step([sys.executable, "-m", "pip", "wheel", "--quiet", "-w", self.wheelDir(key)] + specs)
+
+            if not wheel(specs) and len(specs) > 1:
+                specs = [spec for spec in specs if wheel([spec])]
+            ok = bool(specs) and step(
+                [sys.executable, "-m", "venv", "--system-site-packages", os.path.join(entry, "venv")]
+            ) and step(
+                [self.venvPython(key), "-m", "pip", "install", "--quiet", "--no-index",
+                 "--find-links", self.wheelDir(key)] + specs
+            )
+            if not ok:
+                shutil.rmtree(self.wheelDir(key), ignore_errors=True)
+                shutil.rmtree(os.path.join(entry, "venv"), ignore_errors=True)
+                return False
+        with open(os.path.join(entry, "ready"), "w") as file:
+            json.dump(specs, file)
+        return True
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            ready = os.path.join(self.root, name, "ready")
+            if os.path.exists(ready):
+                entries.append((os.path.getmtime(ready), name))
+        return sorted(entries)
+
+    # Remove the least recently used environments beyond maxEntries, leaving
+    # out `keep` and those a run holds
+    def _evict(self, keep):
+        entries = [name for _, name in self._entries() if name != keep]
+        excess = len(entries) + 1 - self.maxEntries
+        for key in entries:
+            if excess <= 0:
+                break
+            with self._keyLock(key):
+                with self._lock:
+                    if self._held[key]:
+                        continue
+                shutil.rmtree(self.entryDir(key), ignore_errors=True)
+            with self._lock:
+                self.evictions += 1
+            excess -= 1
+
+
+# Serialises builds of the same package set across threads and, where fcntl is
+# available, across processes sharing the cache directory
+class _KeyLock:
+    def __init__(self, path):
+        self.path = path
+        self.users = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is not None:
+            self._file = open(self.path, "w")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+def getPackageCache():
+    global _cache
+    with _cacheLock:
+        if _cache is None:
+            _cache = PackageCache(
+                os.path.expanduser(os.getenv("PACKAGE_CACHE_DIR", "~/.cache/genly_execute/packages")),
+                maxEntries=int(os.getenv("PACKAGE_CACHE_MAX_ENTRIES", "16")),
+            )
+        return _cache
@@ -0,0 +1,359 @@
+import time
+import asyncio
+import contextlib
+from dotenv import load_dotenv
+from utils.executor import execute_code, getExecutor
+from utils.outputStream import OutputStream
+from utils.fenceParser import FenceParser
+from utils.codeCheck import checkCode
+from utils.llm import streamMessage, replayText, trackUsage, totalTokens
+from utils.responseCache import getResponseCache
+from utils.clients import getAnthropicClient
+from utils.repairEngine import RepairEngine
+from utils.prompts import GENERATION, CORRECTION, ANALYSIS
+from utils.modelRouter import getModelRouter
+from utils.sessions import getSessionManager
+from utils.telemetry import span
+
+load_dotenv()
+
+# Cache key for a generation request; runPipeline also uses it to record whether the code worked
+def generation_key(message, context):
+    return getResponseCache().key("send_message", message, context, *getModelRouter().route("generation").key(),
+                                  template=GENERATION)
+
+# Function to send a message to Claude3 and get the response
+async def send_message(message, conversation_id=None, context=None, on_text=None, on_fence=None):
+    cache = getResponseCache()
+    key = generation_key(message, context)
+    cached = cache.get(key)
+    # Reuse a cached answer unless its code is known to fail
+    if cached and cached.get("success") is not False:
+        replayText(cached["response"], on_text, on_fence)
+        return cached["response"], cached["id"]
+
+    client = getAnthropicClient()
+    prompt = GENERATION.render(message=message, context=context)
+    router = getModelRouter()
+    route = router.route("generation")
+    with router.timed("generation", route):
+        msg = await streamMessage(
+            client,
+            on_text,
+            on_fence,
+            label=prompt.name,
+            **route.params(),
+            **prompt.request()
+        )
+    cache.set(key, {"response": msg.content[0].text, "id": msg.id})
+    return msg.content[0].text, msg.id
+
+# Ask Claude3 for corrected code; `prompt` comes from build_correction_prompt
+# and `attempt` (0 for the first repair) picks the model route
+async def correct_code(prompt, conversation_id=None, on_text=None, on_fence=None, attempt=0):
+    client = getAnthropicClient()
+    router = getModelRouter()
+    route = router.route("correction", attempt)
+    with router.timed("correction", route):
+        message = await streamMessage(
+            client,
+            on_text,
+            on_fence,
+            label=prompt.name,
+            **route.params(),
+            **prompt.request()
+        )
+
+    return message.content[0].text, message.id, message.usage
+
+
+async def get_llm_analysis(code_output, human_question, on_text=None):
+    prompt = ANALYSIS.render(message=human_question, output=code_output)
+    router = getModelRouter()
+    route = router.route("analysis")
+    cache = getResponseCache()
+    key = cache.key("get_llm_analysis", human_question, code_output, *route.key(), template=ANALYSIS)
+    cached = cache.get(key)
+    if cached:
+        replayText(cached["response"], on_text)
+        return cached["response"]
+    client = getAnthropicClient()
+    with router.timed("analysis", route):
+        message = await streamMessage(
+            client,
+            on_text,
+            label=prompt.name,
+            **route.params(),
+            **prompt.request()
+        )
+    msg = message.content[0].text
+    cache.set(key, {"response": msg, "id": message.id})
+    return msg
+
+PYTHON_FENCES = ("python", "python3", "py")
+SHELL_FENCES = ("bash", "sh", "shell", "")
+
+# Extract the code and the pip block from Claude3's response. Either is None
+# when the response has no such block; a python block cut off by the token
+# limit is returned as far as it goes, for checkCode to report.
+def parse_response(response):
+    parser = FenceParser()
+    parser.feed(response or "")
+    blocks = list(parser.blocks)
+    if parser.unclosed():
+        blocks.append(parser.unclosed())
+    code = next((body for lang, body in blocks if lang in PYTHON_FENCES), None)
+    packages = next((body for lang, body in blocks
+                     if lang == "pip" or lang in SHELL_FENCES and "pip install" in body), None)
+    if code is None:
+        # An untagged block that is not the pip line
+        code = next((body for lang, body in blocks if lang == "" and body != packages), None)
+    return code, packages
+
+# Prompt asking Claude3 to fix code that failed
+def build_correction_prompt(code, result, user_input, context):
+    return CORRECTION.render(message=user_input, context=context, code=code or "", errors=result.digest())
+
+# Start installing packages as soon as the streamed pip block is complete, and
+# again once the code block is, if its imports need packages the pip block
+# does not name. Code that runs in a conversation's `session` gets them there.
+def prefetch_packages(tasks, session=None):
+    seen = {}
+    def on_fence(lang, body):
+        if lang == "pip" and "pip" not in seen:
+            seen["pip"] = body
+            tasks.append(asyncio.create_task(getExecutor().prefetch(body, session)))
+        elif lang in PYTHON_FENCES and "python" not in seen:
+            seen["python"] = body
+            packages, failure = checkCode(body, seen.get("pip"), getattr(getExecutor(), "hasModule", None))
+            if failure is None and packages != seen.get("pip"):
+                tasks.append(asyncio.create_task(getExecutor().prefetch(packages, session)))
+    return on_fence
+
+
+# Callbacks runPipeline makes as it goes; the Streamlit view overrides these,
+# the batch runner and other headless callers use them as they are. The
+# *Stream methods return an on_text callback (or None) for streamed tokens;
+# executionStream returns on_output(stream, text) for the live output of one
+# execution ("stdout"/"stderr" chunks, called on the event loop).
+class PipelineHooks:
+    def onStage(self, stage):
+        pass
+
+    def generationStream(self):
+        return None
+
+    def onGenerated(self, response):
+        pass
+
+    def executionStream(self):
+        return None
+
+    def onExecuted(self, result):
+        pass
+
+    def correctionStream(self, index):
+        return None
+
+    def onCorrection(self, candidate):
+        pass
+
+    def onRepairStopped(self, repair):
+        pass
+
+    def onFinalResult(self, result):
+        pass
+
+    def analysisStream(self):
+        return None
+
+    def onAnalysis(self, analysis):
+        pass
+
+    # Hooks for one task of a plan (utils/planExecutor.py); tasks run
+    # concurrently, so views that lay things out give each its own place
+    def taskHooks(self, task):
+        return self
+
+
+# Forwards hook calls and records them (all but onStage and taskHooks) so a
+# finished run can be shown again without redoing any of the work
+class RecordingHooks:
+    def __init__(self, hooks, events):
+        self.hooks = hooks
+        self.events = events
+
+    def __getattr__(self, name):
+        method = getattr(self.hooks, name)
+        def record(*args):
+            if name not in ("onStage", "taskHooks"):
+                self.events.append((name, args))
+            return method(*args)
+        return record
+
+
+class PipelineResult:
+    def __init__(self, command):
+        self.command = command
+        self.conversationId = None
+        self.response = None
+        self.code = None
+        self.packages = None
+        self.result = None
+        self.success = False
+        self.analysis = None
+        self.attempts = 0
+        self.repairReason = None
+        self.timings = {}
+        self.usage = None
+        self.events = []
+
+    # Render this finished run through `hooks` exactly as it was rendered live
+    def replay(self, hooks):
+        for name, args in self.events:
+            getattr(hooks, name)(*args)
+
+    def toDict(self):
+        return {
+            "command": self.command,
+            "success": self.success,
+            "response": self.response,
+            "code": self.code,
+            "packages": self.packages,
+            "output": self.result.output if self.result else None,
+            "artifacts": [artifact.toDict() for artifact in self.result.artifacts] if self.result else [],
+            "analysis": self.analysis,
+            "attempts": self.attempts,
+            "repairReason": self.repairReason,
+            "timings": self.timings,
+            "usage": self.usage.toDict() if self.usage else None,
+        }
+
+
+# Time one stage of a run: a telemetry span plus the run's timings entry
+@contextlib.contextmanager
+def stage(pipeline, name):
+    started = time.monotonic()
+    try:
+        with span(name) as current:
+            yield current
+    finally:
+        pipeline.timings[name] = time.monotonic() - started
+
+
+# Run one command through generate -> execute -> correct -> analyze.
+#   generate        send_message-compatible coroutine used for the first answer
+#   context         context handed to generate
+#   correctionContext  "Additional Context" for correction prompts (defaults to context)
+#   cacheKey        response cache key of the generation, or a function of the
+#                   context that returns it (defaults to generation_key)
+#   session         key of the conversation's persistent Python session; the code
+#                   runs there and both contexts say what state it already has
+#   llmSlots/execSlots  optional semaphores bounding LLM calls and executions
+async def runPipeline(command, context=None, generate=None, correctionContext=None, cacheKey=None,
+                      conversationId=None, hooks=None, analyze=True, llmSlots=None, execSlots=None, session=None):
+    pipeline = PipelineResult(command)
+    correctionContext = context if correctionContext is None else correctionContext
+    if session:
+        state = getSessionManager().describe(session)
+        if state:
+            context = f"{context}\n\n{state}" if context else state
+            correctionContext = f"{correctionContext}\n\n{state}" if correctionContext else state
+    if callable(cacheKey):
+        cacheKey = cacheKey(context)
+    with stage(pipeline, "pipeline") as root:
+        await _runStages(pipeline, context, generate or send_message, correctionContext,
+                         cacheKey or generation_key(command, context), conversationId,
+                         RecordingHooks(hooks or PipelineHooks(), pipeline.events), analyze,
+                         llmSlots or contextlib.nullcontext(), execSlots or contextlib.nullcontext(), session)
+        root.set(success=pipeline.success, attempts=pipeline.attempts, **{
+            f"tokens.{name}": value for name, value in pipeline.usage.toDict().items() if name.endswith("Tokens")})
+    pipeline.timings["total"] = pipeline.timings.pop("pipeline")
+    return pipeline
+
+
+async def _runStages(pipeline, context, generate, correctionContext, cacheKey, conversationId, hooks, analyze,
+                     llmSlots, execSlots, session):
+    command = pipeline.command
+    pipeline.usage = trackUsage()
+
+    # Code that cannot run fails here without using a sandbox, and the
+    # packages its imports need are added to the pip block
+    async def execute(code, packages):
+        with span("check") as current:
+            packages, failure = checkCode(code, packages, getattr(getExecutor(), "hasModule", None))
+            current.set(failed=failure is not None)
+        if failure is not None:
+            return failure
+        onOutput = hooks.executionStream()
+        async with execSlots:
+            return await execute_code(code, packages, output=OutputStream(onOutput) if onOutput else None,
+                                      session=session)
+
+    async def correct(prompt, index):
+        prefetch = []
+        async with llmSlots:
+            response, _, usage = await correct_code(prompt, pipeline.conversationId,
+                                                    on_text=hooks.correctionStream(index),
+                                                    on_fence=prefetch_packages(prefetch, session), attempt=index)
+        await asyncio.gather(*prefetch)
+        return response, totalTokens(usage)
+
+    def onCorrection(candidate):
+        router.recordOutcome("correction", router.route("correction", candidate.index), not candidate.failed)
+        hooks.onCorrection(candidate)
+
+    router = getModelRouter()
+    hooks.onStage("Thinking...")
+    prefetch = []
+    calls = pipeline.usage.calls
+    with stage(pipeline, "generate"):
+        async with llmSlots:
+            pipeline.response, pipeline.conversationId = await generate(
+                command, conversationId, context,
+                on_text=hooks.generationStream(), on_fence=prefetch_packages(prefetch, session))
+        pipeline.code, pipeline.packages = parse_response(pipeline.response)
+    hooks.onGenerated(pipeline.response)
+
+    hooks.onStage("Running the code")
+    with stage(pipeline, "execute"):
+        await asyncio.gather(*prefetch)
+        pipeline.result = await execute(pipeline.code, pipeline.packages)
+    pipeline.success = not pipeline.result.failed
+    # Cached answers made no call, so they say nothing about the route
+    if pipeline.usage.calls > calls:
+        router.recordOutcome("generation", router.route("generation"), pipeline.success)
+    hooks.onExecuted(pipeline.result)
+
+    if not pipeline.success:
+        getResponseCache().markResult(cacheKey, False)
+        hooks.onStage("Correcting my code")
+        engine = RepairEngine(
+            correct, parse_response, execute,
+            lambda code, result: build_correction_prompt(code, result, command, correctionContext),
+            onResult=onCorrection,
+        )
+        with stage(pipeline, "repair") as current:
+            repair = await engine.repair(pipeline.code, pipeline.result, pipeline.packages)
+            current.set(success=repair.success, attempts=repair.attempts, reason=repair.reason)
+        candidate = repair.candidate
+        pipeline.response = candidate.response or pipeline.response
+        pipeline.code, pipeline.packages = candidate.code, candidate.packages
+        pipeline.result = candidate.result
+        pipeline.success = repair.success
+        pipeline.attempts = repair.attempts
+        pipeline.repairReason = repair.reason
+        if not repair.success:
+            hooks.onRepairStopped(repair)
+    if pipeline.success:
+        # Remember the code that finally worked so the same request can skip generation
+        getResponseCache().markResult(cacheKey, True, response=pipeline.response,
+                                      code=pipeline.code, packages=pipeline.packages)
+    hooks.onFinalResult(pipeline.result)
+
+    if analyze:
+        hooks.onStage("Summarizing")
+        with stage(pipeline, "analyze"):
+            async with llmSlots:
+                pipeline.analysis = await get_llm_analysis(pipeline.result.output, command, on_text=hooks.analysisStream())
+        hooks.onAnalysis(pipeline.analysis)
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import asyncio
+from dotenv import load_dotenv
+from utils.pipeline import runPipeline, get_llm_analysis, stage, PipelineHooks, RecordingHooks
+from utils.llm import streamMessage, replayText, trackUsage
+from utils.responseCache import getResponseCache
+from utils.clients import getAnthropicClient
+from utils.modelRouter import getModelRouter
+from utils.prompts import TASK_STEP
+from utils.executionResult import ExecutionResult
+from utils.telemetry import span
+
+load_dotenv()
+
+# Tasks of a plan executing at once (each in its own sandbox), fresh attempts
+# a failed task gets after its repair loop gave up, and how much of a task's
+# output is handed to the tasks that depend on it
+PLAN_MAX_PARALLEL = int(os.getenv("PLAN_MAX_PARALLEL", "4"))
+PLAN_TASK_RETRIES = int(os.getenv("PLAN_TASK_RETRIES", "1"))
+PLAN_RESULT_MAX_CHARS = int(os.getenv("PLAN_RESULT_MAX_CHARS", "2000"))
+
+# Field names the Genly task summary has used for the same things
+ID_KEYS = ("id", "taskId", "taskID", "task_id")
+TEXT_KEYS = ("command", "description", "task", "instruction", "title", "name")
+NAME_KEYS = ("name", "title")
+DEPENDENCY_KEYS = ("dependsOn", "dependencies", "depends_on", "after", "prerequisites", "requires")
+
+RESULT_PREFIX = "RESULT:"
+
+
+class PlanError(Exception):
+    pass
+
+
+class PlanTask:
+    def __init__(self, id, description, dependsOn=(), data=None):
+        self.id = id
+        self.description = description
+        self.dependsOn = list(dependsOn)
+        self.data = data or {}
+
+
+def _first(data, keys):
+    for key in keys:
+        if data.get(key) not in (None, "", []):
+            return data[key]
+    return None
+
+
+# A plan's tasks as a dependency DAG. Dependencies may name a task by id, by
+# name or by its 1-based position; unknown names and cycles raise PlanError.
+class Plan:
+    def __init__(self, summary, tasks):
+        self.summary = summary
+        self.tasks = tasks
+        self.byId = {task.id: task for task in tasks}
+        if len(self.byId) != len(tasks):
+            raise PlanError("Task ids are not unique")
+        self._order = self._sort()
+
+    # Tasks so that every task comes after the ones it depends on, otherwise
+    # in plan order
+    def order(self):
+        return list(self._order)
+
+    def _sort(self):
+        waiting = {task.id: set(task.dependsOn) for task in self.tasks}
+        order = []
+        while waiting:
+            ready = [task for task in self.tasks if task.id in waiting and not waiting[task.id]]
+            if not ready:
+                raise PlanError(f"Dependency cycle between tasks {', '.join(waiting)}")
+            for task in ready:
+                del waiting[task.id]
+                order.append(task)
+                for dependencies in waiting.values():
+                    dependencies.discard(task.id)
+        return order
+
+    # Seconds along the slowest chain of dependent tasks, given each task's duration
+    def criticalPath(self, durations):
+        finish = {}
+        for task in self._order:
+            finish[task.id] = durations.get(task.id, 0.0) + max(
+                (finish[dependency] for dependency in task.dependsOn), default=0.0)
+        return max(finish.values(), default=0.0)
+
+
+# Read a Genly task summary: JSON with "planSummary" and a "tasks" list (or
+# just the list). Returns None when the summary is not such a plan or has a
+# single task, so the caller runs it as one script like before. Tasks that
+# declare no dependencies are independent.
+def parsePlan(summary):
+    try:
+        data = json.loads(summary) if isinstance(summary, str) else summary
+    except ValueError:
+        return None
+    if isinstance(data, list):
+        data = {"tasks": data}
+    if not isinstance(data, dict) or not isinstance(data.get("tasks"), list) or len(data["tasks"]) < 2:
+        return None
+    raw = [item if isinstance(item, dict) else {"description": str(item)} for item in data["tasks"]]
+    ids = [str(_first(item, ID_KEYS) or index) for index, item in enumerate(raw, 1)]
+    names = {}
+    for taskId, item in zip(ids, raw):
+        name = _first(item, NAME_KEYS)
+        if isinstance(name, str):
+            names.setdefault(name.strip().lower(), taskId)
+
+    def resolve(reference):
+        text = str(reference).strip()
+        if text in ids:
+            return text
+        if text.lower() in names:
+            return names[text.lower()]
+        if text.isdigit() and 1 <= int(text) <= len(ids):
+            return ids[int(text) - 1]
+        raise PlanError(f"Unknown task {reference!r} in dependencies")
+
+    tasks = []
+    for taskId, item in zip(ids, raw):
+        text = _first(item, TEXT_KEYS)
+        description = text if isinstance(text, str) else json.dumps(item)
+        references = _first(item, DEPENDENCY_KEYS) or []
+        if not isinstance(references, list):
+            references = [references]
+        dependsOn = []
+        for reference in references:
+            dependency = resolve(reference)
+            if dependency != taskId and dependency not in dependsOn:
+                dependsOn.append(dependency)
+        tasks.append(PlanTask(taskId, description, dependsOn, item))
+    summary = data.get("planSummary")
+    return Plan(summary if isinstance(summary, str) else json.dumps(summary), tasks)
+
+
+# One task of a run: its status ("pending", "succeeded", "failed" or
+# "skipped" when a task it depends on failed) and the pipeline run of every
+# attempt
+class PlanNode:
+    def __init__(self, task):
+        self.task = task
+        self.status = "pending"
+        self.pipelines = []
+        self.error = None
+        self.seconds = 0.0
+
+    @property
+    def pipeline(self):
+        return self.pipelines[-1] if self.pipelines else None
+
+    # What dependent tasks get: the JSON after the last "RESULT:" line, or the
+    # end of the output
+    def resultText(self, maxChars=PLAN_RESULT_MAX_CHARS):
+        output = self.pipeline.result.stdout if self.pipeline and self.pipeline.result else ""
+        for line in reversed(output.splitlines()):
+            if line.startswith(RESULT_PREFIX):
+                return line[len(RESULT_PREFIX):].strip()[:maxChars]
+        output = output.strip()
+        return output if len(output) <= maxChars else "..." + output[-maxChars:]
+
+    def toDict(self):
+        return {
+            "id": self.task.id,
+            "description": self.task.description,
+            "dependsOn": self.task.dependsOn,
+            "status": self.status,
+            "attempts": len(self.pipelines),
+            "seconds": self.seconds,
+            "error": self.error,
+            "result": self.pipeline.toDict() if self.pipeline else None,
+        }
+
+
+# Outcome of a plan. Has what the apps use of a PipelineResult
+# (conversationId, success, replay, toDict), with the combined output of all
+# tasks as `result`.
+class PlanResult:
+    def __init__(self, command, plan):
+        self.command = command
+        self.plan = plan
+        self.nodes = [PlanNode(task) for task in plan.order()]
+        self.conversationId = None
+        self.result = None
+        self.success = False
+        self.analysis = None
+        self.timings = {}
+        self.usage = None
+        self.events = []
+
+    # Every task into its own hooks.taskHooks(), then the combined output and summary
+    def replay(self, hooks):
+        for node in self.nodes:
+            taskHooks = hooks.taskHooks(node.task)
+            for pipeline in node.pipelines:
+                pipeline.replay(taskHooks)
+        for name, args in self.events:
+            getattr(hooks, name)(*args)
+
+    def toDict(self):
+        return {
+            "command": self.command,
+            "planSummary": self.plan.summary,
+            "success": self.success,
+            "tasks": [node.toDict() for node in self.nodes],
+            "output": self.result.output if self.result else None,
+            "artifacts": [artifact.toDict() for artifact in self.result.artifacts] if self.result else [],
+            "analysis": self.analysis,
+            "timings": self.timings,
+            "usage": self.usage.toDict() if self.usage else None,
+        }
+
+
+# Runs a Plan as a DAG: code is generated and executed per task, each task
+# starts as soon as the tasks it depends on have succeeded (at most
+# `maxParallel` executing at once, in separate sandboxes) and gets their
+# results in its prompt. A failing task goes through the usual repair loop and
+# then up to `retries` fresh attempts; only that task is redone, and only the
+# tasks depending on it are skipped. Wall-clock time follows the critical
+# path instead of the sum of all tasks.
+class PlanExecutor:
+    def __init__(self, knowledge=None, maxParallel=PLAN_MAX_PARALLEL, retries=PLAN_TASK_RETRIES, llmSlots=None):
+        self.knowledge = knowledge
+        self.maxParallel = maxParallel
+        self.retries = retries
+        self.llmSlots = llmSlots
+
+    def generationKey(self, plan, message, context):
+        return getResponseCache().key("task-step", message, [context, plan.summary, self.knowledge],
+                                      *getModelRouter().route("generation").key(), template=TASK_STEP)
+
+    # send_message-compatible generation with the TASK_STEP prompt
+    def _generator(self, plan):
+        async def generate(message, conversation_id=None, context=None, on_text=None, on_fence=None):
+            cache = getResponseCache()
+            key = self.generationKey(plan, message, context)
+            cached = cache.get(key)
+            if cached and cached.get("success") is not False:
+                replayText(cached["response"], on_text, on_fence)
+                return cached["response"], cached["id"]
+            prompt = TASK_STEP.render(knowledge=self.knowledge, plan=plan.summary, message=message, context=context)
+            router = getModelRouter()
+            route = router.route("generation")
+            with router.timed("generation", route):
+                msg = await streamMessage(getAnthropicClient(), on_text, on_fence, label=prompt.name,
+                                          **route.params(), **prompt.request())
+            cache.set(key, {"response": msg.content[0].text, "id": msg.id})
+            return msg.content[0].text, msg.id
+        return generate
+
+    async def run(self, command, plan, hooks=None, analyze=True):
+        result = PlanResult(command, plan)
+        hooks = RecordingHooks(hooks or PipelineHooks(), result.events)
+        result.usage = trackUsage()
+        with stage(result, "plan") as root:
+            await self._runTasks(result, hooks)
+            root.set(tasks=len(result.nodes), success=result.success)
+            if analyze:
+                hooks.onStage("Summarizing")
+                with stage(result, "analyze"):
+                    result.analysis = await get_llm_analysis(result.result.output, command,
+                                                             on_text=hooks.analysisStream())
+                hooks.onAnalysis(result.analysis)
+        for node in result.nodes:
+            for pipeline in node.pipelines:
+                result.usage.merge(pipeline.usage)
+        result.timings["total"] = result.timings.pop("plan")
+        return result
+
+    async def _runTasks(self, result, hooks):
+        plan = result.plan
+        nodes = {node.task.id: node for node in result.nodes}
+        taskHooks = {node.task.id: hooks.taskHooks(node.task) for node in result.nodes}
+        execSlots = asyncio.Semaphore(self.maxParallel)
+        generate = self._generator(plan)
+        running = {}
+
+        async def runNode(node):
+            await asyncio.gather(*(running[dependency] for dependency in node.task.dependsOn))
+            if any(nodes[dependency].status != "succeeded" for dependency in node.task.dependsOn):
+                node.status = "skipped"
+                taskHooks[node.task.id].onStage("Skipped: a task it depends on failed")
+                return
+            inputs = "\n".join(f"{dependency} ({nodes[dependency].task.description}): {nodes[dependency].resultText()}"
+                               for dependency in node.task.dependsOn) or "None"
+            correctionContext = "\n\n".join(part for part in (
+                self.knowledge, f"Plan: {plan.summary}", f"Results of the tasks it depends on: {inputs}") if part)
+            started = time.monotonic()
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    taskHooks[node.task.id].onStage(f"Trying the task again (attempt {attempt + 1})")
+                with span("plan.task", task=node.task.id, attempt=attempt + 1) as current:
+                    try:
+                        pipeline = await runPipeline(
+                            node.task.description, inputs, generate=generate, correctionContext=correctionContext,
+                            cacheKey=lambda context: self.generationKey(plan, node.task.description, context),
+                            hooks=taskHooks[node.task.id], analyze=False, llmSlots=self.llmSlots, execSlots=execSlots)
+                    except Exception as error:
+                        node.error = f"{type(error).__name__}: {error}"
+                        current.set(error=node.error)
+                        continue
+                    node.pipelines.append(pipeline)
+                    current.set(success=pipeline.success)
+                    if pipeline.success:
+                        break
+            node.seconds = time.monotonic() - started
+            node.status = "succeeded" if node.pipeline and node.pipeline.success else "failed"
+
+        # Dependencies come first in plan.order(), so their tasks exist by the time they are awaited
+        for node in result.nodes:
+            running[node.task.id] = asyncio.ensure_future(runNode(node))
+        try:
+            await asyncio.gather(*running.values())
+        finally:
+            for task in running.values():
+                task.cancel()
+
+        result.success = all(node.status == "succeeded" for node in result.nodes)
+        durations = {node.task.id: node.seconds for node in result.nodes}
+        result.timings["criticalPath"] = plan.criticalPath(durations)
+        result.timings["serial"] = sum(durations.values())
+        parts, artifacts = [], []
+        for node in result.nodes:
+            output = node.pipeline.result.output if node.pipeline and node.pipeline.result else node.error or ""
+            parts.append(f"Task {node.task.id} ({node.status}): {node.task.description}\n{output}".rstrip())
+            if node.pipeline and node.pipeline.result:
+                artifacts += node.pipeline.result.artifacts
+        result.result = ExecutionResult("\n\n".join(parts), artifacts=artifacts)
+        hooks.onFinalResult(result.result)
@@ -0,0 +1,221 @@
+import string
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Anthropic prompt caching marker. Everything up to and including a block that
+# carries it is cached for a few minutes and billed at the cache-read rate when
+# the next request starts with the same text; prefixes shorter than the
+# model's minimum (about 1024 tokens) are simply not cached.
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+# A template split once into literal text and field names, so rendering is a
+# single join instead of re-parsing the format string on every call
+class _Compiled:
+    def __init__(self, text):
+        self.parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(text)]
+        self.fields = tuple(field for _, field in self.parts if field)
+
+    def render(self, values):
+        return "".join(literal + (str(values[field]) if field else "") for literal, field in self.parts)
+
+
+class Prompt:
+    def __init__(self, template, prefix, suffix):
+        self.template = template
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @property
+    def name(self):
+        return self.template.name
+
+    @property
+    def text(self):
+        return self.prefix + self.suffix
+
+    # Keyword arguments for messages.create/stream: the prefix as a cached
+    # block, either as the system prompt or at the start of the user message
+    def request(self):
+        prefix = {"type": "text", "text": self.prefix, "cache_control": CACHE_CONTROL}
+        suffix = {"type": "text", "text": self.suffix}
+        if self.template.placement == "system":
+            return {"system": [prefix], "messages": [{"role": "user", "content": [suffix]}]}
+        return {"messages": [{"role": "user", "content": [prefix, suffix]}]}
+
+
+# A prompt made of a stable prefix, which only uses fields that stay the same
+# across the calls of a request (instructions, additional context, the human
+# request), and a suffix with everything that changes per call. Rendered
+# prefixes are memoized so a correction loop builds its prefix once.
+class PromptTemplate:
+    def __init__(self, name, prefix, suffix, placement="user", maxPrefixes=64):
+        self.name = name
+        self.placement = placement
+        self.maxPrefixes = maxPrefixes
+        self._prefix = _Compiled(prefix)
+        self._suffix = _Compiled(suffix)
+        # Changes whenever the template text does; part of response cache keys
+        # so edited instructions are not answered from the cache
+        self.version = hashlib.sha256("\x00".join([placement, prefix, suffix]).encode()).hexdigest()[:12]
+        self._prefixes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, **values):
+        key = tuple(str(values[field]) for field in self._prefix.fields)
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is not None:
+                self._prefixes.move_to_end(key)
+        if prefix is None:
+            prefix = self._prefix.render(values)
+            with self._lock:
+                self._prefixes[key] = prefix
+                while len(self._prefixes) > self.maxPrefixes:
+                    self._prefixes.popitem(last=False)
+        return Prompt(self, prefix, self._suffix.render(values))
+
+
+GENERATION = PromptTemplate(
+    "generation",
+    """You are a helpful assistant who can write python code that return values that help to answer user requests. All the code you write will be in python. For your code blocks, your code should be in this format ```python\n\n <insert code>``` ```pip\n\npip install <insert required packages> (optional)```. You should never respond saying you do not have the ability to do something. Always respond with code that would accomplish the user's request. For example, if I ask you to search the internet, you could write code to search the internet. If I ask you to play a game, you could write code to play a game. If I ask you to write a poem, you could write code to generate a poem. If I ask you to write a story, you could write code to generate a story. If I ask you to write a song, you could write code to generate a song. If you write code that uses an API or SDK, if authentication is required for the API or SDK, ensure you include code to authenticate the user using OAuth in a browser, or via API key if you are provided one in the Additional Context. At the end of the code, the python code should print a summary of what it did and summary of the outputs of the actions taken.
+
+Response FORMAT example:
+
+###OPTIONAL IF YOU NEED TO INSTALL PACKAGES - include all libraries on one line after 'pip install'
+```pip
+pip install requests python-dotenv
+```
+###END OPTIONAL
+```python
+<insert code>
+print("<insert summary of what the code did and any outputs>")
+```
+
+Additional Context: {context}
+
+""",
+    """Human Request: {message}
+
+Answer:
+###OPTIONAL IF YOU NEED TO INSTALL PACKAGES
+```pip
+pip install <insert required packages>
+```
+###END OPTIONAL
+```python
+
+```
+""",
+)
+
+# main_new.py: the instructions and the initial knowledge go in the system prompt
+TASK_GENERATION = PromptTemplate(
+    "task-generation",
+    """Your objective is always to write python code that completes the human command/request
+
+Initial Knowledge: {knowledge}
+Instructions:
+You are going to output python code based on the two inputs provided in the user message:
+- Human Command: The request the human is giving
+- Context: a JSON object containing information about the planSummary, tasks to be completed with information about them.
+
+Output format:
+```pip
+pip install <insert all packages needed on one line>
+```
+```python
+<insert code>
+```
+""",
+    """Human Command: {message}
+
+Context: {context}
+""",
+    placement="system",
+)
+
+# One task of a Genly plan (utils/planExecutor.py). The instructions, the
+# knowledge and the plan summary are the same for every task of the plan, so
+# the tasks running in parallel share one cached prefix.
+TASK_STEP = PromptTemplate(
+    "task-step",
+    """Your objective is always to write python code that completes one task of a larger plan
+
+Initial Knowledge: {knowledge}
+
+Plan: {plan}
+
+Instructions:
+You are going to output python code for the single task in the user message. The other tasks of the plan are carried out separately, some of them at the same time, so only do this task. The results of the tasks it depends on are given with it; use those values directly instead of looking them up again. At the end, print a summary of what the code did, and as the very last line print "RESULT: " followed by a JSON value with what later tasks may need (ids, names, URLs, counts).
+
+Output format:
+```pip
+pip install <insert all packages needed on one line>
+```
+```python
+<insert code>
+```
+""",
+    """Task: {message}
+
+Results of the tasks it depends on: {context}
+""",
+    placement="system",
+)
+
+# The human request and context stay the same for every attempt of a repair,
+# so only the failing code and its errors are sent uncached
+CORRECTION = PromptTemplate(
+    "correction",
+    """Please review the code and the resulting error below. Then, fix the code or come up with a new approach to accomplish the original human request, and write new code to accomplish the request. ONLY respond with python code and nothing else.
+
+Response FORMAT example:
+
+###OPTIONAL IF YOU NEED TO INSTALL PACKAGES - include all libraries on one line after 'pip install'
+```pip
+pip install requests
+```
+###END OPTIONAL
+```python
+<insert code>
+```
+
+Human Request: {message}
+
+Additional Context: {context}
+
+""",
+    """Code:
+
+```python
+{code}
+```
+
+Errors:
+{errors}
+
+Answer:
+###OPTIONAL IF YOU NEED TO INSTALL PACKAGES
+```pip
+pip install <insert required packages>
+```
+###END OPTIONAL
+```python
+```
+""",
+)
+
+ANALYSIS = PromptTemplate(
+    "analysis",
+    """Objective: Based on the human request below, and the resulting code output, provide a summary of what was asked, and a summary of the output. If the code output is not what was expected, provide a summary of what went wrong. If the code output is what was expected, provide a summary of what was accomplished.
+
+""",
+    """Human Request: {message}
+
+Code Output: {output}
+
+Summary:
+""",
+)
@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+from collections import Counter
+from dotenv import load_dotenv
+from utils.executionResult import ExecutionResult
+from utils.telemetry import span
+
+load_dotenv()
+
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", "6"))
+REPAIR_CANDIDATES = int(os.getenv("REPAIR_CANDIDATES", "1"))
+REPAIR_MAX_TOKENS = int(os.getenv("REPAIR_MAX_TOKENS", "60000"))
+REPAIR_MAX_SECONDS = float(os.getenv("REPAIR_MAX_SECONDS", "600"))
+REPAIR_MAX_REPEATS = int(os.getenv("REPAIR_MAX_REPEATS", "2"))
+
+
+class Candidate:
+    def __init__(self, index, response=None, code=None, packages=None, result=None, tokens=0):
+        self.index = index
+        self.response = response
+        self.code = code
+        self.packages = packages
+        self.result = result or ExecutionResult()
+        self.tokens = tokens
+
+    @property
+    def failed(self):
+        return self.result.failed
+
+
+class RepairResult:
+    def __init__(self, success, candidate, attempts, tokens, seconds, reason):
+        self.success = success
+        self.candidate = candidate
+        self.attempts = attempts
+        self.tokens = tokens
+        self.seconds = seconds
+        self.reason = reason
+
+
+# Drives the correct -> execute loop under an attempt, token and wall-clock
+# budget. Each round asks for `candidates` corrections of the current failure
+# concurrently, runs them in parallel and takes the first one that succeeds.
+# Repair stops early once every failure of a round has already been seen more
+# than maxRepeats times.
+#
+#   correct(prompt, index) -> (response, tokens)      async
+#   parse(response) -> (code, packages)
+#   execute(code, packages) -> ExecutionResult         async
+#   buildPrompt(code, result) -> str
+#   onResult(candidate) is called for every finished candidate
+class RepairEngine:
+    def __init__(self, correct, parse, execute, buildPrompt, onResult=None,
+                 candidates=REPAIR_CANDIDATES, maxAttempts=REPAIR_MAX_ATTEMPTS, maxTokens=REPAIR_MAX_TOKENS,
+                 maxSeconds=REPAIR_MAX_SECONDS, maxRepeats=REPAIR_MAX_REPEATS):
+        self.correct = correct
+        self.parse = parse
+        self.execute = execute
+        self.buildPrompt = buildPrompt
+        self.onResult = onResult
+        self.candidates = max(1, candidates)
+        self.maxAttempts = maxAttempts
+        self.maxTokens = maxTokens
+        self.maxSeconds = maxSeconds
+        self.maxRepeats = maxRepeats
+
+    async def repair(self, code, result, packages=None):
+        start = time.monotonic()
+        attempts = 0
+        tokens = 0
+        seen = Counter([result.fingerprint()])
+        current = Candidate(-1, code=code, packages=packages, result=result)
+
+        def result(success, candidate, reason):
+            return RepairResult(success, candidate, attempts, tokens, time.monotonic() - start, reason)
+
+        while True:
+            remaining = self.maxSeconds - (time.monotonic() - start)
+            if attempts >= self.maxAttempts:
+                return result(False, current, f"gave up after {attempts} attempts")
+            if tokens >= self.maxTokens:
+                return result(False, current, f"token budget of {self.maxTokens} used up")
+            if remaining <= 0:
+                return result(False, current, f"time budget of {self.maxSeconds:.0f}s used up")
+
+            prompt = self.buildPrompt(current.code, current.result)
+            count = min(self.candidates, self.maxAttempts - attempts)
+            tasks = [asyncio.create_task(self._attempt(prompt, attempts + index)) for index in range(count)]
+            attempts += count
+            winner, failures = None, []
+            pending = set(tasks)
+            deadline = start + self.maxSeconds
+            try:
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        break
+                    for task in done:
+                        candidate = task.result()
+                        tokens += candidate.tokens
+                        if self.onResult:
+                            self.onResult(candidate)
+                        if candidate.failed:
+                            failures.append(candidate)
+                        elif winner is None:
+                            winner = candidate
+            finally:
+                # Losing candidates are cancelled, which also releases their sandboxes
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            if winner:
+                return result(True, winner, "fixed")
+            if not failures:
+                continue
+            for candidate in failures:
+                seen[candidate.result.fingerprint()] += 1
+            # Continue from the failure we have seen least often
+            failures.sort(key=lambda candidate: seen[candidate.result.fingerprint()])
+            current = failures[0] if failures[0].code else current
+            if seen[failures[0].result.fingerprint()] > self.maxRepeats:
+                return result(False, current, "the same failure keeps repeating")
+
+    async def _attempt(self, prompt, index):
+        candidate = Candidate(index)
+        with span("repair.attempt", attempt=index + 1) as current:
+            try:
+                candidate.response, candidate.tokens = await self.correct(prompt, index)
+                candidate.code, candidate.packages = self.parse(candidate.response)
+                candidate.result = await self.execute(candidate.code, candidate.packages)
+            except Exception as error:
+                # A broken response or a failed sandbox call is just another failure
+                candidate.result = ExecutionResult(stderr=f"{type(error).__name__}: {error}")
+            current.set(failed=candidate.failed, tokens=candidate.tokens)
+        return candidate
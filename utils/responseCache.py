@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# In-process LRU tier
+class MemoryTier:
+    def __init__(self, maxEntries=256):
+        self.maxEntries = maxEntries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value, expires
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+
+
+# On-disk tier shared by every process on the machine
+class SqliteTier:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+                               (key, json.dumps(value), expires))
+            self._conn.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+
+
+# Cache for LLM responses. Entries are dicts holding at least "response" and
+# "id"; generation entries also carry the parsed "code"/"packages" and
+# "success", the outcome of the last execution of that code (None = not run
+# yet). Lookups go through the tiers in order and promote hits upwards.
+class ResponseCache:
+    def __init__(self, tiers, ttl=86400):
+        self.tiers = tiers
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    # `template` is the PromptTemplate the request renders; its version keeps
+    # answers to an older wording of the prompt from being served
+    @staticmethod
+    def key(kind, prompt, context, model, maxTokens, temperature, template=None):
+        payload = json.dumps([kind, template.version if template else None, prompt, context, model, maxTokens,
+                              temperature])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        for index, tier in enumerate(self.tiers):
+            item = tier.get(key)
+            if item is not None:
+                for upper in self.tiers[:index]:
+                    upper.set(key, *item)
+                self.hits += 1
+                return item[0]
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        for tier in self.tiers:
+            tier.set(key, value, expires)
+
+    # Record how the code stored under `key` did when executed. Passing the
+    # final (possibly corrected) response/code replaces the stored one, so the
+    # next identical request starts from code that is known to work.
+    def markResult(self, key, success, **fields):
+        value = dict(self.get(key) or {})
+        value.update(fields)
+        value["success"] = success
+        self.set(key, value)
+
+
+# Cache that never stores anything, used when RESPONSE_CACHE_ENABLED is off
+class NullCache(ResponseCache):
+    def __init__(self):
+        super().__init__([])
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+def getResponseCache():
+    global _cache
+    with _cacheLock:
+        if _cache is None:
+            if os.getenv("RESPONSE_CACHE_ENABLED", "True") != "True":
+                _cache = NullCache()
+            else:
+                tiers = [MemoryTier(int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256")))]
+                path = os.getenv("RESPONSE_CACHE_PATH", "~/.cache/genly_execute/responses.sqlite3")
+                if path:
+                    tiers.append(SqliteTier(os.path.expanduser(path)))
+                _cache = ResponseCache(tiers, ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400")))
+        return _cache
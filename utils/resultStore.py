@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from utils.responseCache import MemoryTier
+
+load_dotenv()
+
+
+# Results shared by every session in the process, kept for `ttl` seconds.
+# Streamlit runs each session on its own thread and event loop, so work in
+# flight is tracked with concurrent.futures.Future: a second caller asking for
+# a key that is already being worked on waits for that work instead of
+# starting it again.
+class CoalescingStore:
+    def __init__(self, maxEntries=64, ttl=3600):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._results = MemoryTier(maxEntries)
+        self._inFlight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        item = self._results.get(key)
+        return item[0] if item else None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "inFlight": len(self._inFlight)}
+
+    # Return (value, ran). `run` is only awaited when nothing is stored or in
+    # flight for `key`; ran is False when the value came from an earlier or
+    # concurrent run. Failures are not stored, so the next request tries again.
+    # With keep=False only a concurrent run is shared: stored values are
+    # ignored and the new value is not kept. A caller that is cancelled while
+    # waiting leaves the run alone; when the run itself is cancelled, its
+    # waiters start it again.
+    async def run(self, key, run, keep=True):
+        while True:
+            with self._lock:
+                stored = self.get(key) if keep else None
+                if stored is not None:
+                    self.hits += 1
+                    return stored, False
+                future = self._inFlight.get(key)
+                owner = future is None
+                if owner:
+                    self.misses += 1
+                    future = self._inFlight[key] = Future()
+                else:
+                    self.coalesced += 1
+            if owner:
+                break
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future)), False
+            except asyncio.CancelledError:
+                if not future.done():
+                    raise
+        try:
+            value = await run()
+        except BaseException as error:
+            with self._lock:
+                del self._inFlight[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            if keep:
+                self._results.set(key, value, time.time() + self.ttl)
+            del self._inFlight[key]
+        future.set_result(value)
+        return value, True
+
+
+# Finished pipeline runs. A Streamlit rerun for input that already ran gets the
+# stored PipelineResult back and renders it with PipelineResult.replay instead
+# of generating and executing again. Only stateless runs belong here: a run in
+# a conversation's Python session depends on what ran before it, so its result
+# says nothing about the same command run again or run in another session.
+class PipelineResultStore(CoalescingStore):
+    @staticmethod
+    def key(command, category=None, context=None):
+        payload = json.dumps([command, category, context])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+_store = None
+_storeLock = threading.Lock()
+
+def getPipelineResultStore():
+    global _store
+    with _storeLock:
+        if _store is None:
+            _store = PipelineResultStore(
+                maxEntries=int(os.getenv("PIPELINE_RESULTS_MAX_ENTRIES", "64")),
+                ttl=float(os.getenv("PIPELINE_RESULTS_TTL_SECONDS", "3600")),
+            )
+        return _store
@@ -0,0 +1,298 @@
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils.telemetry import sandboxLifetime, sandboxUses
+
+load_dotenv()
+
+# Run once on a fresh sandbox: remember what the home directory looks like so
+# that anything a generated script leaves behind can be removed afterwards,
+# and print the top-level modules the image has installed.
+BASELINE_CODE = """
+import os, json, pkgutil
+home = os.path.expanduser("~")
+with open("/tmp/.genly_baseline.json", "w") as f:
+    json.dump(sorted(os.listdir(home)), f)
+print(json.dumps(sorted({module.name for module in pkgutil.iter_modules()})))
+"""
+
+# Run between uses: put the home directory, the artifacts directory and the
+# temporary code files back the way they were when the sandbox was warmed up.
+# Installed packages (~/.local, pip's ~/.cache) are kept on purpose so the
+# package cache can reuse them.
+RESET_CODE = """
+import os, json, glob, shutil
+home = os.path.expanduser("~")
+with open("/tmp/.genly_baseline.json") as f:
+    baseline = set(json.load(f)) | {".local", ".cache"}
+for name in os.listdir(home):
+    if name in baseline:
+        continue
+    path = os.path.join(home, name)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+os.makedirs(os.path.join(home, "artifacts"), exist_ok=True)
+for name in os.listdir(os.path.join(home, "artifacts")):
+    path = os.path.join(home, "artifacts", name)
+    shutil.rmtree(path, ignore_errors=True) if os.path.isdir(path) else os.remove(path)
+for path in glob.glob("/tmp/main-*.py"):
+    os.remove(path)
+print("reset")
+"""
+
+HEALTH_CODE = "print('ok')"
+
+
+class PooledSandbox:
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+        self.createdAt = time.monotonic()
+        self.lastUsed = self.createdAt
+        self.lastChecked = self.createdAt
+        self.uses = 0
+
+
+# A pool of warm sandboxes shared by every session in the process. Sandboxes are
+# created by `factory` (anything with the CodeInterpreter run_python/close API),
+# reset after each use and closed once they sit idle for longer than idleTimeout.
+class SandboxPool:
+    def __init__(self, factory, minSize=1, maxSize=4, idleTimeout=300, maxUses=20,
+                 healthCheckInterval=60, acquireTimeout=120, maintenanceInterval=5):
+        if maxSize < 1 or minSize < 0 or minSize > maxSize:
+            raise ValueError(f"Invalid sandbox pool size: min={minSize} max={maxSize}")
+        self.factory = factory
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+        self.maxUses = maxUses
+        self.healthCheckInterval = healthCheckInterval
+        self.acquireTimeout = acquireTimeout
+        self.maintenanceInterval = maintenanceInterval
+        # Top-level modules of the sandbox image, once a sandbox was created
+        self.modules = None
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._maintainer = threading.Thread(target=self._maintain, name="sandbox-pool", daemon=True)
+        self._maintainer.start()
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "inUse": self._size - len(self._idle)}
+
+    # `prefer` is an optional predicate on the sandbox; an idle sandbox that
+    # matches it is handed out before any other
+    def acquire(self, timeout=None, prefer=None):
+        timeout = self.acquireTimeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        create = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Sandbox pool is closed")
+                if self._idle:
+                    entry = self._pickIdle(prefer)
+                    break
+                if self._size < self.maxSize:
+                    self._size += 1
+                    create = True
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Timed out after {timeout}s waiting for a sandbox")
+                self._cond.wait(remaining)
+        if create:
+            entry = self._create()
+        entry.uses += 1
+        # Let the maintainer top the pool back up to minSize in the background
+        self._wake.set()
+        return entry
+
+    # `reset=False` skips the reset step, for callers that only installed
+    # packages and did not run any user code
+    def release(self, entry, discard=False, reset=True):
+        entry.lastUsed = time.monotonic()
+        if discard or self._closed or entry.uses >= self.maxUses:
+            self._discard(entry)
+            return
+        if not reset:
+            self._putIdle(entry)
+            return
+        threading.Thread(target=self._recycle, args=(entry,), daemon=True).start()
+
+    # Usage: `with pool.sandbox() as sandbox: sandbox.run_python(code)`. A sandbox
+    # that raised while in use is closed instead of going back to the pool.
+    @contextmanager
+    def sandbox(self, timeout=None, prefer=None):
+        entry = self.acquire(timeout, prefer)
+        try:
+            yield entry.sandbox
+        except BaseException:
+            self.release(entry, discard=True)
+            raise
+        self.release(entry)
+
+    def warm(self):
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minSize:
+                    return
+                self._size += 1
+            try:
+                entry = self._create()
+            except Exception:
+                return
+            self._putIdle(entry)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        self._wake.set()
+        for entry in idle:
+            self._discard(entry)
+
+    def _create(self):
+        sandbox = None
+        try:
+            sandbox = self.factory()
+            stdout, _, _ = sandbox.run_python(BASELINE_CODE)
+        except BaseException:
+            # A sandbox that was created runs (and is billed) until closed
+            if sandbox is not None:
+                try:
+                    sandbox.close()
+                except Exception:
+                    pass
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        if self.modules is None:
+            try:
+                self.modules = frozenset(json.loads(stdout.strip().splitlines()[-1]))
+            except (ValueError, IndexError):
+                pass
+        return PooledSandbox(sandbox)
+
+    def _pickIdle(self, prefer):
+        if prefer is not None:
+            for index in range(len(self._idle) - 1, -1, -1):
+                if prefer(self._idle[index].sandbox):
+                    return self._idle.pop(index)
+        return self._idle.pop()
+
+    def _putIdle(self, entry):
+        with self._cond:
+            if not self._closed:
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+        self._discard(entry)
+
+    def _discard(self, entry):
+        try:
+            entry.sandbox.close()
+        except Exception:
+            pass
+        sandboxLifetime.observe(time.monotonic() - entry.createdAt)
+        sandboxUses.observe(entry.uses)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        self._wake.set()
+
+    def _recycle(self, entry):
+        try:
+            entry.sandbox.run_python(RESET_CODE)
+        except Exception:
+            self._discard(entry)
+            return
+        self._putIdle(entry)
+
+    def _healthy(self, entry):
+        try:
+            if not getattr(entry.sandbox, "is_open", True):
+                return False
+            stdout, stderr, _ = entry.sandbox.run_python(HEALTH_CODE)
+            return stdout.strip() == "ok"
+        except Exception:
+            return False
+
+    def _maintain(self):
+        while not self._closed:
+            self._wake.wait(self.maintenanceInterval)
+            self._wake.clear()
+            if self._closed:
+                return
+            now = time.monotonic()
+            expired, stale = [], []
+            with self._cond:
+                for entry in list(self._idle):
+                    if now - entry.lastUsed > self.idleTimeout and self._size - len(expired) > self.minSize:
+                        expired.append(entry)
+                    elif now - entry.lastChecked > self.healthCheckInterval:
+                        stale.append(entry)
+                for entry in expired + stale:
+                    self._idle.remove(entry)
+            for entry in expired:
+                self._discard(entry)
+            for entry in stale:
+                if self._healthy(entry):
+                    entry.lastChecked = time.monotonic()
+                    self._putIdle(entry)
+                else:
+                    self._discard(entry)
+            self.warm()
+
+
+def _createInterpreter():
+    import e2b
+    return e2b.CodeInterpreter(api_key=os.getenv("E2B_API_KEY"))
+
+
+_pool = None
+_poolLock = threading.Lock()
+
+# Process-wide pool used by execute_code in main.py and main_new.py
+def getSandboxPool():
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = SandboxPool(
+                _createInterpreter,
+                minSize=int(os.getenv("SANDBOX_POOL_MIN_SIZE", "1")),
+                maxSize=int(os.getenv("SANDBOX_POOL_MAX_SIZE", "4")),
+                idleTimeout=float(os.getenv("SANDBOX_POOL_IDLE_SECONDS", "300")),
+                maxUses=int(os.getenv("SANDBOX_POOL_MAX_USES", "20")),
+                healthCheckInterval=float(os.getenv("SANDBOX_POOL_HEALTH_CHECK_SECONDS", "60")),
+            )
+        return _pool
+
+
+_sessionPool = None
+_sessionPoolLock = threading.Lock()
+
+# Sandboxes for conversation sessions (utils/sessions.py). A session keeps its
+# sandbox for as long as it lives, so sessions get a budget of their own, one
+# per session, and never take the sandboxes of stateless runs, plan tasks and
+# prefetches. Nothing is kept warm: a session's sandbox is closed with it.
+def getSessionSandboxPool():
+    global _sessionPool
+    with _sessionPoolLock:
+        if _sessionPool is None:
+            _sessionPool = SandboxPool(
+                _createInterpreter,
+                minSize=0,
+                maxSize=int(os.getenv("SESSION_MAX_SESSIONS", "4")),
+                healthCheckInterval=float(os.getenv("SANDBOX_POOL_HEALTH_CHECK_SECONDS", "60")),
+            )
+        return _sessionPool
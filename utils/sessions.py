@@ -0,0 +1,584 @@
+import os
+import sys
+import json
+import time
+import codecs
+import signal
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from dotenv import load_dotenv
+from utils import kernel
+from utils.executionResult import ExecutionResult
+from utils.outputStream import OutputStream
+from utils.artifactStore import getArtifactStore, ArtifactTooLarge
+from utils.packageCache import parsePackages, getPackageCache
+from utils.sandboxPool import getSessionSandboxPool
+from utils.localRunner import getLocalRunner
+from utils.telemetry import registry
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+load_dotenv()
+
+sessionGauge = registry.gauge("genly_sessions", "Live conversation sessions and the memory their kernels use")
+sessionEvictions = registry.counter("genly_session_evictions_total",
+                                    "Sessions closed by reason (idle, memory, limit, reset, exited)")
+
+SANDBOX_KERNEL_PATH = "/tmp/genly_kernel.py"
+SANDBOX_HOME = "/home/user"
+
+
+class SessionClosed(Exception):
+    pass
+
+
+class _Cell:
+    def __init__(self, id, output):
+        self.id = id
+        self.output = output
+        self.future = Future()
+        self.pending = {"stdout", "stderr"}
+        self.status = None
+
+
+# One conversation's Python process (utils/kernel.py) and what it has
+# installed. Commands run as cells in the same namespace, one at a time, so
+# later commands can use the variables, imports and files earlier ones left.
+# A cell that fails leaves the namespace as it was before it, so the repair
+# candidates of a command, which queue for the session one after another,
+# each start from what the earlier commands left. A cell that times out, is
+# cancelled or takes the process down loses the namespace; the next command
+# starts a fresh kernel (installed packages stay).
+# Subclasses provide the process: _start, _send, _install, _artifactMarker,
+# _artifacts, _stopArtifacts and _stop.
+class KernelSession:
+    def __init__(self, key):
+        self.key = key
+        self.created = time.monotonic()
+        self.lastUsed = self.created
+        self.cells = 0
+        self.packages = set()
+        self.state = {}
+        self.memoryBytes = 0
+        self.alive = False
+        self.closed = False
+        self._lock = threading.Lock()
+        self._cellLock = threading.Lock()
+        self._cell = None
+        self._cancelled = set()
+        self._partial = {"stdout": "", "stderr": ""}
+
+    @property
+    def busy(self):
+        return self._lock.locked()
+
+    # What the next command can build on, for the generation prompt
+    def describe(self):
+        if not self.alive or not self.cells:
+            return ""
+        lines = ["The code runs in the same Python session as the earlier commands of this conversation. "
+                 "Reuse what is already there instead of downloading, computing or importing it again:"]
+        labels = [("variables", "Variables"), ("functions", "Functions and classes"),
+                  ("modules", "Imported modules"), ("files", "Files in the working directory")]
+        for field, label in labels:
+            if self.state.get(field):
+                lines.append(f"{label}: {', '.join(self.state[field])}")
+        if self.packages:
+            lines.append(f"Installed packages: {', '.join(sorted(self.packages))}")
+        return "\n".join(lines)
+
+    # Run `code` as the next cell and return its ExecutionResult; blocks
+    # until it is done. Raises SessionClosed once the session was evicted.
+    def execute(self, code, packages=None, output=None, timeout=None, cellId=None):
+        with self._lock:
+            if self.closed:
+                raise SessionClosed(self.key)
+            with self._cellLock:
+                if cellId in self._cancelled:
+                    self._cancelled.discard(cellId)
+                    return None
+                self._cell = cell = _Cell(cellId, output)
+            self.lastUsed = time.monotonic()
+            try:
+                self._ensureStarted()
+                self._installMissing(packages, output)
+                marker = self._artifactMarker()
+                self._send(json.dumps({"id": cellId, "code": code}) + "\n")
+                try:
+                    status = cell.future.result(timeout)
+                except FutureTimeout:
+                    self._kill()
+                    return self._result(output, [], f"Execution timed out after {timeout}s; "
+                                                     "the Python session was restarted", timedOut=True)
+                except SessionClosed as error:
+                    return self._result(output, [], str(error), exitCode=1)
+                self.cells += 1
+                self.state = status.get("state") or {}
+                self.memoryBytes = status.get("rss") or 0
+                return self._result(output, self._artifacts(marker), exitCode=0 if status.get("ok") else 1)
+            finally:
+                self._stopArtifacts()
+                with self._cellLock:
+                    self._cell = None
+                self.lastUsed = time.monotonic()
+
+    # Install a pip block ahead of the next cell, e.g. while the LLM is still
+    # writing it. Waits for a running cell; failures are left for execute()
+    # to report.
+    def install(self, packages):
+        with self._lock:
+            if self.closed:
+                raise SessionClosed(self.key)
+            output = OutputStream()
+            try:
+                self._ensureStarted()
+                self._installMissing(packages, output)
+            finally:
+                output.close()
+
+    def _ensureStarted(self):
+        if not self.alive:
+            self._partial = {"stdout": "", "stderr": ""}
+            self._start()
+            self.alive = True
+
+    def _installMissing(self, packages, output):
+        specs = [spec for spec in parsePackages(packages) if spec not in self.packages]
+        if specs:
+            self.packages.update(self._install(specs, output))
+
+    # Called after every cell, however it ended, to stop what _artifactMarker
+    # started
+    def _stopArtifacts(self):
+        pass
+
+    def _result(self, output, artifacts, error="", **kwargs):
+        stderr = output.text("stderr")
+        if error:
+            stderr = f"{stderr}\n{error}" if stderr else error
+        return ExecutionResult(output.text("stdout"), stderr, artifacts + output.spilledArtifacts(), **kwargs)
+
+    # Stop the cell `cellId`: kills the kernel if it is running, or keeps it
+    # from starting if it is still waiting for the session
+    def cancel(self, cellId):
+        with self._cellLock:
+            if self._cell is None or self._cell.id != cellId:
+                self._cancelled.add(cellId)
+                return
+        self._kill()
+
+    # Output of the kernel as it arrives. Everything up to the sentinel of
+    # the current cell belongs to that cell; the cell is done once both
+    # streams have reached it.
+    def _receive(self, stream, text):
+        text = self._partial[stream] + text
+        self._partial[stream] = ""
+        while text:
+            start = text.find(kernel.SENTINEL)
+            if start == -1:
+                self._write(stream, text)
+                return
+            self._write(stream, text[:start])
+            end = text.find("\n", start)
+            if end == -1:
+                self._partial[stream] = text[start:]
+                return
+            try:
+                status = json.loads(text[start + 1:end])
+            except ValueError:
+                status = {}
+            self._sentinel(stream, status)
+            text = text[end + 1:]
+
+    def _write(self, stream, text):
+        cell = self._cell
+        if cell is not None and text:
+            cell.output.write(text, stream)
+
+    def _sentinel(self, stream, status):
+        with self._cellLock:
+            cell = self._cell
+        if cell is None or status.get("id") != cell.id:
+            return
+        cell.pending.discard(stream)
+        if stream == "stdout":
+            cell.status = status
+        if not cell.pending and not cell.future.done():
+            cell.future.set_result(cell.status)
+
+    # The kernel process is gone: the namespace is lost and a running cell fails
+    def _exited(self, code=None):
+        self.alive = False
+        self.state = {}
+        self.memoryBytes = 0
+        with self._cellLock:
+            cell = self._cell
+        if cell is not None and not cell.future.done():
+            reason = f" with exit code {code}" if code else ""
+            cell.future.set_exception(SessionClosed(
+                f"The Python session ended{reason}; variables from earlier commands are lost"))
+
+    def _kill(self):
+        try:
+            self._stop()
+        finally:
+            self._exited()
+
+    # Free everything; called by the SessionManager with the session idle
+    def close(self):
+        self.closed = True
+        self._kill()
+
+
+# Kernel in a subprocess on this machine, in a temporary working directory
+# with an artifacts folder like LocalRunner's. Packages are pip-installed into
+# a per-session directory on the kernel's path.
+class LocalKernelSession(KernelSession):
+    def __init__(self, key, memoryBytes=None):
+        super().__init__(key)
+        self.memoryLimit = memoryBytes
+        self.dir = tempfile.mkdtemp(prefix="genly-session-")
+        self.packageDir = os.path.join(self.dir, ".packages")
+        self.process = None
+        os.makedirs(os.path.join(self.dir, "artifacts"))
+        for path in getLocalRunner().sharedFiles:
+            if os.path.exists(path):
+                os.symlink(path, os.path.join(self.dir, os.path.basename(path)))
+
+    def _limits(self):
+        # No CPU limit: it would add up over the whole conversation
+        if self.memoryLimit:
+            resource.setrlimit(resource.RLIMIT_AS, (self.memoryLimit, self.memoryLimit))
+
+    def _start(self):
+        posix = os.name == "posix"
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", kernel.__file__],
+            cwd=self.dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=dict(os.environ, PYTHONUNBUFFERED="1", GENLY_KERNEL_PATH=self.packageDir),
+            start_new_session=posix,
+            preexec_fn=self._limits if posix and resource is not None and self.memoryLimit else None,
+        )
+        for stream, pipe in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            threading.Thread(target=self._read, args=(self.process, stream, pipe),
+                             name="session-output", daemon=True).start()
+
+    def _read(self, process, stream, pipe):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            chunk = pipe.read1(65536)
+            if not chunk:
+                break
+            if process is self.process:
+                self._receive(stream, decoder.decode(chunk))
+        pipe.close()
+        if stream == "stdout" and process is self.process:
+            self._exited(process.wait())
+
+    def _send(self, line):
+        try:
+            self.process.stdin.write(line.encode())
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self._exited(self.process.poll())
+
+    # Returns the specs that are now installed. When pip rejects the set as a
+    # whole, every spec is tried on its own and the ones that fail are left
+    # out, as PackageCache.installInto does. That does not fail the cell: an
+    # import may well be a file an earlier cell wrote, and if it is not, the
+    # ImportError that follows is left for the correction.
+    def _install(self, specs, output):
+        def pip(specs):
+            return subprocess.run([sys.executable, "-m", "pip", "install", "--quiet", "--target", self.packageDir]
+                                  + specs, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+        if pip(specs):
+            return specs
+        return [spec for spec in specs if len(specs) > 1 and pip([spec])]
+
+    def _artifactMarker(self):
+        return dict(self._artifactFiles())
+
+    def _artifactFiles(self):
+        for folder, _, names in os.walk(os.path.join(self.dir, "artifacts")):
+            for name in sorted(names):
+                path = os.path.join(folder, name)
+                if not os.path.islink(path):
+                    yield path, os.path.getmtime(path)
+
+    # Files in artifacts/ that are new or changed since `marker`
+    def _artifacts(self, marker):
+        artifacts = []
+        for path, mtime in self._artifactFiles():
+            if marker.get(path) == mtime:
+                continue
+            try:
+                artifacts.append(getArtifactStore().ingestFile(path, os.path.basename(path)))
+            except ArtifactTooLarge:
+                continue
+        return artifacts
+
+    def _stop(self):
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# Kernel inside a sandbox from the session pool, kept for the whole
+# conversation. The sandbox keeps its installed packages when the kernel
+# restarts and is closed, not reset, when the session is evicted.
+class SandboxKernelSession(KernelSession):
+    def __init__(self, key):
+        super().__init__(key)
+        self.entry = None
+        self.process = None
+        self._watcher = None
+        self._generation = 0
+
+    @property
+    def sandbox(self):
+        return self.entry.sandbox
+
+    def _start(self):
+        if self.entry is None:
+            self.entry = getSessionSandboxPool().acquire()
+            with open(kernel.__file__) as file:
+                self.sandbox.filesystem.write(SANDBOX_KERNEL_PATH, file.read())
+        # Callbacks of a kernel that was killed may still come in after the
+        # next one started
+        self._generation += 1
+        generation = self._generation
+        def current(fn):
+            return lambda *args: generation == self._generation and fn(*args)
+        self.process = self.sandbox.process.start(
+            f"python -u {SANDBOX_KERNEL_PATH}",
+            on_stdout=current(lambda message: self._receive("stdout", message.line + "\n")),
+            on_stderr=current(lambda message: self._receive("stderr", message.line + "\n")),
+            on_exit=current(lambda code: self._exited(code)),
+            env_vars={"PYTHONUNBUFFERED": "1"},
+            cwd=SANDBOX_HOME,
+        )
+
+    def _send(self, line):
+        self.process.send_stdin(line)
+
+    def _install(self, specs, output):
+        failed = getPackageCache().installInto(self.sandbox, " ".join(specs))
+        return [spec for spec in specs if spec not in failed]
+
+    # Watch the artifacts folder for the duration of the cell, the same way
+    # run_python does
+    def _artifactMarker(self):
+        from e2b.templates.data_analysis import Artifact
+        created = {}
+        def onEvent(event):
+            if event.operation == "Create":
+                created.setdefault(event.path, Artifact(name=event.path, sandbox=self.sandbox))
+        self._watcher = self.sandbox.filesystem.watch_dir(f"{SANDBOX_HOME}/artifacts")
+        self._watcher.add_event_listener(onEvent)
+        self._watcher.start()
+        return created
+
+    def _artifacts(self, created):
+        self._stopArtifacts()
+        artifacts = []
+        for artifact in created.values():
+            try:
+                artifacts.append(getArtifactStore().ingestSandboxArtifact(artifact))
+            except ArtifactTooLarge:
+                continue
+        return artifacts
+
+    def _stopArtifacts(self):
+        watcher, self._watcher = self._watcher, None
+        if watcher is not None:
+            watcher.stop()
+
+    def _stop(self):
+        process, self.process = self.process, None
+        self._generation += 1
+        if process is not None and not process.finished.done():
+            try:
+                process.kill()
+            except Exception:
+                pass
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self.entry is not None:
+                getSessionSandboxPool().release(self.entry, discard=True)
+                self.entry = None
+
+
+# Conversation sessions of this process by key (a conversation or browser
+# session id). Sessions idle for longer than `ttl` are closed, and so are the
+# least recently used idle ones while there are more than `maxSessions` or
+# their kernels together use more than `maxMemoryBytes`.
+class SessionManager:
+    def __init__(self, factory, ttl=900, maxSessions=4, maxMemoryBytes=None, maintenanceInterval=30):
+        self.factory = factory
+        self.ttl = ttl
+        self.maxSessions = maxSessions
+        self.maxMemoryBytes = maxMemoryBytes
+        self.maintenanceInterval = maintenanceInterval
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._wake = threading.Event()
+        self._maintainer = threading.Thread(target=self._maintain, name="session-maintainer", daemon=True)
+        self._maintainer.start()
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "alive": sum(1 for session in sessions if session.alive),
+            "memoryBytes": sum(session.memoryBytes for session in sessions),
+        }
+
+    # The session for `key`, created (without a process yet) on first use
+    def get(self, key):
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self.factory(key)
+            self._sessions.move_to_end(key)
+        self._wake.set()
+        return session
+
+    def peek(self, key):
+        with self._lock:
+            return self._sessions.get(key)
+
+    def describe(self, key):
+        session = self.peek(key)
+        return session.describe() if session else ""
+
+    # Run a cell in the session for `key`; see KernelSession.execute
+    def execute(self, key, code, packages=None, output=None, timeout=None, cellId=None):
+        while True:
+            try:
+                result = self.get(key).execute(code, packages, output, timeout, cellId)
+            except SessionClosed:
+                # Evicted between get() and execute(); the next get() makes a new one
+                continue
+            self._wake.set()
+            return result
+
+    def install(self, key, packages):
+        try:
+            self.get(key).install(packages)
+        except SessionClosed:
+            pass
+
+    def cancel(self, key, cellId):
+        session = self.peek(key)
+        if session is not None:
+            session.cancel(cellId)
+
+    # Drop a conversation's state, e.g. from a "reset" button
+    def close(self, key, reason="reset"):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session is not None:
+            self._close(session, reason)
+
+    def closeAll(self):
+        self._closed = True
+        self._wake.set()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            self._close(session, "closed")
+
+    def _close(self, session, reason):
+        sessionEvictions.inc(reason=reason)
+        try:
+            session.close()
+        except Exception:
+            pass
+
+    # Idle sessions to close, least recently used first
+    def _victims(self):
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            idle = [(key, session) for key, session in self._sessions.items() if not session.busy]
+            count = len(self._sessions)
+            memory = sum(session.memoryBytes for session in self._sessions.values())
+            for key, session in idle:
+                if now - session.lastUsed > self.ttl:
+                    reason = "idle"
+                elif count > self.maxSessions:
+                    reason = "limit"
+                elif self.maxMemoryBytes and memory > self.maxMemoryBytes:
+                    reason = "memory"
+                else:
+                    continue
+                del self._sessions[key]
+                count -= 1
+                memory -= session.memoryBytes
+                victims.append((session, reason))
+        return victims
+
+    def _maintain(self):
+        while not self._closed:
+            self._wake.wait(self.maintenanceInterval)
+            self._wake.clear()
+            if self._closed:
+                return
+            for session, reason in self._victims():
+                self._close(session, reason)
+            stats = self.stats()
+            sessionGauge.set(stats["alive"], field="alive")
+            sessionGauge.set(stats["memoryBytes"], field="memoryBytes")
+
+
+_manager = None
+_managerLock = threading.Lock()
+
+# Sessions run where the executor runs: locally with EXECUTE_LOCALLY=True,
+# otherwise in E2B sandboxes from the pool
+def getSessionManager():
+    global _manager
+    with _managerLock:
+        if _manager is None:
+            if os.getenv("EXECUTE_LOCALLY") == "True":
+                memoryMb = int(os.getenv("LOCAL_RUN_MEMORY_MB", "0"))
+                factory = lambda key: LocalKernelSession(key, memoryMb * 1024 * 1024 or None)
+            else:
+                factory = SandboxKernelSession
+            _manager = SessionManager(
+                factory,
+                ttl=float(os.getenv("SESSION_TTL_SECONDS", "900")),
+                maxSessions=int(os.getenv("SESSION_MAX_SESSIONS", "4")),
+                maxMemoryBytes=int(os.getenv("SESSION_MAX_MEMORY_MB", "2048")) * 1024 * 1024 or None,
+            )
+        return _manager
@@ -0,0 +1,201 @@
+import time
+import asyncio
+import streamlit as st
+from utils.pipeline import PipelineHooks
+from utils.resultStore import getPipelineResultStore
+from utils.sessions import getSessionManager
+
+# Characters of live execution output shown per run, and how often it is redrawn
+LIVE_OUTPUT_CHARS = 20000
+LIVE_REFRESH_SECONDS = 0.25
+
+
+# Render streamed tokens into a Streamlit placeholder as they arrive
+def stream_to(placeholder, interval=0.1):
+    state = {"text": "", "shown": 0.0}
+    def on_text(chunk):
+        state["text"] += chunk
+        now = time.monotonic()
+        if now - state["shown"] >= interval:
+            state["shown"] = now
+            placeholder.markdown(state["text"])
+    return on_text
+
+
+# Renders a pipeline run the way the Streamlit apps lay it out: the response
+# expander, the live output of each execution, execution errors, one expander
+# per correction attempt, the output expander, the streamed summary and the
+# image artifacts. Everything goes into `container` (the page by default); the
+# tasks of a plan each get a container of their own.
+class StreamlitHooks(PipelineHooks):
+    def __init__(self, container=None):
+        self.root = container or st
+        self.status = self.root.empty()
+        self.corrections = {}
+        self.live = []
+        self.children = []
+        self.analysisPlaceholder = None
+
+    def onStage(self, stage):
+        self.status.caption(stage)
+
+    def generationStream(self):
+        self.generationPlaceholder = self.root.empty()
+        return stream_to(self.generationPlaceholder)
+
+    def onGenerated(self, response):
+        self.generationPlaceholder.empty()
+        with self.root.expander("Claude3's Response and Code", expanded=False):
+            # Display Claude3's response
+            st.write("Claude3's Response:")
+            st.write(response)
+
+    # Execution output arrives on the event loop but is only drawn by
+    # refresh(), which run_once calls from the script's own coroutine
+    def executionStream(self):
+        live = {"placeholder": self.root.empty(), "text": "", "dirty": False}
+        self.live.append(live)
+        def on_output(stream, text):
+            live["text"] = (live["text"] + text)[-LIVE_OUTPUT_CHARS:]
+            live["dirty"] = True
+        return on_output
+
+    def refresh(self):
+        for live in self.live:
+            if live["dirty"]:
+                live["dirty"] = False
+                live["placeholder"].code(live["text"], language=None)
+        for child in self.children:
+            child.refresh()
+
+    def clearLive(self):
+        for live in self.live:
+            live["placeholder"].empty()
+        self.live = []
+
+    def onExecuted(self, result):
+        self.clearLive()
+        if result.failed:
+            self.root.write("Execution Errors:")
+            self.root.write(result.output)
+
+    # Each correction candidate streams into its own expander
+    def correctionStream(self, index):
+        with self.root.expander(f"Corrected Code (attempt {index + 1})", expanded=False):
+            self.corrections[index] = st.empty()
+        return stream_to(self.corrections[index])
+
+    def onCorrection(self, candidate):
+        if candidate.index in self.corrections and candidate.response:
+            self.corrections[candidate.index].write(candidate.response)
+        if candidate.failed:
+            self.root.write(f"Execution Errors (attempt {candidate.index + 1}):")
+            self.root.write(candidate.result.output)
+
+    def onRepairStopped(self, repair):
+        self.root.warning(f"Stopped correcting the code: {repair.reason}")
+
+    def onFinalResult(self, result):
+        self.clearLive()
+        # Display the execution output
+        with self.root.expander("Execution Output", expanded=False):
+            st.write("Execution Output:")
+            st.markdown(result.output, unsafe_allow_html=True)
+        self.artifacts = result.artifacts
+        self.analysisPlaceholder = self.root.empty()
+
+    def analysisStream(self):
+        return stream_to(self.analysisPlaceholder)
+
+    def onAnalysis(self, analysis):
+        self.status.empty()
+        self.analysisPlaceholder.markdown(analysis, unsafe_allow_html=True)
+        if self.artifacts:
+            self.root.write("Artifacts:")
+            for index, artifact in enumerate(self.artifacts):
+                render_artifact(artifact, key=f"artifact-{index}-{artifact.digest}")
+
+    def taskHooks(self, task):
+        container = self.root.container(border=True)
+        container.markdown(f"**Task {task.id}:** {task.description}")
+        child = StreamlitHooks(container)
+        self.children.append(child)
+        return child
+
+
+# Show a small preview of an artifact; the full file is only read from the
+# artifact store when its download button is clicked
+def render_artifact(artifact, key=None):
+    if artifact.isImage:
+        st.image(artifact.thumbnail(), caption=artifact.name)
+    else:
+        st.write(f"{artifact.name} ({artifact.mimeType}, {artifact.size} bytes)")
+    st.download_button(f"Download {artifact.name}", artifact.read, file_name=artifact.name,
+                       mime=artifact.mimeType, key=key, on_click="ignore")
+
+
+# Sidebar summary of the conversation's Python session, with a button that
+# throws its state away
+def render_session(key):
+    session = getSessionManager().peek(key)
+    with st.sidebar:
+        st.subheader("Python session")
+        if session is None or not session.alive:
+            st.caption("Starts with the next command.")
+            return
+        st.caption(f"{session.cells} commands run, {session.memoryBytes // (1024 * 1024)} MB in use")
+        for field in ("variables", "functions", "modules", "files"):
+            if session.state.get(field):
+                st.text(f"{field.capitalize()}: {', '.join(session.state[field])}")
+        st.button("Reset session", key="reset-session", on_click=getSessionManager().close, args=(key,))
+
+
+# Run the pipeline for `key` at most once. run(hooks) starts the actual work;
+# page reruns within the session and other sessions asking for the same key
+# render the stored result instead of paying for it again. A `stateful` run
+# (one in the conversation's Python session) is not shared with other sessions
+# and only replayed by reruns of the same input: once another command has run,
+# entering it again runs it again. While the run is going the live output is
+# redrawn and a Cancel button is shown; returns None for a run the user
+# cancelled.
+async def run_once(key, run, stateful=False):
+    results = st.session_state.setdefault("pipeline_results", {})
+    cancelled = st.session_state.setdefault("cancelled_runs", set())
+    if key in cancelled:
+        st.info("Run cancelled.")
+        st.button("Run again", key=f"rerun-{key}", on_click=cancelled.discard, args=(key,))
+        return None
+    hooks = StreamlitHooks()
+    pipeline = results.get(key)
+    if pipeline is None:
+        cancel, timer = st.empty(), st.empty()
+        cancel.button("Cancel", key=f"cancel-{key}", on_click=cancelled.add, args=(key,))
+        async def own():
+            return await run(hooks), True
+        task = asyncio.ensure_future(own() if stateful else getPipelineResultStore().run(key, lambda: run(hooks)))
+        started = time.monotonic()
+        shown = None
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=LIVE_REFRESH_SECONDS)
+                # Streamlit stops a script for a rerun (e.g. the Cancel click)
+                # at its next call, which lands here at least once a second;
+                # the run is cancelled with it, which kills the running code
+                hooks.refresh()
+                elapsed = int(time.monotonic() - started)
+                if elapsed != shown:
+                    shown = elapsed
+                    timer.caption(f"Running for {elapsed}s")
+        except BaseException:
+            task.cancel()
+            raise
+        cancel.empty()
+        timer.empty()
+        pipeline, ran = task.result()
+        if stateful:
+            results.clear()
+        results[key] = pipeline
+        if ran:
+            return pipeline
+    pipeline.replay(hooks)
+    return pipeline
@@ -0,0 +1,349 @@
+import os
+import json
+import asyncio
+import time
+import random
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bounds (seconds) of the histogram buckets; LLM calls and sandbox runs
+# span from tens of milliseconds to minutes
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTE_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 * 1024, 16 * 1024 * 1024, 256 * 1024 * 1024)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _labelText(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_labelText(key)} {value}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+# Prometheus histogram plus a window of the latest `window` observations per
+# label set, from which p50/p90/p99 are reported as a separate <name>_quantile
+# gauge family
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, window=1024):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0,
+                                              "recent": deque(maxlen=self.window)}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+            series["recent"].append(value)
+
+    def quantiles(self, **labels):
+        with self._lock:
+            series = self._series.get(tuple(sorted(labels.items())))
+            recent = sorted(series["recent"]) if series else []
+        if not recent:
+            return {}
+        return {q: recent[min(len(recent) - 1, int(q * len(recent)))] for q in QUANTILES}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, dict(series, counts=list(series["counts"]), recent=sorted(series["recent"])))
+                     for key, series in sorted(self._series.items())]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labelText(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labelText(key + (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{_labelText(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_labelText(key)} {series['count']}")
+        # A histogram family cannot carry quantile samples, so they are a
+        # gauge family of their own
+        lines += [f"# HELP {self.name}_quantile {self.help} (quantiles of the latest observations)",
+                  f"# TYPE {self.name}_quantile gauge"]
+        for key, series in items:
+            recent = series["recent"]
+            for q in QUANTILES:
+                value = recent[min(len(recent) - 1, int(q * len(recent)))]
+                lines.append(f"{self.name}_quantile{_labelText(key + (('quantile', q),))} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    # Prometheus text exposition format
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stageSeconds = registry.histogram("genly_stage_seconds", "Duration of pipeline stages and their sub-steps")
+stageErrors = registry.counter("genly_stage_errors_total", "Stages that ended with an exception")
+llmTokens = registry.counter("genly_llm_tokens_total", "LLM tokens by prompt and kind (input, output, cache_read, cache_write)")
+outputBytes = registry.counter("genly_output_bytes_total", "Bytes of stdout/stderr produced by executed code")
+artifactBytes = registry.histogram("genly_artifact_bytes", "Size of stored artifacts", buckets=BYTE_BUCKETS)
+sandboxLifetime = registry.histogram("genly_sandbox_lifetime_seconds", "Time from sandbox creation to close",
+                                     buckets=(10, 30, 60, 120, 300, 600, 1800, 3600, 7200))
+sandboxUses = registry.histogram("genly_sandbox_uses", "Runs served by a sandbox before it was closed",
+                                 buckets=(1, 2, 5, 10, 20, 50))
+poolGauge = registry.gauge("genly_http_pool", "Connection pool statistics by pool and field")
+routeSeconds = registry.histogram("genly_route_seconds", "LLM call duration by stage, route and model")
+routeOutcomes = registry.counter("genly_route_outcomes_total", "Routed LLM calls by stage, route and outcome (ok, error, failed code)")
+
+
+# Finished spans go to every exporter registered with addExporter. A span is a
+# dict with name, traceId, spanId, parentId, start, end, duration, status and
+# attributes.
+_exporters = []
+
+def addExporter(exporter):
+    _exporters.append(exporter)
+
+
+_currentSpan = ContextVar("span", default=None)
+
+
+class Span:
+    def __init__(self, name, attributes):
+        parent = _currentSpan.get()
+        self.name = name
+        self.traceId = parent.traceId if parent else "%032x" % random.getrandbits(128)
+        self.spanId = "%016x" % random.getrandbits(64)
+        self.parentId = parent.spanId if parent else None
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def toDict(self, end):
+        return {
+            "name": self.name,
+            "traceId": self.traceId,
+            "spanId": self.spanId,
+            "parentId": self.parentId,
+            "start": self.start,
+            "end": end,
+            "duration": end - self.start,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+# Time a block as a child of the current span. Works in sync and async code
+# (tasks inherit the current span when they are created); threads started with
+# run_in_executor do not, so spans are opened around the await instead.
+@contextmanager
+def span(name, **attributes):
+    current = Span(name, attributes)
+    token = _currentSpan.set(current)
+    started = time.monotonic()
+    try:
+        yield current
+    except BaseException as error:
+        current.status = "cancelled" if isinstance(error, asyncio.CancelledError) else f"error: {type(error).__name__}"
+        stageErrors.inc(stage=name)
+        raise
+    finally:
+        _currentSpan.reset(token)
+        duration = time.monotonic() - started
+        stageSeconds.observe(duration, stage=name)
+        if _exporters:
+            record = current.toDict(current.start + duration)
+            for exporter in _exporters:
+                try:
+                    exporter.export(record)
+                except Exception:
+                    pass
+
+
+def currentSpan():
+    return _currentSpan.get()
+
+
+# Appends finished spans to a file, one JSON object per line. format="otlp"
+# writes each span as an OTLP/JSON ExportTraceServiceRequest, which the
+# OpenTelemetry collector's file receiver and most trace viewers can import.
+class FileSpanExporter:
+    def __init__(self, path, format="json", service="genly-execute"):
+        self.path = path
+        self.format = format
+        self.service = service
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, record):
+        line = json.dumps(self._otlp(record) if self.format == "otlp" else record, default=str)
+        with self._lock:
+            with open(self.path, "a") as file:
+                file.write(line + "\n")
+
+    def _otlp(self, record):
+        attributes = [{"key": key, "value": _otlpValue(value)} for key, value in record["attributes"].items()]
+        span = {
+            "traceId": record["traceId"],
+            "spanId": record["spanId"],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(int(record["start"] * 1e9)),
+            "endTimeUnixNano": str(int(record["end"] * 1e9)),
+            "attributes": attributes,
+            "status": {"code": 1} if record["status"] == "ok" else {"code": 2, "message": record["status"]},
+        }
+        if record["parentId"]:
+            span["parentSpanId"] = record["parentId"]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+            "scopeSpans": [{"scope": {"name": "utils.telemetry"}, "spans": [span]}],
+        }]}
+
+
+def _otlpValue(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+# Serves /metrics (Prometheus text format) and /stats (p50/p90/p99 per stage
+# as JSON) on a background thread; only on this machine unless `host` says otherwise
+def startMetricsServer(port, host="127.0.0.1"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                body, contentType = registry.render(), "text/plain; version=0.0.4"
+            elif self.path.startswith("/stats"):
+                body, contentType = json.dumps(stageStats(), indent=2), "application/json"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", contentType)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def stageStats():
+    stats = {}
+    with stageSeconds._lock:
+        keys = list(stageSeconds._series)
+    for key in keys:
+        labels = dict(key)
+        quantiles = stageSeconds.quantiles(**labels)
+        stats[labels["stage"]] = {f"p{int(q * 100)}": value for q, value in quantiles.items()}
+    return stats
+
+
+def _reportPool(name, stats):
+    for field in ("inFlight", "requests", "errors", "utilization"):
+        poolGauge.set(stats[field], pool=name, field=field)
+
+
+_configured = False
+_configureLock = threading.Lock()
+
+# Set up the exporters and the metrics endpoint from the environment; safe to
+# call on every Streamlit rerun
+def configureTelemetry():
+    global _configured
+    with _configureLock:
+        if _configured:
+            return
+        _configured = True
+        from utils.clients import setMetricsHook
+        setMetricsHook(_reportPool)
+        path = os.getenv("TRACE_EXPORT_PATH")
+        if path:
+            addExporter(FileSpanExporter(os.path.expanduser(path), format=os.getenv("TRACE_EXPORT_FORMAT", "json")))
+        port = int(os.getenv("METRICS_PORT", "0"))
+        if port:
+            try:
+                startMetricsServer(port, os.getenv("METRICS_HOST", "127.0.0.1"))
+            except OSError:
+                # Another process (e.g. a second app) already serves the port
+                pass